@@ -1,36 +1,700 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Request
+from fastapi.routing import APIRoute
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 import uuid
 from datetime import datetime
 import openai
 import json
+import random
+import re
 import asyncio
-from collections import defaultdict
+import bisect
+import hashlib
+import threading
+import time
+import warnings
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from functools import lru_cache, wraps
 import numpy as np
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Slow-query log
+# A command listener records find/aggregate/count/distinct commands slower than
+# SLOW_QUERY_MS under their filter shape (values replaced by type names). The first
+# time a shape turns up slow, explain("executionStats") is captured in the background
+# so the admin endpoint can show keys examined versus documents returned.
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '100'))
+SLOW_QUERY_MAX_SHAPES = int(os.environ.get('SLOW_QUERY_MAX_SHAPES', '200'))
+SLOW_QUERY_COMMANDS = ("find", "aggregate", "count", "distinct")
+# Filter-like command fields that make up a shape
+SLOW_QUERY_SHAPE_FIELDS = ("filter", "query", "sort", "pipeline", "key")
+# Session and transport fields the driver adds, which explain rejects
+SLOW_QUERY_DRIVER_FIELDS = ("lsid", "txnNumber", "autocommit", "startTransaction", "readConcern", "writeConcern",
+                            "apiVersion", "apiStrict", "apiDeprecationErrors")
+
+def query_shape(value: Any) -> Any:
+    """Replace literal values with their type names, keeping field names and operators"""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if value and all(isinstance(item, dict) for item in value):
+            return [query_shape(item) for item in value]
+        return "array"
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return "number"
+    return type(value).__name__
+
+def summarize_explain(explain: Dict[str, Any]) -> Dict[str, Any]:
+    """Pull executionStats and the winning plan's stages out of an explain reply"""
+    stats, stages = None, []
+
+    def walk(node: Any, in_plan: bool):
+        nonlocal stats
+        if isinstance(node, dict):
+            if stats is None and isinstance(node.get("executionStats"), dict):
+                stats = node["executionStats"]
+            if in_plan and isinstance(node.get("stage"), str):
+                stages.append(node["stage"])
+            for key, item in node.items():
+                if key in ("rejectedPlans", "allPlansExecution"):
+                    continue
+                walk(item, in_plan or key in ("winningPlan", "queryPlan"))
+        elif isinstance(node, list):
+            for item in node:
+                walk(item, in_plan)
+
+    walk(explain, False)
+    stats = stats or {}
+    returned = stats.get("nReturned", 0)
+    keys = stats.get("totalKeysExamined", 0)
+    docs = stats.get("totalDocsExamined", 0)
+    return {
+        "plan_stages": list(dict.fromkeys(stages)),
+        "collection_scan": "COLLSCAN" in stages,
+        "n_returned": returned,
+        "keys_examined": keys,
+        "docs_examined": docs,
+        "keys_examined_per_returned": round(keys / max(returned, 1), 2),
+        "docs_examined_per_returned": round(docs / max(returned, 1), 2),
+        "execution_time_ms": stats.get("executionTimeMillis")
+    }
+
+class SlowQueryLog(monitoring.CommandListener):
+    """Command listener that aggregates slow operations by collection, command and filter shape.
+
+    pymongo calls it from Motor's worker threads, so state is guarded by a lock and
+    explains are handed to the event loop captured at startup.
+    """
+
+    def __init__(self, threshold_ms: float = SLOW_QUERY_MS, max_shapes: int = SLOW_QUERY_MAX_SHAPES):
+        self.threshold_ms = threshold_ms
+        self.max_shapes = max_shapes
+        self.lock = threading.Lock()
+        self.pending: Dict[int, Tuple[str, Dict[str, Any]]] = {}
+        self.shapes: Dict[str, Dict[str, Any]] = {}
+        self.dropped = 0
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def started(self, event):
+        if event.command_name in SLOW_QUERY_COMMANDS:
+            with self.lock:
+                self.pending[event.request_id] = (event.database_name, event.command)
+
+    def succeeded(self, event):
+        self.finish(event)
+
+    def failed(self, event):
+        self.finish(event)
+
+    def finish(self, event):
+        if event.command_name not in SLOW_QUERY_COMMANDS:
+            return
+        with self.lock:
+            pending = self.pending.pop(event.request_id, None)
+        duration_ms = event.duration_micros / 1000
+        if pending is not None and duration_ms >= self.threshold_ms:
+            self.record(event.command_name, pending[0], pending[1], duration_ms)
+
+    def record(self, command_name: str, database_name: str, command: Dict[str, Any], duration_ms: float):
+        collection_name = command.get(command_name)
+        # Sort directions are part of the shape; everything else is reduced to types
+        shape = {
+            field: dict(command[field]) if field == "sort" else query_shape(command[field])
+            for field in SLOW_QUERY_SHAPE_FIELDS if field in command
+        }
+        key = hashlib.md5(json.dumps([collection_name, command_name, shape], sort_keys=True, default=str).encode()).hexdigest()
+        with self.lock:
+            entry = self.shapes.get(key)
+            is_new = entry is None
+            if is_new:
+                if len(self.shapes) >= self.max_shapes:
+                    self.dropped += 1
+                    return
+                entry = self.shapes[key] = {
+                    "shape_id": key,
+                    "collection": collection_name,
+                    "command": command_name,
+                    "shape": shape,
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "first_seen": datetime.utcnow().isoformat(),
+                    "explain": None,
+                    "explain_error": None
+                }
+            entry["count"] += 1
+            entry["total_ms"] += duration_ms
+            entry["max_ms"] = max(entry["max_ms"], duration_ms)
+            entry["last_seen"] = datetime.utcnow().isoformat()
+        if is_new:
+            logging.warning(f"Slow {command_name} on {collection_name} ({duration_ms:.0f}ms): {json.dumps(shape, default=str)}")
+            if self.loop is not None and not self.loop.is_closed():
+                self.loop.call_soon_threadsafe(self.schedule_explain, key, database_name, command_name, command)
+
+    def schedule_explain(self, key: str, database_name: str, command_name: str, command: Dict[str, Any]):
+        asyncio.ensure_future(self.capture_explain(key, database_name, command_name, command))
+
+    async def capture_explain(self, key: str, database_name: str, command_name: str, command: Dict[str, Any]):
+        # Re-run the original command (driver fields stripped) under explain
+        explained = {
+            field: value for field, value in command.items()
+            if not field.startswith("$") and field not in SLOW_QUERY_DRIVER_FIELDS
+        }
+        if command_name == "aggregate":
+            explained["pipeline"] = [stage for stage in explained.get("pipeline", []) if "$out" not in stage and "$merge" not in stage]
+        try:
+            reply = await client[database_name].command({"explain": explained, "verbosity": "executionStats"})
+            summary = summarize_explain(reply)
+            error = None
+        except Exception as e:
+            logging.error(f"Slow query explain error for {command_name} on {command.get(command_name)}: {e}")
+            summary, error = None, str(e)
+        with self.lock:
+            entry = self.shapes.get(key)
+            if entry is not None:
+                entry["explain"], entry["explain_error"] = summary, error
+
+    def worst(self, limit: int) -> List[Dict[str, Any]]:
+        with self.lock:
+            entries = [dict(entry) for entry in self.shapes.values()]
+        for entry in entries:
+            entry["total_ms"] = round(entry["total_ms"], 1)
+            entry["max_ms"] = round(entry["max_ms"], 1)
+            entry["avg_ms"] = round(entry["total_ms"] / entry["count"], 1)
+        entries.sort(key=lambda entry: entry["total_ms"], reverse=True)
+        return entries[:limit]
+
+slow_query_log = SlowQueryLog()
+
 # MongoDB Atlas connection
 mongo_url = os.environ.get('MONGO_URL')
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[slow_query_log] if SLOW_QUERY_MS > 0 else [])
 db = client["world_data"]  # Using the world_data database as specified
 
 # OpenAI setup
 openai.api_key = os.environ.get('OPENAI_API_KEY')
+LLM_TIMEOUT_SECONDS = float(os.environ.get('LLM_TIMEOUT_SECONDS', '20'))
+
+class LLMCircuitOpenError(Exception):
+    """Raised instead of calling OpenAI while the circuit breaker is open"""
+
+class LLMCircuitBreaker:
+    """Fail fast when OpenAI is degraded.
+
+    Calls that raise or take longer than slow_call_seconds count as failures.
+    Once the failure rate over the rolling window crosses failure_threshold the
+    circuit opens and calls are rejected immediately; after open_seconds a single
+    half-open probe decides whether to close it again.
+    """
+
+    def __init__(self, window_seconds: float = 60, min_calls: int = 5, failure_threshold: float = 0.5,
+                 slow_call_seconds: float = 10, open_seconds: float = 30):
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_threshold = failure_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.calls = deque()  # (timestamp, failed, latency)
+        self.rejected_calls = 0
+        self.times_opened = 0
+
+    def _trim(self, now: float):
+        while self.calls and now - self.calls[0][0] > self.window_seconds:
+            self.calls.popleft()
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        if self.state == "open" and now - self.opened_at >= self.open_seconds:
+            self.state = "half_open"
+            self.probe_in_flight = False
+        if self.state == "closed":
+            return True
+        if self.state == "half_open" and not self.probe_in_flight:
+            self.probe_in_flight = True
+            return True
+        self.rejected_calls += 1
+        return False
+
+    def record(self, latency: float, error: bool, slow_call_seconds: Optional[float] = None):
+        now = time.monotonic()
+        failed = error or latency > (slow_call_seconds or self.slow_call_seconds)
+        if self.state == "half_open":
+            self.probe_in_flight = False
+            if failed:
+                self._open(now)
+            else:
+                self.state = "closed"
+                self.calls.clear()
+            return
+        self.calls.append((now, failed, latency))
+        self._trim(now)
+        if self.state == "closed" and len(self.calls) >= self.min_calls:
+            failures = sum(1 for _, call_failed, _ in self.calls if call_failed)
+            if failures / len(self.calls) >= self.failure_threshold:
+                self._open(now)
+
+    def _open(self, now: float):
+        self.state = "open"
+        self.opened_at = now
+        self.times_opened += 1
+        logging.warning("LLM circuit breaker opened")
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        self._trim(now)
+        window_calls = len(self.calls)
+        failures = sum(1 for _, call_failed, _ in self.calls if call_failed)
+        latencies = [latency for _, _, latency in self.calls]
+        return {
+            "state": self.state,
+            "window_calls": window_calls,
+            "window_failure_rate": failures / window_calls if window_calls else 0.0,
+            "window_avg_latency_seconds": sum(latencies) / window_calls if window_calls else 0.0,
+            "rejected_calls": self.rejected_calls,
+            "times_opened": self.times_opened,
+            "seconds_until_half_open": max(self.open_seconds - (now - self.opened_at), 0.0) if self.state == "open" else 0.0
+        }
+
+llm_circuit_breaker = LLMCircuitBreaker(
+    slow_call_seconds=float(os.environ.get('LLM_SLOW_CALL_SECONDS', '10')),
+    open_seconds=float(os.environ.get('LLM_CIRCUIT_OPEN_SECONDS', '30'))
+)
+
+# LLM model routing
+# Each call is routed to a tier that sets its model, token budget and timeout:
+# short chat answers, chart insights, and comparative or full-dataset deep dives.
+LLM_TIERS = {
+    "chat_answer": {
+        "model": os.environ.get('LLM_MODEL_CHAT_ANSWER', 'gpt-3.5-turbo'),
+        # Fits the chat JSON contract (100-word insight plus metrics, anomalies and trend)
+        "max_tokens": int(os.environ.get('LLM_MAX_TOKENS_CHAT_ANSWER', '500')),
+        "timeout": float(os.environ.get('LLM_TIMEOUT_CHAT_ANSWER', '10')),
+        "slow_call_seconds": 8
+    },
+    "chart_insight": {
+        "model": os.environ.get('LLM_MODEL_CHART_INSIGHT', 'gpt-3.5-turbo'),
+        "max_tokens": int(os.environ.get('LLM_MAX_TOKENS_CHART_INSIGHT', '800')),
+        "timeout": float(os.environ.get('LLM_TIMEOUT_CHART_INSIGHT', str(LLM_TIMEOUT_SECONDS))),
+        "slow_call_seconds": llm_circuit_breaker.slow_call_seconds
+    },
+    "deep_dive": {
+        "model": os.environ.get('LLM_MODEL_DEEP_DIVE', 'gpt-3.5-turbo'),
+        "max_tokens": int(os.environ.get('LLM_MAX_TOKENS_DEEP_DIVE', '1200')),
+        "timeout": float(os.environ.get('LLM_TIMEOUT_DEEP_DIVE', '45')),
+        "slow_call_seconds": 30
+    }
+}
+# USD per 1K prompt and completion tokens, for cost estimates in /api/metrics
+LLM_MODEL_PRICES = {
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-4o": (0.0025, 0.01),
+    "gpt-4-turbo": (0.01, 0.03)
+}
+
+def route_llm_tier(task: str, comparative: bool = False) -> str:
+    """Tier for an LLM task; user questions that explicitly ask for a comparison get a deep dive"""
+    return "deep_dive" if comparative else task
+
+def estimate_llm_cost(model: str, prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+    prices = LLM_MODEL_PRICES.get(model)
+    if prices is None:
+        return None
+    return (prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1000
+
+class LLMTierStats:
+    """Call counts, latency percentiles, token usage and estimated cost for one tier"""
+
+    def __init__(self, max_samples: int = 1000):
+        self.calls = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost_usd = 0.0
+        self.latencies = deque(maxlen=max_samples)
+
+    def record(self, latency: float, response: Any, model: str):
+        self.calls += 1
+        self.latencies.append(latency)
+        if response is None:
+            self.errors += 1
+            return
+        usage = getattr(response, "usage", None)
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.cost_usd += estimate_llm_cost(model, prompt_tokens, completion_tokens) or 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        latencies = np.array(self.latencies) if self.latencies else None
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "latency_p50_seconds": round(float(np.percentile(latencies, 50)), 4) if latencies is not None else None,
+            "latency_p95_seconds": round(float(np.percentile(latencies, 95)), 4) if latencies is not None else None,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "estimated_cost_usd": round(self.cost_usd, 6)
+        }
+
+llm_tier_stats = {tier: LLMTierStats() for tier in LLM_TIERS}
+
+# LLM dispatch
+# All LLM calls take a slot from one dispatcher. Waiting calls are served by priority
+# class (interactive chat, then chart insights, then background work) and each class
+# has its own concurrency cap; the lower caps leave slots free for interactive calls.
+LLM_PRIORITY_CLASSES = ("interactive", "standard", "background")
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', '8'))
+LLM_CLASS_CONCURRENCY = {
+    "interactive": LLM_MAX_CONCURRENCY,
+    "standard": int(os.environ.get('LLM_STANDARD_CONCURRENCY', str(max(1, LLM_MAX_CONCURRENCY - 3)))),
+    "background": int(os.environ.get('LLM_BACKGROUND_CONCURRENCY', '2'))
+}
+
+# Priority class of the LLM calls made by the current request or job
+llm_priority: ContextVar[str] = ContextVar("llm_priority", default="standard")
+
+class LLMDispatcher:
+    """Priority queue in front of the LLM with global and per-class concurrency caps"""
+
+    def __init__(self, max_concurrency: int, class_limits: Dict[str, int], max_samples: int = 1000):
+        self.max_concurrency = max_concurrency
+        self.class_limits = class_limits
+        self.active = defaultdict(int)
+        self.waiters: List[Tuple[int, int, str, asyncio.Future]] = []
+        self.sequence = 0
+        self.granted = defaultdict(int)
+        self.wait_times = {cls: deque(maxlen=max_samples) for cls in class_limits}
+
+    def _can_run(self, cls: str) -> bool:
+        return sum(self.active.values()) < self.max_concurrency and self.active[cls] < self.class_limits[cls]
+
+    def _dispatch(self):
+        # Wake waiters in priority order, skipping classes that are at their cap
+        for waiter in sorted(self.waiters):
+            _, _, cls, future = waiter
+            if future.done():
+                self.waiters.remove(waiter)
+            elif self._can_run(cls):
+                self.waiters.remove(waiter)
+                self.active[cls] += 1
+                future.set_result(None)
+
+    async def acquire(self, cls: str):
+        started = time.monotonic()
+        if not self.waiters and self._can_run(cls):
+            self.active[cls] += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self.sequence += 1
+            self.waiters.append((LLM_PRIORITY_CLASSES.index(cls), self.sequence, cls, future))
+            self._dispatch()
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Granted just before the cancellation: hand the slot back
+                    self.release(cls)
+                raise
+        self.granted[cls] += 1
+        self.wait_times[cls].append(time.monotonic() - started)
+
+    def release(self, cls: str):
+        self.active[cls] -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, cls: str):
+        await self.acquire(cls)
+        try:
+            yield
+        finally:
+            self.release(cls)
+
+    def snapshot(self) -> Dict[str, Any]:
+        queued = defaultdict(int)
+        for _, _, cls, future in self.waiters:
+            if not future.done():
+                queued[cls] += 1
+        classes = {}
+        for cls, limit in self.class_limits.items():
+            waits = np.array(self.wait_times[cls]) if self.wait_times[cls] else None
+            classes[cls] = {
+                "concurrency_limit": limit,
+                "active": self.active[cls],
+                "queued": queued[cls],
+                "granted": self.granted[cls],
+                "wait_p50_seconds": round(float(np.percentile(waits, 50)), 4) if waits is not None else None,
+                "wait_p95_seconds": round(float(np.percentile(waits, 95)), 4) if waits is not None else None,
+                "wait_max_seconds": round(float(waits.max()), 4) if waits is not None else None
+            }
+        return {"max_concurrency": self.max_concurrency, "classes": classes}
+
+llm_dispatcher = LLMDispatcher(LLM_MAX_CONCURRENCY, LLM_CLASS_CONCURRENCY)
+
+# LLM usage accounting
+# Every LLM call is recorded under (endpoint, collection, chart_type): token usage, a
+# latency histogram, JSON parse failures and fallbacks. Route handlers also collect
+# the calls made while serving a request and log them as one line of fields.
+LLM_LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 45)
+
+# Route template of the request (or job origin) making LLM calls
+llm_endpoint: ContextVar[str] = ContextVar("llm_endpoint", default="background")
+# Per-request totals for the access log; None outside route handlers
+llm_request_usage: ContextVar[Optional[Dict[str, float]]] = ContextVar("llm_request_usage", default=None)
+
+class LLMUsageStats:
+    """Token, latency and failure counters for one (endpoint, collection, chart_type)"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latency_sum = 0.0
+        self.latency_buckets = [0] * (len(LLM_LATENCY_BUCKETS) + 1)
+        self.json_parse_failures = 0
+        self.fallbacks = 0
+
+    def record_call(self, latency: float, prompt_tokens: int, completion_tokens: int, error: bool):
+        self.calls += 1
+        self.errors += int(error)
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.latency_sum += latency
+        self.latency_buckets[bisect.bisect_left(LLM_LATENCY_BUCKETS, latency)] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        cumulative = np.cumsum(self.latency_buckets).tolist()
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "latency_seconds_sum": round(self.latency_sum, 4),
+            "latency_histogram": {
+                **{f"le_{bound:g}": count for bound, count in zip(LLM_LATENCY_BUCKETS, cumulative)},
+                "le_inf": cumulative[-1]
+            },
+            "json_parse_failures": self.json_parse_failures,
+            "fallbacks": self.fallbacks
+        }
+
+llm_usage_stats: Dict[Tuple[str, str, str], LLMUsageStats] = defaultdict(LLMUsageStats)
+
+def llm_usage_key(collection_name: Optional[str], chart_type: Optional[str]) -> Tuple[str, str, str]:
+    # Chart types come from clients, so unknown values share one label
+    chart_label = chart_type if chart_type in CHART_ANALYSIS_GUIDE else ("other" if chart_type else "none")
+    return llm_endpoint.get(), collection_name or "none", chart_label
+
+def add_request_usage(**values: float):
+    usage = llm_request_usage.get()
+    if usage is not None:
+        for key, value in values.items():
+            usage[key] = usage.get(key, 0) + value
+
+def parse_llm_json(response: Any, collection_name: Optional[str] = None, chart_type: Optional[str] = None) -> Any:
+    """json.loads of a completion's content, counting parse failures before re-raising"""
+    try:
+        return json.loads(response.choices[0].message.content)
+    except (json.JSONDecodeError, TypeError):
+        llm_usage_stats[llm_usage_key(collection_name, chart_type)].json_parse_failures += 1
+        add_request_usage(llm_parse_failures=1)
+        raise
+
+def record_llm_fallback(collection_name: Optional[str] = None, chart_type: Optional[str] = None):
+    """Count a response replaced by static fallback content"""
+    llm_usage_stats[llm_usage_key(collection_name, chart_type)].fallbacks += 1
+    add_request_usage(llm_fallbacks=1)
+
+async def create_chat_completion(tier: str = "chart_insight", collection_name: Optional[str] = None,
+                                 chart_type: Optional[str] = None, **kwargs):
+    """Call OpenAI through the circuit breaker with the tier's model, token budget and timeout.
+
+    Raises LLMCircuitOpenError when the breaker is open. Explicit model/max_tokens win.
+    collection_name and chart_type only label the usage metrics.
+    """
+    config = LLM_TIERS[tier]
+    kwargs.setdefault("model", config["model"])
+    kwargs.setdefault("max_tokens", config["max_tokens"])
+    async with llm_dispatcher.slot(llm_priority.get()):
+        if not llm_circuit_breaker.allow():
+            raise LLMCircuitOpenError("LLM circuit breaker is open")
+        started = time.monotonic()
+        response = None
+        try:
+            async with timed_stage("llm"):
+                response = await asyncio.to_thread(
+                    openai.chat.completions.create,
+                    timeout=config["timeout"],
+                    **kwargs
+                )
+        finally:
+            latency = time.monotonic() - started
+            llm_circuit_breaker.record(latency, error=response is None, slow_call_seconds=config["slow_call_seconds"])
+            llm_tier_stats[tier].record(latency, response, kwargs["model"])
+            usage = getattr(response, "usage", None)
+            prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+            completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+            llm_usage_stats[llm_usage_key(collection_name, chart_type)].record_call(
+                latency, prompt_tokens, completion_tokens, error=response is None
+            )
+            add_request_usage(llm_calls=1, llm_prompt_tokens=prompt_tokens,
+                              llm_completion_tokens=completion_tokens, llm_seconds=latency)
+    return response
+
+# Request stage timing
+# Handlers wrap DB calls, LLM calls and serialization in timed_stage(); the totals go
+# out as a Server-Timing header and into per-route, per-stage histograms. With
+# REQUEST_TIMING disabled no timings dict is set and timed_stage is a pass-through.
+REQUEST_TIMING_ENABLED = os.environ.get('REQUEST_TIMING', 'true').lower() in ('1', 'true', 'yes')
+STAGE_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Seconds spent per stage in the current request; None when not timing
+request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+@asynccontextmanager
+async def timed_stage(stage: str):
+    """Add the time spent in the block to the current request's stage total"""
+    timings = request_timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - started
+
+class LatencyHistogram:
+    """Prometheus-style histogram: per-bucket counts plus count and sum"""
+
+    def __init__(self, buckets: Tuple[float, ...] = STAGE_LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        totals = np.cumsum(self.counts).tolist()
+        return [(f"{bound:g}", total) for bound, total in zip(self.buckets, totals)] + [("+Inf", totals[-1])]
+
+stage_histograms: Dict[Tuple[str, str], LatencyHistogram] = defaultdict(LatencyHistogram)
+
+def format_server_timing(timings: Dict[str, float]) -> str:
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
+
+def prometheus_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def render_stage_metrics() -> str:
+    """Stage histograms in the Prometheus text exposition format"""
+    name = "api_request_stage_seconds"
+    lines = [
+        f"# HELP {name} Time spent in each stage of an API request",
+        f"# TYPE {name} histogram"
+    ]
+    for (route, stage), histogram in sorted(stage_histograms.items()):
+        labels = f'route="{prometheus_label(route)}",stage="{prometheus_label(stage)}"'
+        for bound, total in histogram.cumulative():
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {total}')
+        lines.append(f"{name}_sum{{{labels}}} {histogram.sum:.6f}")
+        lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+    return "\n".join(lines) + "\n"
+
+class InstrumentedRoute(APIRoute):
+    """API route that labels LLM calls with its path, logs their totals and times its stages.
+
+    Stages: "handler" is the endpoint function, "serialize" the rest of the request
+    (parameter parsing, response validation and JSON rendering), "total" both.
+    """
+
+    def get_route_handler(self):
+        endpoint = self.dependant.call
+        if REQUEST_TIMING_ENABLED and asyncio.iscoroutinefunction(endpoint):
+            @wraps(endpoint)
+            async def timed_endpoint(*args, **kwargs):
+                async with timed_stage("handler"):
+                    return await endpoint(*args, **kwargs)
+            self.dependant.call = timed_endpoint
+        handler = super().get_route_handler()
+        path = self.path
+
+        async def instrumented_handler(request: Request):
+            llm_endpoint.set(path)
+            usage = {}
+            llm_request_usage.set(usage)
+            timings = None
+            if REQUEST_TIMING_ENABLED:
+                timings = {}
+                request_timings.set(timings)
+                started = time.perf_counter()
+            try:
+                response = await handler(request)
+            finally:
+                if usage:
+                    fields = " ".join(f"{key}={round(value, 4) if isinstance(value, float) else value}"
+                                      for key, value in usage.items())
+                    logging.info(f"{request.method} {path} {fields}")
+                if timings is not None:
+                    timings["total"] = time.perf_counter() - started
+                    if "handler" in timings:
+                        timings["serialize"] = max(0.0, timings["total"] - timings["handler"])
+                    for stage, seconds in timings.items():
+                        stage_histograms[(path, stage)].observe(seconds)
+            if timings is not None:
+                response.headers["Server-Timing"] = format_server_timing(timings)
+            return response
+
+        return instrumented_handler
 
 # Create the main app
 app = FastAPI(title="TRACITY API", description="AI-Powered Data Visualization Platform")
 
 # Create a router with the /api prefix
-api_router = APIRouter(prefix="/api")
+api_router = APIRouter(prefix="/api", route_class=InstrumentedRoute)
 
 # Pydantic Models
 class ChatQuery(BaseModel):
@@ -65,6 +729,24 @@ class FilterRequest(BaseModel):
     sort_order: Optional[str] = "asc"  # asc or desc
     limit: Optional[int] = 100
     chart_type: Optional[str] = "bar"  # For AI insights context
+    format: Optional[str] = "rows"  # rows, columnar or series
+    group_by: Optional[str] = None  # Split series by another field (e.g. year) when format is series
+    top_n: Optional[int] = None  # Slices kept for pie/doughnut charts before the "Others" bucket
+    insight_mode: Optional[str] = "sample"  # sample, or full for map-reduce over every matching record
+
+class HistogramRequest(FilterRequest):
+    field: Optional[str] = None  # Defaults to the collection's primary metric
+    bins: int = 10
+    binning: str = "fixed"  # fixed (equal width) or quantile (equal count)
+    boundaries: Optional[List[float]] = None  # Explicit bin edges, e.g. AQI bands
+
+class BatchInsightRequest(BaseModel):
+    requests: List[FilterRequest]
+
+class JoinRequest(BaseModel):
+    collections: List[str]
+    states: Optional[List[str]] = None
+    years: Optional[List[int]] = None
 
 class CollectionMetadata(BaseModel):
     collection: str
@@ -122,12 +804,80 @@ async def get_collection_metadata(collection_name: str) -> CollectionMetadata:
             special_filters={}
         )
 
+# Sort planning
+# Sorts an index can serve (the field leads the index, or follows keys the filter pins
+# to one value) are hinted onto that index; anything else becomes a top-K sort that may
+# spill to disk instead of failing at the in-memory sort limit. Fields missing from the
+# sampled schema (sparse or newly added) still sort, on the top-K path.
+SORT_SCHEMA_TTL_SECONDS = 300
+SORT_SCHEMA_SAMPLE_SIZE = 200
+SORT_ORDERS = {"asc": 1, "desc": -1}
+
+sort_schema_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+
+async def get_sort_schema(collection_name: str) -> Dict[str, Any]:
+    """Field names (from a random sample of documents) and index key patterns of a collection"""
+    cached = sort_schema_cache.get(collection_name)
+    if cached and time.monotonic() - cached[0] < SORT_SCHEMA_TTL_SECONDS:
+        return cached[1]
+    sample, index_info = await asyncio.gather(
+        db[collection_name].aggregate([
+            {"$sample": {"size": SORT_SCHEMA_SAMPLE_SIZE}}, {"$project": {"_id": 0}}
+        ]).to_list(SORT_SCHEMA_SAMPLE_SIZE),
+        db[collection_name].index_information()
+    )
+    indexes = {
+        name: [field for field, _ in info["key"]]
+        for name, info in index_info.items()
+        # Sparse and partial indexes omit documents, so they cannot serve an unfiltered sort
+        if not info.get("sparse") and "partialFilterExpression" not in info
+        and all(isinstance(kind, (int, float)) for _, kind in info["key"])
+    }
+    fields = {"_id"} | {field for doc in sample for field in doc} | {field for keys in indexes.values() for field in keys}
+    schema = {"fields": fields, "indexes": indexes}
+    sort_schema_cache[collection_name] = (time.monotonic(), schema)
+    return schema
+
+def is_equality_match(condition: Any) -> bool:
+    """True when a filter condition pins a field to a single value"""
+    if isinstance(condition, dict):
+        keys = set(condition)
+        if keys == {"$eq"}:
+            return True
+        if keys == {"$in"} and isinstance(condition["$in"], list) and len(condition["$in"]) == 1:
+            return True
+        return not any(key.startswith("$") for key in keys)
+    return not isinstance(condition, list)
+
+def plan_sort(schema: Dict[str, Any], query: Dict[str, Any], sort_by: str, sort_order: str) -> Dict[str, Any]:
+    """Choose how to sort: on a supporting index or as a top-K sort.
+
+    Raises HTTPException(400) for sort orders or field names MongoDB cannot sort by.
+    """
+    direction = SORT_ORDERS.get((sort_order or "asc").lower())
+    if direction is None:
+        raise HTTPException(status_code=400, detail=f"sort_order must be one of: {', '.join(SORT_ORDERS)}")
+    if not sort_by or "\0" in sort_by or any(not part or part.startswith("$") for part in sort_by.split(".")):
+        raise HTTPException(status_code=400, detail=f"Cannot sort by '{sort_by}': not a valid field name")
+
+    for name, keys in schema["indexes"].items():
+        if sort_by not in keys:
+            continue
+        prefix = keys[:keys.index(sort_by)]
+        # Keys ahead of the sort field must be fixed by the filter for the index order to hold
+        if all(field in query and is_equality_match(query[field]) for field in prefix):
+            return {"strategy": "index", "field": sort_by, "direction": direction, "index": name,
+                    "field_seen": True}
+    return {"strategy": "top_k", "field": sort_by, "direction": direction, "index": None,
+            "field_seen": sort_by in schema["fields"]}
+
 async def build_filter_query(filter_request: FilterRequest) -> Dict[str, Any]:
     """Build MongoDB query from filter request"""
     query = {}
     
     if filter_request.states:
-        query["state"] = {"$in": filter_request.states}
+        state_names = await resolve_state_names(filter_request.states, filter_request.collection)
+        query["state"] = {"$in": state_names}
     
     if filter_request.years:
         if filter_request.collection == "covid_stats":
@@ -146,6 +896,34 @@ async def build_filter_query(filter_request: FilterRequest) -> Dict[str, Any]:
     
     return query
 
+# Chart-specific analysis guidance shared by the insight prompts
+CHART_ANALYSIS_GUIDE = {
+    "bar": "Focus on comparative analysis between different states/regions. Highlight top performers and underperformers.",
+    "line": "Emphasize trends over time, seasonal patterns, and rate of change. Look for growth or decline patterns.",
+    "pie": "Analyze proportional relationships and market share. Focus on distribution and relative contributions.",
+    "doughnut": "Similar to pie chart but emphasize the central metric and overall composition."
+}
+
+def get_fallback_enhanced_insights(collection_name: str, chart_type: str = "bar", llm_failed: bool = True) -> Dict[str, Any]:
+    """Static insight payload used when the LLM call fails (flagged so it is not cached as a result).
+
+    llm_failed=False is for callers that had nothing to send to the LLM; nothing is counted or flagged.
+    """
+    if llm_failed:
+        record_llm_fallback(collection_name, chart_type)
+    return {
+        "fallback": llm_failed,
+        "insight": f"Analysis of {collection_name} data shows various patterns across Indian states. The data provides valuable insights into regional variations and trends over time, optimized for {chart_type} visualization.",
+        "chart_type": chart_type,
+        "key_findings": ["Regional variations observed", "Temporal trends identified", "Data quality is good"],
+        "anomalies": [],
+        "trend": "stable",
+        "recommendations": ["Continue monitoring", "Implement targeted policies"],
+        "comparison_insights": "Significant differences observed between states",
+        "temporal_analysis": "Trends show interesting patterns over the analyzed period",
+        "visualization_notes": f"{chart_type} chart effectively displays the data relationships"
+    }
+
 async def get_enhanced_web_insights(data_sample: List[Dict], collection_name: str, query: str, chart_type: str = "bar") -> Dict[str, Any]:
     """Generate enhanced insights using web research and AI with chart type context"""
     try:
@@ -158,14 +936,7 @@ async def get_enhanced_web_insights(data_sample: List[Dict], collection_name: st
         }
         
         # Chart-specific analysis guidance
-        chart_analysis_guide = {
-            "bar": "Focus on comparative analysis between different states/regions. Highlight top performers and underperformers.",
-            "line": "Emphasize trends over time, seasonal patterns, and rate of change. Look for growth or decline patterns.",
-            "pie": "Analyze proportional relationships and market share. Focus on distribution and relative contributions.",
-            "doughnut": "Similar to pie chart but emphasize the central metric and overall composition."
-        }
-        
-        chart_context = chart_analysis_guide.get(chart_type, chart_analysis_guide["bar"])
+        chart_context = CHART_ANALYSIS_GUIDE.get(chart_type, CHART_ANALYSIS_GUIDE["bar"])
         
         # Generate research-based insights
         if collection_name == "crimes":
@@ -262,105 +1033,1833 @@ async def get_enhanced_web_insights(data_sample: List[Dict], collection_name: st
         }}
         """
         
-        response = await asyncio.to_thread(
-            openai.chat.completions.create,
-            model="gpt-3.5-turbo",
+        response = await create_chat_completion(
+            tier=route_llm_tier("chart_insight"),
+            collection_name=collection_name,
+            chart_type=chart_type,
             messages=[
                 {"role": "system", "content": f"You are an expert data analyst specializing in Indian socioeconomic data and {chart_type} chart visualization. Provide detailed, research-backed insights optimized for {chart_type} charts."},
                 {"role": "user", "content": prompt}
-            ],
-            max_tokens=800
+            ]
         )
         
-        result = json.loads(response.choices[0].message.content)
+        result = parse_llm_json(response, collection_name, chart_type)
         return result
     except Exception as e:
         logging.error(f"Enhanced insights error: {e}")
-        return {
-            "insight": f"Analysis of {collection_name} data shows various patterns across Indian states. The data provides valuable insights into regional variations and trends over time, optimized for {chart_type} visualization.",
+        return get_fallback_enhanced_insights(collection_name, chart_type)
+
+async def get_batched_enhanced_insights(items: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Analyze several small datasets in a single LLM call.
+
+    Each item needs id, collection, chart_type, total_records and data_sample.
+    Returns insights keyed by item id; items the model skips get the fallback.
+    """
+    sections = []
+    for item in items:
+        data_sample = item["data_sample"]
+        chart_type = item["chart_type"]
+        sections.append({
+            "id": item["id"],
+            "collection": item["collection"],
             "chart_type": chart_type,
-            "key_findings": ["Regional variations observed", "Temporal trends identified", "Data quality is good"],
-            "anomalies": [],
-            "trend": "stable",
-            "recommendations": ["Continue monitoring", "Implement targeted policies"],
-            "comparison_insights": "Significant differences observed between states",
-            "temporal_analysis": "Trends show interesting patterns over the analyzed period",
-            "visualization_notes": f"{chart_type} chart effectively displays the data relationships"
+            "chart_context": CHART_ANALYSIS_GUIDE.get(chart_type, CHART_ANALYSIS_GUIDE["bar"]),
+            "total_records": item["total_records"],
+            "key_fields": list(data_sample[0].keys()) if data_sample else [],
+            "sample_data": data_sample[:3]
+        })
+
+    collections = {item["collection"] for item in items}
+    chart_types = {item["chart_type"] for item in items}
+    batch_collection = collections.pop() if len(collections) == 1 else "multiple"
+    batch_chart_type = chart_types.pop() if len(chart_types) == 1 else "multiple"
+    results = {}
+    try:
+        prompt = f"""
+        Analyze each of the following Indian socioeconomic datasets independently. Every dataset
+        is prepared for its own chart; tailor the analysis to that chart type.
+        
+        Datasets: {json.dumps(sections, default=str)}
+        
+        Respond with a single JSON object keyed by dataset id. Each value must be:
+        {{
+            "insight": "Analytical insight optimized for the chart type (80-120 words)",
+            "chart_type": "the dataset's chart type",
+            "key_findings": ["Finding 1", "Finding 2", "Finding 3"],
+            "anomalies": ["Any unusual patterns detected"],
+            "trend": "Overall trend (increasing/decreasing/stable/volatile)",
+            "recommendations": ["Recommendation 1", "Recommendation 2"],
+            "comparison_insights": "How different states/regions compare",
+            "temporal_analysis": "Analysis of trends over time",
+            "visualization_notes": "Why the chart type is effective for this data"
+        }}
+        """
+        
+        response = await create_chat_completion(
+            tier="chart_insight",
+            collection_name=batch_collection,
+            chart_type=batch_chart_type,
+            messages=[
+                {"role": "system", "content": "You are an expert data analyst specializing in Indian socioeconomic data and chart visualization. Always respond with valid JSON."},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=min(400 * len(items), 3000)
+        )
+        
+        parsed = parse_llm_json(response, batch_collection, batch_chart_type)
+        if isinstance(parsed, dict):
+            results = {str(k): v for k, v in parsed.items() if isinstance(v, dict)}
+    except Exception as e:
+        logging.error(f"Batched insights error: {e}")
+
+    return {
+        item["id"]: results.get(item["id"]) or get_fallback_enhanced_insights(item["collection"], item["chart_type"])
+        for item in items
+    }
+
+# Map-reduce insights
+# Full-dataset analysis: the filtered result is profiled per state (or per year when a
+# single state is selected) in MongoDB, each chunk of profiles is summarized by its own
+# LLM call under a shared concurrency limit, and a final call merges the summaries.
+INSIGHT_MODES = ("sample", "full")
+MAP_REDUCE_CONCURRENCY = int(os.environ.get('MAP_REDUCE_CONCURRENCY', '4'))
+MAP_REDUCE_MAX_CHUNKS = int(os.environ.get('MAP_REDUCE_MAX_CHUNKS', '12'))
+
+map_reduce_semaphore = asyncio.Semaphore(MAP_REDUCE_CONCURRENCY)
+
+async def profile_insight_chunks(collection_name: str, query: Dict[str, Any]) -> Dict[str, Any]:
+    """Per-chunk statistics of the primary metric for the whole filtered result"""
+    field = await get_metric_field(collection_name)
+    if field is None:
+        return {"field": None, "chunk_by": None, "profiles": []}
+    rollup = COLLECTION_METRICS.get(collection_name, {}).get('rollup', 'sum')
+    results = await db[collection_name].aggregate([
+        {"$match": query},
+        {"$group": {
+            "_id": {"state": "$state", "year": sample_year_key(collection_name)},
+            "records": {"$sum": 1},
+            "total": {"$sum": f"${field}"},
+            "min": {"$min": f"${field}"},
+            "max": {"$max": f"${field}"}
+        }}
+    ]).to_list(None)
+
+    states = {r["_id"].get("state") for r in results}
+    chunk_by, detail_by = ("year", "state") if len(states) == 1 else ("state", "year")
+    chunks = defaultdict(list)
+    for r in results:
+        chunks[r["_id"].get(chunk_by)].append(r)
+
+    profiles = []
+    for key, cells in chunks.items():
+        records = sum(c["records"] for c in cells)
+        total = sum(c["total"] or 0 for c in cells)
+        detail = {
+            str(c["_id"].get(detail_by)): round((c["total"] or 0) / (c["records"] if rollup == "avg" else 1), 2)
+            for c in sorted(cells, key=lambda c: str(c["_id"].get(detail_by)))
         }
+        profiles.append({
+            chunk_by: key,
+            "records": records,
+            "total": round(total, 2),
+            "mean": round(total / records, 2) if records else None,
+            "min": min((c["min"] for c in cells if c["min"] is not None), default=None),
+            "max": max((c["max"] for c in cells if c["max"] is not None), default=None),
+            f"by_{detail_by}": detail
+        })
+    profiles.sort(key=lambda p: str(p[chunk_by]))
+    return {"field": field, "rollup": rollup, "chunk_by": chunk_by, "profiles": profiles}
 
-# Helper functions for enhanced data processing
-async def process_enhanced_query(query: str) -> Dict[str, Any]:
-    """Process queries with better state/year detection and specific responses"""
-    query_lower = query.lower()
+def partition_profiles(profiles: List[Dict[str, Any]], max_chunks: int) -> List[List[Dict[str, Any]]]:
+    """Pack profiles into at most max_chunks groups with balanced record counts"""
+    bins = [[] for _ in range(min(max_chunks, len(profiles)))]
+    loads = [0] * len(bins)
+    for profile in sorted(profiles, key=lambda p: p["records"], reverse=True):
+        target = loads.index(min(loads))
+        bins[target].append(profile)
+        loads[target] += profile["records"]
+    return [b for b in bins if b]
+
+def describe_profiles(chunk: List[Dict[str, Any]], chunk_by: str, field: str) -> str:
+    """Plain summary of a chunk, used when its LLM call fails"""
+    return "; ".join(
+        f"{p[chunk_by]}: {p['records']} records, mean {field.replace('_', ' ')} {p['mean']}"
+        for p in chunk
+    )
+
+async def summarize_insight_chunk(collection_name: str, chunk: List[Dict[str, Any]],
+                                  chunk_by: str, field: str) -> Dict[str, Any]:
+    """Map step: summarize one chunk of profiles"""
+    prompt = f"""
+    Summarize this portion of the Indian {collection_name} dataset, grouped by {chunk_by}.
+    Metric: {field}. Statistics per {chunk_by}: {json.dumps(chunk, default=str)}
     
-    # Indian states mapping (including common variations)
-    state_mapping = {
-        'delhi': ['delhi', 'new delhi', 'ncr'],
-        'mumbai': ['mumbai', 'bombay', 'maharashtra'],
-        'bangalore': ['bangalore', 'bengaluru', 'karnataka'],
-        'chennai': ['chennai', 'madras', 'tamil nadu'],
-        'kolkata': ['kolkata', 'calcutta', 'west bengal'],
-        'hyderabad': ['hyderabad', 'telangana'],
-        'kerala': ['kerala', 'kochi', 'trivandrum'],
-        'punjab': ['punjab', 'chandigarh'],
-        'gujarat': ['gujarat', 'ahmedabad', 'surat'],
-        'rajasthan': ['rajasthan', 'jaipur', 'jodhpur'],
-        'uttar pradesh': ['uttar pradesh', 'up', 'lucknow', 'kanpur'],
-        'bihar': ['bihar', 'patna'],
-        'andhra pradesh': ['andhra pradesh', 'ap', 'visakhapatnam'],
-        'odisha': ['odisha', 'orissa', 'bhubaneswar'],
-        'madhya pradesh': ['madhya pradesh', 'mp', 'bhopal'],
-        'assam': ['assam', 'guwahati'],
-        'jharkhand': ['jharkhand', 'ranchi'],
-        'haryana': ['haryana', 'gurgaon', 'faridabad'],
-        'chhattisgarh': ['chhattisgarh', 'raipur'],
-        'uttarakhand': ['uttarakhand', 'dehradun'],
-        'himachal pradesh': ['himachal pradesh', 'shimla'],
-        'goa': ['goa', 'panaji'],
-        'tripura': ['tripura', 'agartala'],
-        'meghalaya': ['meghalaya', 'shillong'],
-        'manipur': ['manipur', 'imphal'],
-        'nagaland': ['nagaland', 'kohima'],
-        'arunachal pradesh': ['arunachal pradesh', 'itanagar'],
-        'mizoram': ['mizoram', 'aizawl'],
-        'sikkim': ['sikkim', 'gangtok']
+    Respond in JSON format:
+    {{
+        "summary": "What stands out in this portion (40-60 words)",
+        "notable": ["Specific observation with numbers"]
+    }}
+    """
+    async with map_reduce_semaphore:
+        try:
+            response = await create_chat_completion(
+                tier="chat_answer",
+                collection_name=collection_name,
+                messages=[
+                    {"role": "system", "content": "You are an expert data analyst specializing in Indian socioeconomic data. Always respond with valid JSON."},
+                    {"role": "user", "content": prompt}
+                ],
+                max_tokens=250
+            )
+            parsed = parse_llm_json(response, collection_name)
+            if isinstance(parsed, dict) and parsed.get("summary"):
+                return {"summary": parsed["summary"], "notable": parsed.get("notable") or [], "failed": False}
+        except Exception as e:
+            logging.error(f"Map-reduce chunk error for {collection_name}: {e}")
+    record_llm_fallback(collection_name)
+    return {"summary": describe_profiles(chunk, chunk_by, field), "notable": [], "failed": True}
+
+async def get_map_reduce_insights(collection_name: str, query: Dict[str, Any], query_text: str,
+                                  chart_type: str = "bar") -> Dict[str, Any]:
+    """Insights over the full filtered dataset: profile in MongoDB, map chunks, reduce summaries"""
+    profile = await profile_insight_chunks(collection_name, query)
+    if not profile["profiles"]:
+        # Nothing matched, so no LLM call was made
+        return get_fallback_enhanced_insights(collection_name, chart_type, llm_failed=False)
+    chunk_by, field = profile["chunk_by"], profile["field"]
+    chunks = partition_profiles(profile["profiles"], MAP_REDUCE_MAX_CHUNKS)
+    summaries = await asyncio.gather(*(
+        summarize_insight_chunk(collection_name, chunk, chunk_by, field) for chunk in chunks
+    ))
+
+    total_records = sum(p["records"] for p in profile["profiles"])
+    coverage = {
+        "records": total_records,
+        "chunk_by": chunk_by,
+        "chunks": len(chunks),
+        f"{chunk_by}s": len(profile["profiles"]),
+        "failed_chunks": sum(1 for s in summaries if s["failed"])
     }
+    chart_context = CHART_ANALYSIS_GUIDE.get(chart_type, CHART_ANALYSIS_GUIDE["bar"])
+    partials = [{"summary": s["summary"], "notable": s["notable"]} for s in summaries]
+    prompt = f"""
+    {query_text}. The analysis covers all {total_records} records of the Indian {collection_name}
+    dataset ({len(profile['profiles'])} {chunk_by}s, metric: {field}) for a {chart_type} chart.
     
-    # Detect states
-    detected_states = []
-    for state, variations in state_mapping.items():
-        if any(var in query_lower for var in variations):
-            detected_states.append(state)
-    
-    # Detect years
-    import re
-    years = re.findall(r'\b(20[0-2][0-9])\b', query)
-    detected_years = [int(year) for year in years]
+    Chart Type Context: {chart_context}
     
-    # Detect data type
-    collection = None
-    data_type = None
-    if any(word in query_lower for word in ['crime', 'murder', 'theft', 'assault', 'fraud']):
-        collection = 'crimes'
-        data_type = 'crime'
-    elif any(word in query_lower for word in ['literacy', 'education', 'literate']):
-        collection = 'literacy'
-        data_type = 'literacy'
-    elif any(word in query_lower for word in ['aqi', 'air quality', 'pollution', 'air']):
-        collection = 'aqi'
-        data_type = 'air quality'
-    elif any(word in query_lower for word in ['power', 'electricity', 'energy', 'consumption']):
-        collection = 'power_consumption'
-        data_type = 'power consumption'
+    Partial analyses, one per group of {chunk_by}s: {json.dumps(partials, default=str)}
     
+    Combine them into one analysis. Respond in JSON format:
+    {{
+        "insight": "Analytical insight covering the whole dataset (100-150 words)",
+        "chart_type": "{chart_type}",
+        "key_findings": ["Finding 1", "Finding 2", "Finding 3"],
+        "anomalies": ["Any unusual patterns detected"],
+        "trend": "Overall trend (increasing/decreasing/stable/volatile)",
+        "recommendations": ["Recommendation 1", "Recommendation 2"],
+        "comparison_insights": "How different states/regions compare",
+        "temporal_analysis": "Analysis of trends over time",
+        "visualization_notes": "Why {chart_type} chart is effective for this data"
+    }}
+    """
+    try:
+        async with map_reduce_semaphore:
+            response = await create_chat_completion(
+                tier="deep_dive",
+                collection_name=collection_name,
+                chart_type=chart_type,
+                messages=[
+                    {"role": "system", "content": "You are an expert data analyst specializing in Indian socioeconomic data and chart visualization. Always respond with valid JSON."},
+                    {"role": "user", "content": prompt}
+                ]
+            )
+        result = parse_llm_json(response, collection_name, chart_type)
+        if not isinstance(result, dict):
+            raise ValueError("Reduce step did not return a JSON object")
+    except Exception as e:
+        logging.error(f"Map-reduce reduce error for {collection_name}: {e}")
+        result = get_fallback_enhanced_insights(collection_name, chart_type)
+        result["key_findings"] = [s["summary"] for s in summaries][:5]
+    result["coverage"] = coverage
+    return result
+
+# Insight job subsystem
+# Data endpoints hand insight generation to background workers and return an
+# insight_job_id right away; clients poll or stream the job to get the result.
+INSIGHT_JOB_WORKERS = int(os.environ.get('INSIGHT_JOB_WORKERS', '2'))
+INSIGHT_JOB_TTL_SECONDS = int(os.environ.get('INSIGHT_JOB_TTL_SECONDS', '900'))
+INSIGHT_JOB_WAIT_SECONDS = 60  # How long the synchronous insight endpoints wait for their job
+INSIGHT_JOB_MAX_ENTRIES = 500
+# Prompt and sample size shared by /insights/enhanced and /insights/batch so they reuse each other's jobs
+ENHANCED_INSIGHT_QUERY = "Analyze patterns in {collection} data"
+ENHANCED_INSIGHT_SAMPLE_SIZE = 50
+
+insight_jobs: Dict[str, Dict[str, Any]] = {}
+insight_job_queue: asyncio.Queue = asyncio.Queue()
+insight_job_workers: List[asyncio.Task] = []
+
+def make_insight_job_id(collection_name: str, query: Dict[str, Any], chart_type: str, mode: str = "sample",
+                        query_text: str = "", sample_limit: Optional[int] = None) -> str:
+    """Deterministic job id so identical insight requests share one computation.
+
+    The prompt and the sample size are part of the key: an insight built from a
+    50-row sample for one endpoint's prompt does not answer a 200-row request.
+    """
+    key = {"collection": collection_name, "query": query, "chart_type": chart_type, "query_text": query_text}
+    if mode != "sample":
+        key["mode"] = mode
+    else:
+        key["sample_limit"] = sample_limit
+    key = json.dumps(key, sort_keys=True, default=str)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+def prune_insight_jobs():
+    """Drop finished jobs past their TTL and cap the registry size"""
+    now = time.monotonic()
+    finished = [
+        (job["finished_at"], job_id) for job_id, job in insight_jobs.items()
+        if job["status"] in ("completed", "failed")
+    ]
+    for finished_at, job_id in finished:
+        if now - finished_at > INSIGHT_JOB_TTL_SECONDS:
+            insight_jobs.pop(job_id, None)
+    overflow = len(insight_jobs) - INSIGHT_JOB_MAX_ENTRIES
+    if overflow > 0:
+        for _, job_id in sorted(finished)[:overflow]:
+            insight_jobs.pop(job_id, None)
+
+def ensure_insight_workers():
+    """Start the insight workers on first use (requires a running event loop)"""
+    insight_job_workers[:] = [task for task in insight_job_workers if not task.done()]
+    while len(insight_job_workers) < INSIGHT_JOB_WORKERS:
+        insight_job_workers.append(asyncio.create_task(insight_job_worker()))
+
+async def insight_job_worker():
+    """Consume queued insight jobs and store their results"""
+    while True:
+        job_id, data_sample, collection_name, query_text, chart_type, query, mode = await insight_job_queue.get()
+        job = insight_jobs.get(job_id)
+        if job is None or job["status"] != "pending":
+            # Pruned, or already answered by another path such as /insights/batch
+            insight_job_queue.task_done()
+            continue
+        try:
+            job["status"] = "running"
+            # Full-dataset analyses are bulk work unless a request is blocked waiting on them;
+            # sample insights back a chart someone is viewing
+            llm_priority.set("background" if mode == "full" and not job.get("waiters") else "standard")
+            # Attribute LLM usage to the endpoint that queued the job, not to whichever
+            # request happened to start this worker
+            llm_endpoint.set(job.get("endpoint", "background"))
+            llm_request_usage.set(None)
+            request_timings.set(None)
+            if mode == "full":
+                result = await get_map_reduce_insights(collection_name, query, query_text, chart_type)
+            else:
+                result = await get_enhanced_web_insights(data_sample, collection_name, query_text, chart_type)
+            job["result"] = await enrich_insights(result, collection_name, query)
+            if result.get("fallback"):
+                # Serve the canned text to current waiters but let the next request retry the LLM
+                job["status"] = "failed"
+                job["error"] = "LLM unavailable; fallback insights returned"
+            else:
+                job["status"] = "completed"
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Insight job {job_id} error: {e}")
+            job["status"] = "failed"
+            job["error"] = str(e)
+        finally:
+            job["finished_at"] = time.monotonic()
+            job["completed_at"] = datetime.utcnow().isoformat()
+            job["done"].set()
+            insight_job_queue.task_done()
+
+async def submit_insight_job(data_sample: Optional[List[Dict]], collection_name: str, query_text: str,
+                             chart_type: str, query: Dict[str, Any], mode: str = "sample",
+                             sample_limit: Optional[int] = None) -> str:
+    """Queue an insight job unless an identical one is pending or already done.
+
+    mode "sample" analyzes data_sample (fetched with sample_limit rows at most); "full"
+    runs map-reduce over everything matching query.
+    """
+    prune_insight_jobs()
+    job_id = make_insight_job_id(collection_name, query, chart_type, mode, query_text, sample_limit)
+    job = insight_jobs.get(job_id)
+    if job and job["status"] != "failed":
+        return job_id
+
+    insight_jobs[job_id] = {
+        "job_id": job_id,
+        "status": "pending",
+        "collection": collection_name,
+        "chart_type": chart_type,
+        "endpoint": llm_endpoint.get(),
+        "waiters": 0,
+        "result": None,
+        "error": None,
+        "created_at": datetime.utcnow().isoformat(),
+        "completed_at": None,
+        "finished_at": None,
+        "done": asyncio.Event()
+    }
+    ensure_insight_workers()
+    await insight_job_queue.put((job_id, data_sample, collection_name, query_text, chart_type, query, mode))
+    return job_id
+
+def record_insight_job_result(job_id: str, collection_name: str, chart_type: str, result: Dict[str, Any]):
+    """Store insights computed outside the worker queue so later requests can reuse them.
+
+    Fallback results are not stored, and jobs a worker owns (pending or running) are left alone.
+    """
+    if result.get("fallback"):
+        return
+    existing = insight_jobs.get(job_id)
+    if existing and existing["status"] in ("pending", "running"):
+        return
+    done = asyncio.Event()
+    done.set()
+    now = datetime.utcnow().isoformat()
+    insight_jobs[job_id] = {
+        "job_id": job_id,
+        "status": "completed",
+        "collection": collection_name,
+        "chart_type": chart_type,
+        "endpoint": llm_endpoint.get(),
+        "result": result,
+        "error": None,
+        "created_at": now,
+        "completed_at": now,
+        "finished_at": time.monotonic(),
+        "done": done
+    }
+
+async def wait_for_insight_job(job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+    """Wait up to timeout seconds for a job to finish and return it (None if unknown).
+
+    Waiters are counted so the worker can tell blocked callers from fire-and-forget jobs.
+    """
+    job = insight_jobs.get(job_id)
+    if job is None:
+        return None
+    if timeout > 0 and not job["done"].is_set():
+        job["waiters"] = job.get("waiters", 0) + 1
+        try:
+            await asyncio.wait_for(job["done"].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            job["waiters"] -= 1
+    return job
+
+def serialize_insight_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Public view of a job record"""
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "collection": job["collection"],
+        "chart_type": job["chart_type"],
+        "insights": job["result"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "completed_at": job["completed_at"]
+    }
+
+# Helper functions for enhanced data processing
+# Indian states mapping (including common variations)
+STATE_ALIASES = {
+    'delhi': ['delhi', 'new delhi', 'ncr'],
+    'mumbai': ['mumbai', 'bombay', 'maharashtra'],
+    'bangalore': ['bangalore', 'bengaluru', 'karnataka'],
+    'chennai': ['chennai', 'madras', 'tamil nadu'],
+    'kolkata': ['kolkata', 'calcutta', 'west bengal'],
+    'hyderabad': ['hyderabad', 'telangana'],
+    'kerala': ['kerala', 'kochi', 'trivandrum'],
+    'punjab': ['punjab', 'chandigarh'],
+    'gujarat': ['gujarat', 'ahmedabad', 'surat'],
+    'rajasthan': ['rajasthan', 'jaipur', 'jodhpur'],
+    'uttar pradesh': ['uttar pradesh', 'up', 'lucknow', 'kanpur'],
+    'bihar': ['bihar', 'patna'],
+    'andhra pradesh': ['andhra pradesh', 'ap', 'visakhapatnam'],
+    'odisha': ['odisha', 'orissa', 'bhubaneswar'],
+    'madhya pradesh': ['madhya pradesh', 'mp', 'bhopal'],
+    'assam': ['assam', 'guwahati'],
+    'jharkhand': ['jharkhand', 'ranchi'],
+    'haryana': ['haryana', 'gurgaon', 'faridabad'],
+    'chhattisgarh': ['chhattisgarh', 'raipur'],
+    'uttarakhand': ['uttarakhand', 'dehradun'],
+    'himachal pradesh': ['himachal pradesh', 'shimla'],
+    'goa': ['goa', 'panaji'],
+    'tripura': ['tripura', 'agartala'],
+    'meghalaya': ['meghalaya', 'shillong'],
+    'manipur': ['manipur', 'imphal'],
+    'nagaland': ['nagaland', 'kohima'],
+    'arunachal pradesh': ['arunachal pradesh', 'itanagar'],
+    'mizoram': ['mizoram', 'aizawl'],
+    'sikkim': ['sikkim', 'gangtok']
+}
+
+# Data type keywords in priority order: (collection, data_type, keywords)
+COLLECTION_KEYWORDS = [
+    ('crimes', 'crime', ['crime', 'murder', 'theft', 'assault', 'fraud']),
+    ('literacy', 'literacy', ['literacy', 'education', 'literate']),
+    ('aqi', 'air quality', ['aqi', 'air quality', 'pollution', 'air']),
+    ('power_consumption', 'power consumption', ['power', 'electricity', 'energy', 'consumption'])
+]
+
+def build_query_matcher():
+    """Compile one word-boundary regex that finds states, years and data keywords in a single pass.
+
+    Two-letter abbreviations (UP, AP, MP) only match when written in capitals so they
+    are not picked up from ordinary words like "up"; everything else is case-insensitive.
+    """
+    alias_lookup = {}
+    for state, variations in STATE_ALIASES.items():
+        for alias in variations:
+            alias_lookup[alias] = ('state', state)
+    for priority, (collection, data_type, keywords) in enumerate(COLLECTION_KEYWORDS):
+        for keyword in keywords:
+            alias_lookup.setdefault(keyword, ('collection', priority))
+            alias_lookup.setdefault(keyword + 's', ('collection', priority))
+
+    def to_trie_pattern(aliases):
+        # Factor shared prefixes so the engine walks a trie instead of trying every alias
+        trie = {}
+        for alias in aliases:
+            node = trie
+            for char in alias:
+                node = node.setdefault(char, {})
+            node[''] = {}
+
+        def emit(node):
+            end = '' in node
+            branches = [
+                (r'\s+' if char == ' ' else re.escape(char)) + emit(child)
+                for char, child in sorted(node.items()) if char
+            ]
+            if not branches:
+                return ''
+            body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+            # Longer alternatives are tried first, so "air quality" wins over "air"
+            return f'(?:{body})?' if end else body
+
+        return emit(trie)
+
+    words = to_trie_pattern(alias for alias in alias_lookup if len(alias) > 2)
+    abbreviations = to_trie_pattern(alias.upper() for alias in alias_lookup if len(alias) <= 2)
+    pattern = re.compile(
+        rf"\b(?:(?P<year>20[0-2][0-9])|(?P<alias>(?i:{words}))|(?P<abbr>{abbreviations}))\b"
+    )
+    return pattern, alias_lookup
+
+QUERY_MATCHER, QUERY_ALIAS_LOOKUP = build_query_matcher()
+STATE_ORDER = {state: index for index, state in enumerate(STATE_ALIASES)}
+
+# Fuzzy matching for misspelled aliases ("Karnatka", "Tamilnadu", "Chattisgarh").
+# Short words are excluded: too many ordinary words sit one edit away from them.
+# Collection keywords are ordinary English themselves, so they only tolerate one edit.
+FUZZY_MIN_STATE_LENGTH = 5
+FUZZY_MIN_KEYWORD_LENGTH = 6
+FUZZY_MAX_KEYWORD_DISTANCE = 1
+# Misspellings too far from their alias for the edit-distance search (transpositions cost 2)
+FUZZY_MISSPELLINGS = {'dehli': 'delhi'}
+# Common English words within fuzzy range of an alias ("crises", "literary", "ranch",
+# "assay"). They are only matched exactly, never corrected into an alias. Generated from
+# an English word-frequency list (top 60k words) against the alias index above.
+FUZZY_COMMON_WORDS = frozenset({
+    'aslam', 'assad', 'assay', 'bowers', 'chilling', 'chimes', 'climes', 'cries', 'crimea',
+    'crises', 'dassault', 'degli', 'delphi', 'grimes', 'hillsong', 'iterate', 'koichi', 'kojima',
+    'liberate', 'literary', 'lowers', 'manicure', 'mochi', 'mowers', 'mulder', 'murat', 'narayana',
+    'panna', 'patina', 'powders', 'primes', 'ranch', 'ranching', 'rancho', 'ratna', 'rimes',
+    'rowers', 'schilling', 'shelling', 'shilling', 'shillings', 'sochi', 'spilling', 'strat',
+    'surah', 'suraj', 'towers'
+})
+# Function words are never joined with a neighbour into a misspelled alias ("ranch in")
+FUZZY_STOP_WORDS = frozenset({
+    'a', 'about', 'across', 'an', 'and', 'any', 'are', 'as', 'at', 'be', 'between', 'by', 'did', 'do', 'does',
+    'during', 'for', 'from', 'has', 'have', 'how', 'in', 'into', 'is', 'it', 'its', 'me', 'my', 'of', 'on', 'or',
+    'over', 'per', 'show', 'since', 'than', 'that', 'the', 'their', 'there', 'this', 'to', 'vs', 'was', 'were',
+    'what', 'when', 'where', 'which', 'who', 'why', 'with'
+})
+
+def build_fuzzy_alias_index():
+    """Index aliases (spaces removed) by character trigram for typo lookups"""
+    compact_aliases = {}
+    for alias, target in QUERY_ALIAS_LOOKUP.items():
+        min_length = FUZZY_MIN_STATE_LENGTH if target[0] == 'state' else FUZZY_MIN_KEYWORD_LENGTH
+        compact = alias.replace(' ', '')
+        if len(compact) >= min_length:
+            compact_aliases.setdefault(compact, alias)
+    compact_aliases.update(FUZZY_MISSPELLINGS)
+    trigram_index = defaultdict(list)
+    for compact in compact_aliases:
+        for trigram in set(alias_trigrams(compact)):
+            trigram_index[trigram].append(compact)
+    return compact_aliases, dict(trigram_index)
+
+def alias_trigrams(word: str) -> List[str]:
+    padded = f"  {word} "
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+def bounded_edit_distance(a: str, b: str, limit: int) -> int:
+    """Levenshtein distance, giving up (returning limit + 1) once it exceeds limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    # Only cells within `limit` of the diagonal can stay under the limit
+    too_far = limit + 1
+    previous = [j if j <= limit else too_far for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        current = [i if i <= limit else too_far] + [too_far] * len(b)
+        char_a = a[i - 1]
+        row_best = current[0]
+        for j in range(max(1, i - limit), min(len(b), i + limit) + 1):
+            cost = previous[j - 1] + (char_a != b[j - 1])
+            if previous[j] + 1 < cost:
+                cost = previous[j] + 1
+            if current[j - 1] + 1 < cost:
+                cost = current[j - 1] + 1
+            current[j] = cost
+            if cost < row_best:
+                row_best = cost
+        if row_best > limit:
+            return too_far
+        previous = current
+    return min(previous[-1], too_far)
+
+FUZZY_COMPACT_ALIASES, FUZZY_TRIGRAM_INDEX = build_fuzzy_alias_index()
+
+# Wording that explicitly asks to compare datasets. Conjunctions and range words are not
+# cues: "energy theft in Bihar and UP" or "crime between 2015 and 2020" ask no comparison.
+COMPARATIVE_CUES = re.compile(
+    r"\b(?:correlat\w*|compar\w*|vs|versus|(?:impact|effect)s?\s+of\b.+\bon)\b",
+    re.IGNORECASE
+)
+
+@lru_cache(maxsize=4096)
+def fuzzy_match_alias(word: str) -> Optional[Tuple[str, int]]:
+    """Return (alias, edit distance) for the alias closest to a possibly misspelled word"""
+    if len(word) < FUZZY_MIN_STATE_LENGTH:
+        return None
+    if word in FUZZY_COMPACT_ALIASES:
+        return FUZZY_COMPACT_ALIASES[word], 0
+    if word in FUZZY_COMMON_WORDS:
+        return None
+    max_distance = 1 if len(word) < 8 else 2
+    trigrams = alias_trigrams(word)
+    # Each edit destroys at most three trigrams, so real candidates share the rest
+    min_shared = max(len(trigrams) - 3 * max_distance, 1)
+    shared = defaultdict(int)
+    for trigram in set(trigrams):
+        for compact in FUZZY_TRIGRAM_INDEX.get(trigram, ()):
+            shared[compact] += 1
+    best, best_distance = None, max_distance + 1
+    for compact, count in shared.items():
+        if count < min_shared or abs(len(compact) - len(word)) > max_distance:
+            continue
+        alias = FUZZY_COMPACT_ALIASES[compact]
+        limit = max_distance if QUERY_ALIAS_LOOKUP[alias][0] == 'state' else FUZZY_MAX_KEYWORD_DISTANCE
+        distance = bounded_edit_distance(word, compact, limit)
+        if distance > limit:
+            continue
+        if distance < best_distance or (distance == best_distance and len(compact) > len(best)):
+            best, best_distance = compact, distance
+    return (FUZZY_COMPACT_ALIASES[best], best_distance) if best else None
+
+def match_query_entities(query: str) -> Dict[str, Any]:
+    """Extract states, years and the target collection from a query in one regex pass.
+
+    Words left unmatched are then checked against the fuzzy alias index (alone and
+    joined with their neighbour) so common misspellings still resolve.
+    """
+    states = set()
+    years = []
+    collection_priorities = set()
+    corrections = {}
+    matched_spans = []
+
+    def add_alias(alias):
+        kind, value = QUERY_ALIAS_LOOKUP[alias]
+        if kind == 'state':
+            states.add(value)
+        else:
+            collection_priorities.add(value)
+
+    for match in QUERY_MATCHER.finditer(query):
+        matched_spans.append(match.span())
+        if match.group('year'):
+            year = int(match.group('year'))
+            if year not in years:
+                years.append(year)
+            continue
+        add_alias(' '.join(match.group(0).lower().split()))
+
+    words = [
+        word for word in re.finditer(r'[a-z]+', query.lower())
+        if not any(start < word.end() and word.start() < end for start, end in matched_spans)
+    ]
+    used = set()
+    for i, word in enumerate(words):
+        if i in used:
+            continue
+        best = None
+        match = fuzzy_match_alias(word.group())
+        if match:
+            best = ([i], match)
+        if i + 1 < len(words) and query[word.end():words[i + 1].start()].isspace():
+            # Join with the next word ("utar pradesh") unless that word matches as well on its own
+            pair = (word.group(), words[i + 1].group())
+            joinable = not any(part in FUZZY_STOP_WORDS or part in FUZZY_COMMON_WORDS for part in pair)
+            pair_match = fuzzy_match_alias(pair[0] + pair[1]) if joinable else None
+            next_match = fuzzy_match_alias(words[i + 1].group())
+            if pair_match and (best is None or pair_match[1] <= best[1][1]) and \
+                    (next_match is None or pair_match[1] < next_match[1]):
+                best = ([i, i + 1], pair_match)
+        if best:
+            indices, (alias, _) = best
+            add_alias(alias)
+            corrections[' '.join(words[j].group() for j in indices)] = alias
+            used.update(indices)
+
+    collection = data_type = None
+    if collection_priorities:
+        collection, data_type, _ = COLLECTION_KEYWORDS[min(collection_priorities)]
     return {
-        'states': detected_states,
-        'years': detected_years,
+        'states': sorted(states, key=STATE_ORDER.get),
+        'years': years,
         'collection': collection,
         'data_type': data_type,
+        'collections': [COLLECTION_KEYWORDS[priority][0] for priority in sorted(collection_priorities)],
+        'comparative': bool(COMPARATIVE_CUES.search(query)),
+        'corrections': corrections
+    }
+
+async def process_enhanced_query(query: str) -> Dict[str, Any]:
+    """Process queries with better state/year detection and specific responses"""
+    entities = match_query_entities(query)
+    
+    return {
+        'states': entities['states'],
+        'years': entities['years'],
+        'collection': entities['collection'],
+        'data_type': entities['data_type'],
+        'collections': entities['collections'],
+        'comparative': entities['comparative'],
+        'corrections': entities['corrections'],
         'original_query': query
     }
 
+# Canonical state index
+# Built from distinct("state") across collections plus STATE_ALIASES so every endpoint
+# can map user-supplied state names to the spellings actually stored in the database.
+STATE_INDEX_TTL_SECONDS = 3600
+
+state_index: Dict[str, Any] = {"names": {}, "groups": {}, "by_collection": {}, "built_at": None}
+state_index_lock = asyncio.Lock()
+
+def state_key(name: str) -> str:
+    """Normalize a state name for lookup: lowercase, '&' as 'and', punctuation collapsed"""
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', name.lower().replace('&', ' and ')).split())
+
+async def build_state_index() -> Dict[str, Any]:
+    """Collect stored state spellings per collection and index them with the alias table"""
+    collections = [c for c in await db.list_collection_names() if not c.startswith('system.')]
+    distinct_states = await asyncio.gather(
+        *(db[c].distinct("state") for c in collections),
+        return_exceptions=True
+    )
+    by_collection = {}
+    db_names = defaultdict(set)
+    for collection_name, names in zip(collections, distinct_states):
+        if isinstance(names, Exception):
+            logging.error(f"Error indexing states for {collection_name}: {names}")
+            continue
+        names = {name for name in names if isinstance(name, str) and name.strip()}
+        if names:
+            by_collection[collection_name] = names
+        for name in names:
+            db_names[state_key(name)].add(name)
+
+    # Stored spellings resolve to themselves; aliases resolve to their whole group
+    names_index = {key: sorted(names) for key, names in db_names.items()}
+    groups = {}
+    for canonical, variations in STATE_ALIASES.items():
+        keys = {state_key(canonical)} | {state_key(variation) for variation in variations}
+        group = sorted({name for key in keys for name in db_names.get(key, ())})
+        if group:
+            groups[state_key(canonical)] = group
+            for key in keys:
+                names_index.setdefault(key, group)
+
+    return {"names": names_index, "groups": groups, "by_collection": by_collection, "built_at": time.monotonic()}
+
+async def get_state_index() -> Dict[str, Any]:
+    """Return the state index, building it on first use and refreshing it hourly"""
+    built_at = state_index["built_at"]
+    if built_at is not None and time.monotonic() - built_at < STATE_INDEX_TTL_SECONDS:
+        return state_index
+    async with state_index_lock:
+        built_at = state_index["built_at"]
+        if built_at is None or time.monotonic() - built_at >= STATE_INDEX_TTL_SECONDS:
+            try:
+                state_index.update(await build_state_index())
+            except Exception as e:
+                logging.error(f"Error building state index: {e}")
+                # Retry in a minute instead of on every request
+                state_index["built_at"] = time.monotonic() - STATE_INDEX_TTL_SECONDS + 60
+    return state_index
+
+async def resolve_state_names(names: List[str], collection_name: Optional[str] = None,
+                              expand_aliases: bool = False) -> List[str]:
+    """Map user or chat state names to stored spellings.
+
+    expand_aliases resolves detected chat states (e.g. 'mumbai') to their whole alias
+    group. With collection_name, names not present in that collection are dropped, so
+    an empty result means the query cannot match anything.
+    """
+    index = await get_state_index()
+    collection_states = index["by_collection"].get(collection_name) if collection_name else None
+    resolved = []
+    for name in names:
+        key = state_key(name)
+        matches = (expand_aliases and index["groups"].get(key)) or index["names"].get(key)
+        if not matches:
+            if index["names"]:
+                continue  # Not a stored spelling or known alias
+            # Index unavailable: fall back to the alias table and title case
+            variations = STATE_ALIASES.get(key, [])
+            matches = [name.strip()] if not expand_aliases else [v.title() for v in variations] or [name.title()]
+        for match in matches:
+            if collection_states is not None and match not in collection_states:
+                continue
+            if match not in resolved:
+                resolved.append(match)
+    return resolved
+
+# Cross-collection join engine
+# Primary metric of each collection: candidate field names (the first one present in
+# the data wins) and how rows roll up to a single value per (state, year).
+COLLECTION_METRICS = {
+    'crimes': {'fields': ['cases_reported'], 'rollup': 'sum'},
+    'literacy': {'fields': ['literacy_rate'], 'rollup': 'avg'},
+    'aqi': {'fields': ['avg_aqi', 'aqi'], 'rollup': 'avg'},
+    'power_consumption': {'fields': ['power_consumption_gwh', 'consumption'], 'rollup': 'sum'},
+    'covid_stats': {'fields': ['deaths', 'confirmed'], 'rollup': 'sum'}
+}
+ROLLUP_CACHE_TTL_SECONDS = 300
+ROLLUP_CACHE_MAX_ENTRIES = 256
+DATA_VERSION_TTL_SECONDS = 30
+JOIN_MAX_COLLECTIONS = 5
+
+metric_field_cache: Dict[str, str] = {}
+rollup_cache: Dict[str, Tuple[float, Dict[Tuple[str, int], float]]] = {}
+data_version_cache: Dict[str, Tuple[float, str]] = {}
+
+async def get_data_version(collection_name: str) -> str:
+    """Cheap fingerprint of a collection's contents: document count plus newest _id.
+
+    In-place updates do not change it, so caches keyed on it also keep a TTL.
+    """
+    cached = data_version_cache.get(collection_name)
+    if cached and time.monotonic() - cached[0] < DATA_VERSION_TTL_SECONDS:
+        return cached[1]
+    count, newest = await asyncio.gather(
+        db[collection_name].estimated_document_count(),
+        db[collection_name].find_one(sort=[("_id", -1)], projection={"_id": 1})
+    )
+    version = f"{count}:{newest['_id'] if newest else ''}"
+    data_version_cache[collection_name] = (time.monotonic(), version)
+    return version
+
+def cache_put(cache: Dict, key: str, value: Any, max_entries: int):
+    """Insert into a dict cache, evicting the oldest entries beyond max_entries"""
+    cache.pop(key, None)
+    cache[key] = value
+    while len(cache) > max_entries:
+        cache.pop(next(iter(cache)))
+
+async def get_metric_field(collection_name: str) -> Optional[str]:
+    """Name of the numeric field that represents a collection's primary metric"""
+    if collection_name in metric_field_cache:
+        return metric_field_cache[collection_name]
+    sample = await db[collection_name].find_one()
+    if not sample:
+        return None
+    candidates = COLLECTION_METRICS.get(collection_name, {}).get('fields', [])
+    numeric_fields = [
+        key for key, value in sample.items()
+        if key not in ('_id', 'year') and isinstance(value, (int, float)) and not isinstance(value, bool)
+    ]
+    field = next((f for f in candidates if f in numeric_fields), numeric_fields[0] if numeric_fields else None)
+    if field:
+        metric_field_cache[collection_name] = field
+    return field
+
+def build_state_year_query(collection_name: str, states: Optional[List[str]] = None,
+                           years: Optional[List[int]] = None) -> Dict[str, Any]:
+    """Mongo filter for stored state names and years (covid_stats keeps years in its date string)"""
+    query = {}
+    if states is not None:
+        query["state"] = {"$in": states}
+    if collection_name == "covid_stats":
+        date_filter = {"date": {"$regex": "^[0-9]{4}-"}}
+        if years:
+            query["$or"] = [{"date": {"$regex": f"^{year}-"}} for year in years]
+        return {"$and": [query, date_filter]} if query else date_filter
+    if years:
+        query["year"] = {"$in": years}
+    return query
+
+def year_expression(collection_name: str):
+    """Aggregation expression for a document's year"""
+    if collection_name == "covid_stats":
+        return {"$toInt": {"$substr": ["$date", 0, 4]}}
+    return "$year"
+
+async def fetch_state_year_rollup(collection_name: str, states: Optional[List[str]] = None,
+                                  years: Optional[List[int]] = None) -> Dict[Tuple[str, int], float]:
+    """One value per (state, year) for the collection's primary metric, aggregated in Mongo"""
+    version = await get_data_version(collection_name)
+    cache_key = json.dumps([collection_name, version, states, years], default=str)
+    cached = rollup_cache.get(cache_key)
+    if cached and time.monotonic() - cached[0] < ROLLUP_CACHE_TTL_SECONDS:
+        return cached[1]
+
+    field = await get_metric_field(collection_name)
+    if field is None:
+        return {}
+    rollup = COLLECTION_METRICS.get(collection_name, {}).get('rollup', 'avg')
+    pipeline = [
+        {"$match": build_state_year_query(collection_name, states, years)},
+        {"$group": {
+            "_id": {"state": "$state", "year": year_expression(collection_name)},
+            "value": {f"${rollup}": f"${field}"}
+        }}
+    ]
+    results = await db[collection_name].aggregate(pipeline).to_list(None)
+    values = {}
+    for result in results:
+        state, year = result["_id"].get("state"), result["_id"].get("year")
+        if state and year is not None and result["value"] is not None:
+            values[(state, int(year))] = float(result["value"])
+    cache_put(rollup_cache, cache_key, (time.monotonic(), values), ROLLUP_CACHE_MAX_ENTRIES)
+    return values
+
+async def join_collections(collections: List[str], states: Optional[List[str]] = None,
+                           years: Optional[List[int]] = None, expand_aliases: bool = False) -> Dict[str, Any]:
+    """Align the primary metrics of several collections with a hash join on (state, year).
+
+    State spellings are matched through state_key. When the collections share no years
+    (e.g. census-year literacy against yearly crime counts) the join falls back to one
+    row per state with each metric averaged over its years.
+    """
+    async def load(collection_name):
+        state_names = None
+        if states:
+            state_names = await resolve_state_names(states, collection_name, expand_aliases=expand_aliases)
+        if state_names == []:
+            return {}
+        return await fetch_state_year_rollup(collection_name, state_names, years)
+
+    rollups, fields = await asyncio.gather(
+        asyncio.gather(*(load(c) for c in collections)),
+        asyncio.gather(*(get_metric_field(c) for c in collections))
+    )
+
+    # Re-key every side by normalized state so differing spellings still align
+    display_names = {}
+    keyed = []
+    for rollup in rollups:
+        side = {}
+        for (state, year), value in rollup.items():
+            key = state_key(state)
+            display_names.setdefault(key, state)
+            side[(key, year)] = value
+        keyed.append(side)
+
+    def hash_join(sides):
+        # Build on the smallest side and probe the others
+        build = min(sides, key=len)
+        return sorted(k for k in build if all(k in side for side in sides))
+
+    on = "state_year"
+    join_keys = hash_join(keyed)
+    if not join_keys:
+        on = "state"
+        per_state_sides = []
+        for side in keyed:
+            grouped = defaultdict(list)
+            for (key, _), value in side.items():
+                grouped[key].append(value)
+            per_state_sides.append({(key, None): float(np.mean(values)) for key, values in grouped.items()})
+        keyed = per_state_sides
+        join_keys = hash_join(keyed)
+
+    rows = []
+    for key, year in join_keys:
+        row = {"state": display_names[key]}
+        if on == "state_year":
+            row["year"] = year
+        for collection_name, side in zip(collections, keyed):
+            row[collection_name] = side[(key, year)]
+        rows.append(row)
+
+    return {
+        "on": on,
+        "columns": ["state", "year", *collections] if on == "state_year" else ["state", *collections],
+        "rows": rows,
+        "metrics": {
+            collection_name: {
+                "field": field,
+                "rollup": COLLECTION_METRICS.get(collection_name, {}).get('rollup', 'avg')
+            }
+            for collection_name, field in zip(collections, fields)
+        }
+    }
+
+def pairwise_correlations(frame: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Pearson correlation between each pair of joined metrics"""
+    collections = list(frame["metrics"])
+    if len(frame["rows"]) < 3:
+        return []
+    matrix = np.array([[row[c] for c in collections] for row in frame["rows"]], dtype=float)
+    correlations = []
+    for i in range(len(collections)):
+        for j in range(i + 1, len(collections)):
+            if np.std(matrix[:, i]) == 0 or np.std(matrix[:, j]) == 0:
+                continue
+            correlations.append({
+                "metrics": [collections[i], collections[j]],
+                "pearson": round(float(np.corrcoef(matrix[:, i], matrix[:, j])[0, 1]), 3),
+                "observations": len(frame["rows"])
+            })
+    return correlations
+
+def describe_correlation(value: float) -> str:
+    strength = abs(value)
+    if strength >= 0.7:
+        label = "strong"
+    elif strength >= 0.4:
+        label = "moderate"
+    elif strength >= 0.2:
+        label = "weak"
+    else:
+        return "no meaningful"
+    return f"a {label} {'positive' if value > 0 else 'negative'}"
+
+async def generate_comparative_response(frame: Dict[str, Any], query_info: Dict,
+                                        national_frame: Optional[Dict[str, Any]] = None) -> str:
+    """Human-readable summary of a cross-collection join"""
+    labels = {collection: data_type for collection, data_type, _ in COLLECTION_KEYWORDS}
+    metric_names = [labels.get(c, c).title() for c in frame["metrics"]]
+    states_str = ", ".join(s.title() for s in query_info['states']) if query_info['states'] else "all states"
+
+    response = f"📊 **{' vs '.join(metric_names)}**\n\n"
+    response += f"For **{states_str}**, {len(frame['rows'])} aligned "
+    response += "state-year records" if frame["on"] == "state_year" else "state records (averaged over available years)"
+    response += ":\n"
+
+    for collection_name, name in zip(frame["metrics"], metric_names):
+        values = [row[collection_name] for row in frame["rows"]]
+        if values:
+            response += f"• **{name}** ({frame['metrics'][collection_name]['field']}): average {np.mean(values):,.1f}, range {min(values):,.1f} – {max(values):,.1f}\n"
+
+    correlations = pairwise_correlations(frame)
+    scope = "Within this selection"
+    if not correlations and national_frame:
+        correlations = pairwise_correlations(national_frame)
+        scope = f"Across all {len(national_frame['rows'])} aligned records nationally"
+    if correlations:
+        response += "\n**Relationships**:\n"
+        for correlation in correlations:
+            first, second = (labels.get(c, c) for c in correlation["metrics"])
+            response += f"• {scope}, {first} and {second} show {describe_correlation(correlation['pearson'])} correlation (r = {correlation['pearson']})\n"
+    else:
+        response += "\nThere are too few overlapping records to estimate a correlation."
+
+    response += "\n💡 **Tip**: Correlation does not imply causation — compare more states or years for a fuller picture!"
+    return response
+
+# Cross-dataset analytics
+ANALYTICS_CACHE_MAX_ENTRIES = 128
+CORRELATION_MAX_LAG = 3
+
+analytics_cache: Dict[str, Dict[str, Any]] = {}
+
+async def load_metric_matrices(collections: List[str], states: Optional[List[str]] = None,
+                               years: Optional[List[int]] = None) -> Dict[str, Any]:
+    """Stack each collection's (state, year) rollup into a state x year matrix (NaN where missing)"""
+    async def load(collection_name):
+        state_names = await resolve_state_names(states, collection_name) if states else None
+        if state_names == []:
+            return {}
+        return await fetch_state_year_rollup(collection_name, state_names, years)
+
+    rollups, fields = await asyncio.gather(
+        asyncio.gather(*(load(c) for c in collections)),
+        asyncio.gather(*(get_metric_field(c) for c in collections))
+    )
+    display_names = {}
+    keyed = []
+    for rollup in rollups:
+        side = {}
+        for (state, year), value in rollup.items():
+            key = state_key(state)
+            display_names.setdefault(key, state)
+            side[(key, year)] = value
+        keyed.append(side)
+
+    state_keys = sorted({key for side in keyed for key, _ in side})
+    all_years = sorted({year for side in keyed for _, year in side})
+    state_pos = {key: i for i, key in enumerate(state_keys)}
+    year_pos = {year: i for i, year in enumerate(all_years)}
+    matrices = np.full((len(collections), len(state_keys), len(all_years)), np.nan)
+    for c, side in enumerate(keyed):
+        if side:
+            rows = [state_pos[key] for key, _ in side]
+            cols = [year_pos[year] for _, year in side]
+            matrices[c, rows, cols] = list(side.values())
+
+    return {
+        "matrices": matrices,
+        "states": [display_names[key] for key in state_keys],
+        "years": all_years,
+        "fields": dict(zip(collections, fields))
+    }
+
+def rank_average(values: np.ndarray) -> np.ndarray:
+    """Ranks with ties sharing their average rank (for Spearman correlation)"""
+    order = np.argsort(values, kind="mergesort")
+    sorted_values = values[order]
+    # Boundaries of runs of equal values
+    starts = np.flatnonzero(np.r_[True, sorted_values[1:] != sorted_values[:-1]])
+    ends = np.r_[starts[1:], len(values)]
+    average_ranks = (starts + ends - 1) / 2.0 + 1
+    ranks = np.empty(len(values))
+    ranks[order] = np.repeat(average_ranks, ends - starts)
+    return ranks
+
+def pearson(x: np.ndarray, y: np.ndarray) -> Optional[float]:
+    if len(x) < 3:
+        return None
+    x = x - x.mean()
+    y = y - y.mean()
+    denominator = np.sqrt((x * x).sum() * (y * y).sum())
+    if denominator == 0:
+        return None
+    return float((x * y).sum() / denominator)
+
+def correlation_matrices(series: np.ndarray) -> Dict[str, Any]:
+    """Pairwise-complete Pearson and Spearman matrices for rows of a (metrics x observations) array"""
+    count = series.shape[0]
+    present = ~np.isnan(series)
+    # Observations both metrics have, for every pair at once
+    overlap = present.astype(int) @ present.T.astype(int)
+    pearson_matrix = [[None] * count for _ in range(count)]
+    spearman_matrix = [[None] * count for _ in range(count)]
+    for i in range(count):
+        for j in range(i, count):
+            mask = present[i] & present[j]
+            x, y = series[i, mask], series[j, mask]
+            r = pearson(x, y)
+            rho = pearson(rank_average(x), rank_average(y)) if r is not None else None
+            for a, b in ((i, j), (j, i)):
+                pearson_matrix[a][b] = None if r is None else round(r, 4)
+                spearman_matrix[a][b] = None if rho is None else round(rho, 4)
+    return {
+        "pearson": pearson_matrix,
+        "spearman": spearman_matrix,
+        "observations": overlap.tolist()
+    }
+
+def lagged_correlations(matrices: np.ndarray, collections: List[str], max_lag: int) -> List[Dict[str, Any]]:
+    """Correlate metric A in year t with metric B in year t + lag, pooled across states"""
+    results = []
+    year_count = matrices.shape[2]
+    for lag in range(1, min(max_lag, year_count - 1) + 1):
+        leading = matrices[:, :, :-lag].reshape(len(collections), -1)
+        following = matrices[:, :, lag:].reshape(len(collections), -1)
+        for i, leader in enumerate(collections):
+            for j, follower in enumerate(collections):
+                mask = ~np.isnan(leading[i]) & ~np.isnan(following[j])
+                r = pearson(leading[i, mask], following[j, mask])
+                if r is not None:
+                    results.append({
+                        "leading": leader,
+                        "following": follower,
+                        "lag_years": lag,
+                        "pearson": round(r, 4),
+                        "observations": int(mask.sum())
+                    })
+    return results
+
+async def compute_correlation_analytics(collections: List[str], states: Optional[List[str]] = None,
+                                        years: Optional[List[int]] = None, max_lag: int = 1) -> Dict[str, Any]:
+    """Correlation matrices across datasets, cached per data version"""
+    versions = await asyncio.gather(*(get_data_version(c) for c in collections))
+    cache_key = json.dumps(["correlation", collections, versions, states, years, max_lag], default=str)
+    if cache_key in analytics_cache:
+        return {**analytics_cache[cache_key], "cached": True}
+
+    started = time.perf_counter()
+    loaded = await load_metric_matrices(collections, states, years)
+    matrices = loaded["matrices"]
+    metric_count = len(collections)
+
+    # State x year cells pooled, and a cross-section of per-state means for datasets
+    # measured in different years (e.g. census literacy)
+    counts = (~np.isnan(matrices)).sum(axis=2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        state_means = np.where(counts > 0, np.nansum(matrices, axis=2) / counts, np.nan)
+    result = {
+        "metrics": collections,
+        "fields": loaded["fields"],
+        "states": loaded["states"],
+        "years": loaded["years"],
+        "state_year": correlation_matrices(matrices.reshape(metric_count, -1)),
+        "state_level": correlation_matrices(state_means),
+        "lagged": lagged_correlations(matrices, collections, max_lag) if max_lag > 0 else [],
+        "data_versions": dict(zip(collections, versions)),
+        "computed_in_ms": round((time.perf_counter() - started) * 1000, 2)
+    }
+    cache_put(analytics_cache, cache_key, result, ANALYTICS_CACHE_MAX_ENTRIES)
+    return {**result, "cached": False}
+
+# Trend fitting and short-horizon forecasting
+FORECAST_MAX_HORIZON = 3
+# Two-sided 95% t critical values by degrees of freedom (index 0 unused); 1.96 beyond 30
+T_CRITICAL_95 = np.array([
+    np.nan, 12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+    2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+    2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042
+])
+
+def t_critical(degrees_of_freedom: np.ndarray) -> np.ndarray:
+    df = np.asarray(degrees_of_freedom, dtype=int)
+    return np.where(df > 30, 1.96, T_CRITICAL_95[np.clip(df, 0, 30)])
+
+def fit_linear_trends(years: np.ndarray, values: np.ndarray, method: str = "ols") -> Dict[str, np.ndarray]:
+    """Fit value = intercept + slope * year for every row of a (series x years) array at once.
+
+    Missing values (NaN) are ignored per series. method="robust" uses the Theil-Sen
+    estimator (median of pairwise slopes); its interval reuses the residual-based
+    OLS standard error and is therefore approximate.
+    """
+    present = ~np.isnan(values)
+    weights = present.astype(float)
+    filled = np.where(present, values, 0.0)
+    n = weights.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x_mean = (weights * years).sum(axis=1) / n
+        y_mean = filled.sum(axis=1) / n
+        dx = np.where(present, years - x_mean[:, None], 0.0)
+        dy = np.where(present, filled - y_mean[:, None], 0.0)
+        sxx = (dx * dx).sum(axis=1)
+        if method == "robust":
+            i, j = np.triu_indices(len(years), k=1)
+            pair_slopes = (values[:, j] - values[:, i]) / (years[j] - years[i])
+            has_pairs = (~np.isnan(pair_slopes)).any(axis=1)
+            slope = np.full(len(values), np.nan)
+            if has_pairs.any():
+                slope[has_pairs] = np.nanmedian(pair_slopes[has_pairs], axis=1)
+            offsets = np.where(present, values - slope[:, None] * years, np.nan)
+            intercept = np.full(len(values), np.nan)
+            has_offsets = present.any(axis=1) & ~np.isnan(slope)
+            if has_offsets.any():
+                intercept[has_offsets] = np.nanmedian(offsets[has_offsets], axis=1)
+        else:
+            slope = (dx * dy).sum(axis=1) / sxx
+            intercept = y_mean - slope * x_mean
+        fitted = intercept[:, None] + slope[:, None] * years
+        residuals = np.where(present, values - fitted, 0.0)
+        sse = (residuals * residuals).sum(axis=1)
+        sst = (dy * dy).sum(axis=1)
+        residual_variance = sse / (n - 2)
+        slope_se = np.sqrt(residual_variance / sxx)
+        margin = t_critical(np.maximum(n - 2, 0)) * slope_se
+        r_squared = 1 - sse / sst
+    return {
+        "n": n,
+        "slope": slope,
+        "intercept": intercept,
+        "slope_ci_low": slope - margin,
+        "slope_ci_high": slope + margin,
+        "r_squared": r_squared,
+        "residual_variance": residual_variance,
+        "x_mean": x_mean,
+        "y_mean": y_mean,
+        "sxx": sxx
+    }
+
+def classify_trends(fit: Dict[str, np.ndarray]) -> List[Optional[str]]:
+    """increasing/decreasing when the slope is significant and material, else stable or volatile"""
+    labels = []
+    for i in range(len(fit["slope"])):
+        n, slope, mean = fit["n"][i], fit["slope"][i], fit["y_mean"][i]
+        if n < 3 or np.isnan(slope):
+            labels.append(None)
+            continue
+        scale = abs(mean) if mean else 1.0
+        significant = fit["slope_ci_low"][i] > 0 or fit["slope_ci_high"][i] < 0
+        if significant and abs(slope) / scale >= 0.01:
+            labels.append("increasing" if slope > 0 else "decreasing")
+        elif np.sqrt(max(fit["residual_variance"][i], 0)) / scale > 0.25:
+            labels.append("volatile")
+        else:
+            labels.append("stable")
+    return labels
+
+def project_trends(fit: Dict[str, np.ndarray], future_years: np.ndarray) -> Dict[str, np.ndarray]:
+    """Point projections with 95% prediction intervals for each series"""
+    x = future_years[None, :]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        value = fit["intercept"][:, None] + fit["slope"][:, None] * x
+        spread = np.sqrt(fit["residual_variance"][:, None] * (
+            1 + 1 / fit["n"][:, None] + (x - fit["x_mean"][:, None]) ** 2 / fit["sxx"][:, None]
+        ))
+        margin = t_critical(np.maximum(fit["n"] - 2, 0))[:, None] * spread
+    return {"value": value, "lower": value - margin, "upper": value + margin}
+
+def json_number(value, digits: int = 4):
+    """Round a NumPy scalar for JSON, mapping NaN/inf to None"""
+    value = float(value)
+    return round(value, digits) if np.isfinite(value) else None
+
+async def compute_trend_forecast(collection_name: str, states: Optional[List[str]] = None,
+                                 years: Optional[List[int]] = None, horizon: int = FORECAST_MAX_HORIZON,
+                                 method: str = "ols") -> Dict[str, Any]:
+    """Fit every state's yearly series (and the national aggregate) and project it forward"""
+    version = await get_data_version(collection_name)
+    cache_key = json.dumps(["forecast", collection_name, version, states, years, horizon, method], default=str)
+    if cache_key in analytics_cache:
+        return {**analytics_cache[cache_key], "cached": True}
+
+    loaded = await load_metric_matrices([collection_name], states, years)
+    matrix = loaded["matrices"][0]
+    year_axis = np.array(loaded["years"], dtype=float)
+    rollup = COLLECTION_METRICS.get(collection_name, {}).get('rollup', 'avg')
+
+    # National series: total or mean over the states that report in every year, so a
+    # state dropping in or out of the data does not read as a national rise or fall.
+    # Without any fully covered state, sums are scaled up by each year's coverage instead.
+    observed = ~np.isnan(matrix)
+    reporting = observed.sum(axis=0)
+    complete = observed.all(axis=1) if matrix.size else np.zeros(0, dtype=bool)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if complete.any():
+            panel = matrix[complete]
+            national = panel.sum(axis=0) if rollup == "sum" else panel.mean(axis=0)
+            national_basis = "complete_states"
+        else:
+            means = np.where(reporting > 0, np.nansum(matrix, axis=0) / reporting, np.nan)
+            national = means * matrix.shape[0] if rollup == "sum" else means
+            national_basis = "coverage_scaled"
+    series = np.vstack([national[None, :], matrix]) if matrix.size else np.empty((1, 0))
+
+    fit = fit_linear_trends(year_axis, series, method)
+    labels = classify_trends(fit)
+    future_years = year_axis.max() + np.arange(1, horizon + 1) if len(year_axis) else np.empty(0)
+    projections = project_trends(fit, future_years)
+
+    def describe(i, name):
+        return {
+            "state": name,
+            "observations": int(fit["n"][i]),
+            "slope_per_year": json_number(fit["slope"][i]),
+            "slope_ci_95": [json_number(fit["slope_ci_low"][i]), json_number(fit["slope_ci_high"][i])],
+            "intercept": json_number(fit["intercept"][i]),
+            "r_squared": json_number(fit["r_squared"][i]),
+            "trend": labels[i],
+            "projections": [
+                {
+                    "year": int(year),
+                    "value": json_number(projections["value"][i, k]),
+                    "lower_95": json_number(projections["lower"][i, k]),
+                    "upper_95": json_number(projections["upper"][i, k])
+                }
+                for k, year in enumerate(future_years)
+            ] if fit["n"][i] >= 3 else []
+        }
+
+    result = {
+        "collection": collection_name,
+        "field": loaded["fields"][collection_name],
+        "method": method,
+        "horizon": horizon,
+        "years": loaded["years"],
+        "overall": {
+            **describe(0, "All states"),
+            "basis": national_basis,
+            "states_in_series": int(complete.sum()) if national_basis == "complete_states" else len(loaded["states"])
+        },
+        "states": [describe(i + 1, name) for i, name in enumerate(loaded["states"])],
+        "data_version": version
+    }
+    cache_put(analytics_cache, cache_key, result, ANALYTICS_CACHE_MAX_ENTRIES)
+    return {**result, "cached": False}
+
+async def apply_fitted_trend(insights: Dict[str, Any], collection_name: str,
+                             query: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Replace the LLM's guessed trend with the fitted one for the filtered states"""
+    if not isinstance(insights, dict) or collection_name not in COLLECTION_METRICS:
+        return insights
+    try:
+        states = query_filter_values(query, "state")
+        forecast = await compute_trend_forecast(collection_name, states, horizon=1)
+        overall = forecast["overall"]
+        if overall["trend"]:
+            insights = {
+                **insights,
+                "trend": overall["trend"],
+                "trend_analysis": {
+                    "slope_per_year": overall["slope_per_year"],
+                    "slope_ci_95": overall["slope_ci_95"],
+                    "r_squared": overall["r_squared"],
+                    "observations": overall["observations"],
+                    "field": forecast["field"],
+                    "next_year": overall["projections"][0] if overall["projections"] else None
+                }
+            }
+    except Exception as e:
+        logging.error(f"Trend fitting error for {collection_name}: {e}")
+    return insights
+
+# Anomaly detection
+# Robust z-scores (median/MAD) flag values far from their peers in the same year,
+# from a state's own history, and sudden jumps between consecutive periods.
+ANOMALY_Z_THRESHOLD = 3.5
+JUMP_Z_THRESHOLD = 6.0
+ANOMALY_MIN_GROUP_SIZE = 5
+ANOMALY_MAX_RESULTS = 200
+INSIGHT_ANOMALY_LIMIT = 5
+
+def robust_z_scores(values: np.ndarray, axis: int, min_count: int = ANOMALY_MIN_GROUP_SIZE) -> Tuple[np.ndarray, np.ndarray]:
+    """0.6745 * (x - median) / MAD along an axis; NaN where the group is too small or flat"""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        median = np.nanmedian(values, axis=axis, keepdims=True)
+        mad = np.nanmedian(np.abs(values - median), axis=axis, keepdims=True)
+    counts = (~np.isnan(values)).sum(axis=axis, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        z = 0.6745 * (values - median) / mad
+    z[np.broadcast_to((mad == 0) | (counts < min_count), z.shape)] = np.nan
+    return z, np.broadcast_to(median, values.shape)
+
+def flag_outliers(z: np.ndarray, threshold: float) -> Tuple[np.ndarray, np.ndarray]:
+    with np.errstate(invalid="ignore"):
+        return np.nonzero(np.abs(z) > threshold)
+
+async def fetch_daily_series(collection_name: str, field: str) -> Dict[str, Any]:
+    """Per-state daily totals for date-keyed collections, as a states x dates matrix"""
+    pipeline = [
+        {"$match": {"date": {"$regex": "^[0-9]{4}-"}}},
+        {"$group": {"_id": {"state": "$state", "date": "$date"}, "value": {"$sum": f"${field}"}}}
+    ]
+    results = await db[collection_name].aggregate(pipeline).to_list(None)
+    rows = [r for r in results if r["_id"].get("state") and r["value"] is not None]
+    states = sorted({r["_id"]["state"] for r in rows})
+    dates = sorted({r["_id"]["date"] for r in rows})
+    state_pos = {state: i for i, state in enumerate(states)}
+    date_pos = {date: i for i, date in enumerate(dates)}
+    matrix = np.full((len(states), len(dates)), np.nan)
+    for r in rows:
+        matrix[state_pos[r["_id"]["state"]], date_pos[r["_id"]["date"]]] = r["value"]
+    return {"states": states, "periods": dates, "matrix": matrix}
+
+async def compute_collection_anomalies(collection_name: str) -> Dict[str, Any]:
+    """Scan a whole collection for anomalies; cached per data version"""
+    version = await get_data_version(collection_name)
+    cache_key = json.dumps(["anomalies", collection_name, version])
+    if cache_key in analytics_cache:
+        return analytics_cache[cache_key]
+
+    started = time.perf_counter()
+    loaded = await load_metric_matrices([collection_name])
+    field = loaded["fields"][collection_name]
+    matrix = loaded["matrices"][0]
+    states, years = loaded["states"], loaded["years"]
+    anomalies = []
+
+    label = (field or "value").replace("_", " ")
+
+    def fmt(value):
+        return f"{value:,.1f}"
+
+    if matrix.size:
+        # Against other states in the same year
+        z, baseline = robust_z_scores(matrix, axis=0)
+        for i, j in zip(*flag_outliers(z, ANOMALY_Z_THRESHOLD)):
+            direction = "higher" if z[i, j] > 0 else "lower"
+            anomalies.append({
+                "type": "cross_sectional", "state": states[i], "period": str(years[j]),
+                "value": float(matrix[i, j]), "baseline": float(baseline[i, j]), "robust_z": float(z[i, j]),
+                "description": f"{states[i]} {label} in {years[j]} ({fmt(matrix[i, j])}) is far {direction} than the typical state ({fmt(baseline[i, j])})"
+            })
+        # Against the state's own history
+        z, baseline = robust_z_scores(matrix, axis=1)
+        for i, j in zip(*flag_outliers(z, ANOMALY_Z_THRESHOLD)):
+            direction = "above" if z[i, j] > 0 else "below"
+            anomalies.append({
+                "type": "temporal", "state": states[i], "period": str(years[j]),
+                "value": float(matrix[i, j]), "baseline": float(baseline[i, j]), "robust_z": float(z[i, j]),
+                "description": f"{states[i]} {label} in {years[j]} ({fmt(matrix[i, j])}) is well {direction} its usual level ({fmt(baseline[i, j])})"
+            })
+
+    # Sudden jumps between consecutive periods (daily for date-keyed collections)
+    if collection_name == "covid_stats" and field:
+        series = await fetch_daily_series(collection_name, field)
+    else:
+        series = {"states": states, "periods": [str(year) for year in years], "matrix": matrix}
+    if series["matrix"].shape[1] > 1:
+        changes = np.diff(series["matrix"], axis=1)
+        z, baseline = robust_z_scores(changes, axis=1)
+        for i, j in zip(*flag_outliers(z, JUMP_Z_THRESHOLD)):
+            state, period = series["states"][i], series["periods"][j + 1]
+            anomalies.append({
+                "type": "jump", "state": state, "period": period,
+                "value": float(changes[i, j]), "baseline": float(baseline[i, j]), "robust_z": float(z[i, j]),
+                "description": f"Sudden {'jump' if changes[i, j] > 0 else 'drop'} in {label} for {state} at {period}: {changes[i, j]:+,.1f} vs a typical change of {baseline[i, j]:+,.1f}"
+            })
+
+    # Keep every flagged cell: callers filter by state/year first and truncate afterwards
+    anomalies.sort(key=lambda a: abs(a["robust_z"]), reverse=True)
+    result = {
+        "collection": collection_name,
+        "field": field,
+        "anomalies": anomalies,
+        "total_detected": len(anomalies),
+        "data_version": version,
+        "computed_at": datetime.utcnow().isoformat(),
+        "computed_in_ms": round((time.perf_counter() - started) * 1000, 2)
+    }
+    cache_put(analytics_cache, cache_key, result, ANALYTICS_CACHE_MAX_ENTRIES)
+    return result
+
+async def get_detected_anomalies(collection_name: str, states: Optional[List[str]] = None,
+                                 years: Optional[List[int]] = None, limit: int = INSIGHT_ANOMALY_LIMIT) -> List[Dict[str, Any]]:
+    """Precomputed anomalies for a collection, narrowed to stored state names and years"""
+    if collection_name not in COLLECTION_METRICS:
+        return []
+    detected = await compute_collection_anomalies(collection_name)
+    state_set = set(states) if states else None
+    year_prefixes = tuple(str(year) for year in years) if years else None
+    selected = []
+    for anomaly in detected["anomalies"]:
+        if state_set is not None and anomaly["state"] not in state_set:
+            continue
+        if year_prefixes and not anomaly["period"].startswith(year_prefixes):
+            continue
+        selected.append(anomaly)
+        if len(selected) >= limit:
+            break
+    return selected
+
+# Quantile sketches
+# Mergeable KLL sketches per (state, year) cell and numeric field answer percentile
+# questions without touching the raw documents. They are refreshed incrementally from
+# documents newer than the last ingested _id and merged up to per-state, per-year and
+# collection-wide sketches. Refreshes run as background tasks; requests read the last
+# sketches built and only a collection that has none yet waits for its first build.
+QUANTILE_SKETCH_K = int(os.environ.get('QUANTILE_SKETCH_K', '200'))
+QUANTILE_SKETCH_REBUILD_SECONDS = 3600
+DISTRIBUTION_PERCENTILES = [1, 5, 10, 25, 50, 75, 90, 95, 99]
+
+class KLLSketch:
+    """KLL quantile sketch (Karnin, Lang, Liberty 2016).
+
+    Items live in compactors of increasing weight; a full compactor sorts itself and
+    promotes every other item to the next level. Rank error is about 1.65 / k with
+    high probability, and sketches of disjoint data merge without losing accuracy.
+    """
+
+    def __init__(self, k: int = QUANTILE_SKETCH_K):
+        self.k = k
+        self.compactors: List[List[float]] = [[]]
+        self.size = 0
+        self.count = 0
+        self.min = float("inf")
+        self.max = float("-inf")
+        self.max_size = self.capacity(0)
+
+    def capacity(self, level: int) -> int:
+        depth = len(self.compactors) - level - 1
+        return int(np.ceil(self.k * (2.0 / 3.0) ** depth)) + 1
+
+    def grow(self):
+        self.compactors.append([])
+        self.max_size = sum(self.capacity(level) for level in range(len(self.compactors)))
+
+    def update(self, value: float):
+        self.compactors[0].append(value)
+        self.size += 1
+        self.count += 1
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if self.size >= self.max_size:
+            self.compress()
+
+    def compress(self):
+        for level in range(len(self.compactors)):
+            items = self.compactors[level]
+            if len(items) >= self.capacity(level):
+                if level + 1 >= len(self.compactors):
+                    self.grow()
+                items.sort()
+                # Keep one item back on odd lengths; promote every other item from a random offset
+                keep = [items.pop()] if len(items) % 2 else []
+                self.compactors[level + 1].extend(items[random.getrandbits(1)::2])
+                self.compactors[level] = keep
+                self.size = sum(len(c) for c in self.compactors)
+                if self.size < self.max_size:
+                    break
+
+    def merge(self, other: "KLLSketch"):
+        while len(self.compactors) < len(other.compactors):
+            self.grow()
+        for level, items in enumerate(other.compactors):
+            self.compactors[level].extend(items)
+        self.size = sum(len(c) for c in self.compactors)
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        while self.size >= self.max_size:
+            self.compress()
+
+    def weighted_items(self) -> Tuple[np.ndarray, np.ndarray]:
+        values = np.array([v for items in self.compactors for v in items], dtype=float)
+        weights = np.array([2 ** level for level, items in enumerate(self.compactors) for _ in items], dtype=float)
+        order = np.argsort(values, kind="mergesort")
+        return values[order], np.cumsum(weights[order])
+
+    def quantiles(self, fractions: List[float]) -> List[Optional[float]]:
+        if not self.count:
+            return [None] * len(fractions)
+        values, cumulative = self.weighted_items()
+        positions = np.searchsorted(cumulative, np.asarray(fractions) * cumulative[-1], side="left")
+        result = values[np.minimum(positions, len(values) - 1)]
+        # The exact extremes are tracked separately
+        return [self.min if f <= 0 else self.max if f >= 1 else float(v) for f, v in zip(fractions, result)]
+
+    def rank(self, value: float) -> Optional[float]:
+        """Fraction of values <= value"""
+        if not self.count:
+            return None
+        values, cumulative = self.weighted_items()
+        position = np.searchsorted(values, value, side="right")
+        return float(cumulative[position - 1] / cumulative[-1]) if position else 0.0
+
+def merge_sketches(sketches: List[KLLSketch]) -> KLLSketch:
+    merged = KLLSketch()
+    for sketch in sketches:
+        merged.merge(sketch)
+    return merged
+
+quantile_sketches: Dict[str, Dict[str, Any]] = {}
+quantile_sketch_locks: Dict[str, asyncio.Lock] = {}
+quantile_sketch_tasks: Dict[str, asyncio.Task] = {}
+
+def document_year(collection_name: str, doc: Dict[str, Any]) -> Optional[int]:
+    if collection_name == "covid_stats":
+        date = doc.get("date")
+        return int(date[:4]) if isinstance(date, str) and date[:4].isdigit() else None
+    year = doc.get("year")
+    return int(year) if isinstance(year, (int, float)) and not isinstance(year, bool) else None
+
+async def refresh_quantile_sketches(collection_name: str) -> Dict[str, Any]:
+    """Bring a collection's sketches up to date with its current data version"""
+    version = await get_data_version(collection_name)
+    store = quantile_sketches.get(collection_name)
+    if store and store["version"] == version:
+        return store
+
+    lock = quantile_sketch_locks.setdefault(collection_name, asyncio.Lock())
+    async with lock:
+        store = quantile_sketches.get(collection_name)
+        if store and store["version"] == version:
+            return store
+
+        # Rebuild from scratch when documents were removed or the store is old,
+        # otherwise only ingest documents inserted since the last refresh
+        document_count = int(version.split(":", 1)[0])
+        rebuild = (
+            store is None
+            or document_count < store["count"]
+            or time.monotonic() - store["built_at"] > QUANTILE_SKETCH_REBUILD_SECONDS
+        )
+        if rebuild:
+            sample = await db[collection_name].find_one()
+            fields = [
+                key for key, value in (sample or {}).items()
+                if key not in ('_id', 'year') and isinstance(value, (int, float)) and not isinstance(value, bool)
+            ]
+            store = {"fields": fields, "cells": {field: {} for field in fields},
+                     "count": 0, "last_id": None, "built_at": time.monotonic()}
+        else:
+            store = {**store, "cells": {field: dict(cells) for field, cells in store["cells"].items()}}
+
+        started = time.perf_counter()
+        query = {"_id": {"$gt": store["last_id"]}} if store["last_id"] is not None else {}
+        projection = {field: 1 for field in store["fields"] + ["state", "year", "date"]}
+        ingested = 0
+        touched = set()
+        async for doc in db[collection_name].find(query, projection=projection).sort("_id", 1):
+            cell = (doc.get("state"), document_year(collection_name, doc))
+            for field in store["fields"]:
+                value = doc.get(field)
+                if isinstance(value, (int, float)) and not isinstance(value, bool) and value == value:
+                    cells = store["cells"][field]
+                    if (field, cell) not in touched:
+                        # Copy-on-write so readers of the previous store are unaffected
+                        previous = cells.get(cell)
+                        cells[cell] = merge_sketches([previous]) if previous else KLLSketch()
+                        touched.add((field, cell))
+                    cells[cell].update(float(value))
+            store["last_id"] = doc["_id"]
+            ingested += 1
+        store["count"] += ingested
+
+        # Merge cells up to the per-state, per-year and collection-wide levels
+        store["rollups"] = {}
+        for field, cells in store["cells"].items():
+            by_state, by_year = defaultdict(list), defaultdict(list)
+            for (state, year), sketch in cells.items():
+                by_state[state].append(sketch)
+                by_year[year].append(sketch)
+            store["rollups"][field] = {
+                "all": merge_sketches(list(cells.values())),
+                "state": {state: merge_sketches(s) for state, s in by_state.items() if state},
+                "year": {year: merge_sketches(s) for year, s in by_year.items() if year is not None}
+            }
+        store["version"] = version
+        store["refreshed_at"] = datetime.utcnow().isoformat()
+        store["last_refresh"] = {
+            "mode": "rebuild" if rebuild else "incremental",
+            "documents_ingested": ingested,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 2)
+        }
+        quantile_sketches[collection_name] = store
+        return store
+
+def log_quantile_refresh_error(task: asyncio.Task):
+    if not task.cancelled() and task.exception():
+        logging.error(f"Quantile sketch refresh error: {task.exception()}")
+
+def schedule_quantile_refresh(collection_name: str) -> asyncio.Task:
+    """Start a background sketch refresh unless one is already running"""
+    task = quantile_sketch_tasks.get(collection_name)
+    if task is None or task.done():
+        task = asyncio.create_task(refresh_quantile_sketches(collection_name))
+        task.add_done_callback(log_quantile_refresh_error)
+        quantile_sketch_tasks[collection_name] = task
+    return task
+
+async def get_quantile_sketches(collection_name: str) -> Dict[str, Any]:
+    """Last built sketches for a collection, scheduling a background refresh when they are stale"""
+    store = quantile_sketches.get(collection_name)
+    if store is None:
+        # Cold start: wait for the first build (shielded so a dropped request doesn't cancel it)
+        return await asyncio.shield(schedule_quantile_refresh(collection_name))
+    version = await get_data_version(collection_name)
+    if store["version"] != version:
+        schedule_quantile_refresh(collection_name)
+    return store
+
+def select_sketch(store: Dict[str, Any], field: str, states: Optional[List[str]] = None,
+                  years: Optional[List[int]] = None) -> KLLSketch:
+    """Merge the smallest set of precomputed sketches that covers the filters"""
+    rollups = store["rollups"][field]
+    if states is None and not years:
+        return rollups["all"]
+    if states is None:
+        return merge_sketches([rollups["year"][y] for y in years if y in rollups["year"]])
+    if not years:
+        return merge_sketches([rollups["state"][s] for s in states if s in rollups["state"]])
+    cells = store["cells"][field]
+    return merge_sketches([cells[(s, y)] for s in states for y in years if (s, y) in cells])
+
+def summarize_sketch(sketch: KLLSketch, percentiles: List[float]) -> Dict[str, Any]:
+    """Percentiles plus a box-plot summary (whiskers at 1.5 IQR, clamped to the data range)"""
+    if not sketch.count:
+        return {"count": 0, "percentiles": {}, "box_plot": None}
+    values = sketch.quantiles([p / 100 for p in percentiles])
+    q1, median, q3 = sketch.quantiles([0.25, 0.5, 0.75])
+    iqr = q3 - q1
+    return {
+        "count": sketch.count,
+        "min": json_number(sketch.min),
+        "max": json_number(sketch.max),
+        "percentiles": {f"p{p:g}": json_number(v) for p, v in zip(percentiles, values)},
+        "box_plot": {
+            "lower_whisker": json_number(max(sketch.min, q1 - 1.5 * iqr)),
+            "q1": json_number(q1),
+            "median": json_number(median),
+            "q3": json_number(q3),
+            "upper_whisker": json_number(min(sketch.max, q3 + 1.5 * iqr))
+        }
+    }
+
+async def describe_state_percentiles(collection_name: str, state_names: List[str]) -> str:
+    """Where each state's median sits in the collection-wide distribution"""
+    field = await get_metric_field(collection_name)
+    if not field or not state_names:
+        return ""
+    store = await get_quantile_sketches(collection_name)
+    if field not in store["rollups"]:
+        return ""
+    rollups = store["rollups"][field]
+    lines = []
+    for state in state_names[:5]:
+        sketch = rollups["state"].get(state)
+        if sketch and sketch.count:
+            median = sketch.quantiles([0.5])[0]
+            percentile = round(rollups["all"].rank(median) * 100)
+            suffix = "th" if 10 <= percentile % 100 <= 20 else {1: "st", 2: "nd", 3: "rd"}.get(percentile % 10, "th")
+            lines.append(f"• {state}: median {median:,.1f} sits at the {percentile}{suffix} percentile of all records\n")
+    if not lines:
+        return ""
+    return f"\n\n**Percentile Position** ({field.replace('_', ' ')}):\n" + "".join(lines)
+
+async def warm_analytics_cache():
+    """Precompute anomalies and quantile sketches for the metric collections so the first request is served instantly"""
+    try:
+        available = await db.list_collection_names()
+        for collection_name in COLLECTION_METRICS:
+            if collection_name in available:
+                await compute_collection_anomalies(collection_name)
+                await refresh_quantile_sketches(collection_name)
+    except Exception as e:
+        logging.error(f"Analytics warm-up error: {e}")
+
+def query_filter_values(query: Optional[Dict[str, Any]], field: str) -> Optional[List[Any]]:
+    """Values of a {field: {"$in": [...]}} condition in a Mongo query, if present"""
+    if query and isinstance(query.get(field), dict):
+        return query[field].get("$in") or None
+    return None
+
+async def enrich_insights(insights: Dict[str, Any], collection_name: str,
+                          query: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Add the fitted trend and detected anomalies to LLM insights"""
+    insights = await apply_fitted_trend(insights, collection_name, query)
+    if not isinstance(insights, dict):
+        return insights
+    try:
+        detected = await get_detected_anomalies(
+            collection_name, query_filter_values(query, "state"), query_filter_values(query, "year")
+        )
+        if detected:
+            existing = [a for a in insights.get("anomalies") or [] if isinstance(a, str)]
+            insights = {
+                **insights,
+                "anomalies": [a["description"] for a in detected] + existing,
+                "detected_anomalies": detected
+            }
+    except Exception as e:
+        logging.error(f"Anomaly lookup error for {collection_name}: {e}")
+    return insights
+
 async def generate_specific_response(data: List[Dict], query_info: Dict) -> str:
     """Generate human-readable responses for specific queries"""
     if not data:
@@ -459,7 +2958,8 @@ async def generate_specific_response(data: List[Dict], query_info: Dict) -> str:
     response += f"\n💡 **Tip**: Ask me to compare with other states or years for deeper insights!"
     
     return response
-async def get_openai_insight(data_sample: List[Dict], query: str) -> Dict[str, Any]:
+async def get_openai_insight(data_sample: List[Dict], query: str, collection_name: Optional[str] = None,
+                             comparative: bool = False) -> Dict[str, Any]:
     """Generate AI insights using OpenAI"""
     try:
         # Prepare data context for OpenAI
@@ -478,27 +2978,83 @@ async def get_openai_insight(data_sample: List[Dict], query: str) -> Dict[str, A
         - trend: Overall trend direction (increasing, decreasing, stable, volatile)
         """
         
-        response = await asyncio.to_thread(
-            openai.chat.completions.create,
-            model="gpt-3.5-turbo",
+        response = await create_chat_completion(
+            tier=route_llm_tier("chat_answer", comparative),
+            collection_name=collection_name,
             messages=[
                 {"role": "system", "content": "You are an expert data analyst. Always respond with valid JSON."},
                 {"role": "user", "content": prompt}
-            ],
-            max_tokens=500
+            ]
         )
         
-        result = json.loads(response.choices[0].message.content)
+        result = parse_llm_json(response, collection_name)
         return result
     except Exception as e:
         logging.error(f"OpenAI error: {e}")
-        return {
-            "insight": "Data analysis completed. Multiple trends detected in the dataset.",
-            "chart_type": "bar",
-            "key_metrics": ["count", "average"],
-            "anomalies": [],
-            "trend": "stable"
-        }
+        return get_fallback_openai_insight(collection_name)
+
+def get_fallback_openai_insight(collection_name: Optional[str] = None) -> Dict[str, Any]:
+    """Static chat insight used when the LLM call fails"""
+    record_llm_fallback(collection_name)
+    return {
+        "insight": "Data analysis completed. Multiple trends detected in the dataset.",
+        "chart_type": "bar",
+        "key_metrics": ["count", "average"],
+        "anomalies": [],
+        "trend": "stable"
+    }
+
+async def get_batched_openai_insights(samples: Dict[str, List[Dict]], query: str,
+                                      comparative: bool = False) -> Dict[str, Dict[str, Any]]:
+    """Chat insights for several collections from one LLM call.
+
+    The instructions are sent once with every collection's sample and the model answers
+    with a JSON object keyed by collection; collections it skips get the fallback.
+    """
+    if len(samples) == 1:
+        collection_name, data_sample = next(iter(samples.items()))
+        return {collection_name: await get_openai_insight(data_sample, query, collection_name, comparative)}
+
+    results = {}
+    try:
+        data_context = json.dumps(
+            {collection_name: data_sample[:5] for collection_name, data_sample in samples.items()},
+            default=str
+        )
+        prompt = f"""
+        Analyze each of these datasets independently and provide insights for the query: "{query}"
+        
+        Data samples keyed by collection: {data_context}
+        
+        Respond with a single JSON object keyed by collection name. Each value must contain:
+        - insight: A clear, actionable insight (max 100 words)
+        - chart_type: Recommended chart type (bar, line, pie, scatter, area)
+        - key_metrics: Array of important metrics found
+        - anomalies: Array of any unusual patterns or outliers detected
+        - trend: Overall trend direction (increasing, decreasing, stable, volatile)
+        """
+        
+        tier = route_llm_tier("chat_answer", comparative)
+        response = await create_chat_completion(
+            tier=tier,
+            collection_name="multiple",
+            messages=[
+                {"role": "system", "content": "You are an expert data analyst. Always respond with valid JSON."},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=LLM_TIERS[tier]["max_tokens"] * len(samples)
+        )
+        
+        parsed = parse_llm_json(response, "multiple")
+        if isinstance(parsed, dict):
+            results = {str(k): v for k, v in parsed.items() if isinstance(v, dict)}
+    except Exception as e:
+        logging.error(f"Batched OpenAI error: {e}")
+
+    return {
+        collection_name: results.get(collection_name) or get_fallback_openai_insight(collection_name)
+        for collection_name in samples
+    }
 
 async def get_chart_recommendations(data: List[Dict]) -> Dict[str, Any]:
     """Analyze data structure and recommend best chart types"""
@@ -527,7 +3083,244 @@ async def get_chart_recommendations(data: List[Dict]) -> Dict[str, Any]:
     elif len(numeric_fields) >= 2:
         return {"recommended": "scatter", "alternatives": ["bubble", "line"]}
     else:
-        return {"recommended": "bar", "alternatives": ["pie", "line"]}
+        return {"recommended": "bar", "alternatives": ["pie", "line"]}
+
+# Stratified sampling
+# Insight and visualization samples are spread over (state, year) strata instead of
+# taking the first rows in natural order, which usually cover one or two states.
+# Stratum counts are cached per data version; each sampled stratum is then its own
+# small query, so the matched set is never rescanned per stratum.
+STRATIFIED_MAX_STRATA = int(os.environ.get('STRATIFIED_MAX_STRATA', '64'))
+
+def sample_year_key(collection_name: str):
+    """Aggregation expression for a document's year as used for strata (string prefix for dates)"""
+    if collection_name == "covid_stats":
+        return {"$substr": ["$date", 0, 4]}
+    return "$year"
+
+def stratum_filter(collection_name: str, state: Any, year: Any, by_year: bool = True) -> Dict[str, Any]:
+    condition = {"state": state}
+    if by_year:
+        if collection_name == "covid_stats":
+            condition["date"] = {"$regex": f"^{re.escape(str(year))}-"} if year else {"$in": [None, ""]}
+        else:
+            condition["year"] = year
+    return condition
+
+def allocate_sample(strata: List[Tuple[Any, Any, int]], budget: int) -> List[Tuple[Any, Any, int]]:
+    """Spread a row budget over (state, year, count) strata one row at a time.
+
+    States take turns so each is represented before any gets a second row; within a
+    state the years rotate newest first, offset per state so years are spread too.
+    When there are more states than rows, a random subset of states is used.
+    """
+    by_state = defaultdict(list)
+    for state, year, count in strata:
+        by_state[state].append((year, count))
+    states = sorted(by_state, key=str)
+    if budget < len(states):
+        states = sorted(random.sample(states, budget), key=str)
+    rotations = {}
+    for i, state in enumerate(states):
+        years = sorted(by_state[state], key=lambda item: str(item[0]), reverse=True)
+        offset = i % len(years)
+        rotations[state] = years[offset:] + years[:offset]
+    allocated = defaultdict(int)
+    cursors = {state: 0 for state in states}
+    remaining = budget
+    while remaining > 0:
+        progressed = False
+        for state in states:
+            rotation = rotations[state]
+            # Next year for this state that still has unsampled rows
+            for _ in range(len(rotation)):
+                year, count = rotation[cursors[state] % len(rotation)]
+                cursors[state] += 1
+                if allocated[(state, year)] < count:
+                    allocated[(state, year)] += 1
+                    remaining -= 1
+                    progressed = True
+                    break
+            if remaining == 0:
+                break
+        if not progressed:
+            break
+    return [(state, year, allocated[(state, year)]) for state in states
+            for year, _ in rotations[state] if allocated[(state, year)]]
+
+async def sample_stratum(collection_name: str, query: Dict[str, Any], condition: Dict[str, Any], size: int) -> List[Dict]:
+    """Random documents from one stratum; the stratum condition leads so state/year indexes apply"""
+    match = {"$and": [condition, query]} if query else condition
+    return await db[collection_name].aggregate([{"$match": match}, {"$sample": {"size": size}}]).to_list(size)
+
+async def fetch_stratified_sample(collection_name: str, query: Dict[str, Any], budget: int) -> List[Dict]:
+    """Up to `budget` documents matching `query`, stratified by state and year"""
+    if budget <= 0:
+        return []
+    collection = db[collection_name]
+    version = await get_data_version(collection_name)
+    cache_key = json.dumps(["strata", collection_name, version, query], default=str)
+    cached = rollup_cache.get(cache_key)
+    if cached and time.monotonic() - cached[0] < ROLLUP_CACHE_TTL_SECONDS:
+        strata = cached[1]
+    else:
+        results = await collection.aggregate([
+            {"$match": query},
+            {"$group": {"_id": {"state": "$state", "year": sample_year_key(collection_name)}, "count": {"$sum": 1}}}
+        ]).to_list(None)
+        strata = [(r["_id"].get("state"), r["_id"].get("year"), r["count"]) for r in results]
+        cache_put(rollup_cache, cache_key, (time.monotonic(), strata), ROLLUP_CACHE_MAX_ENTRIES)
+
+    if sum(count for _, _, count in strata) <= budget:
+        return await collection.find(query).to_list(budget)
+    by_year = len(strata) <= STRATIFIED_MAX_STRATA
+    if not by_year:
+        # Too many cells to query one by one: stratify by state only
+        per_state = defaultdict(int)
+        for state, _, count in strata:
+            per_state[state] += count
+        strata = [(state, None, count) for state, count in per_state.items()]
+
+    allocation = allocate_sample(strata, budget)
+    groups = await asyncio.gather(*(
+        sample_stratum(collection_name, query, stratum_filter(collection_name, state, year, by_year), size)
+        for state, year, size in allocation
+    ))
+    # Interleave strata so the first rows (used in prompts) already span states
+    sample = []
+    for position in range(max((len(g) for g in groups), default=0)):
+        sample.extend(g[position] for g in groups if position < len(g))
+    return sample
+
+# Chart-ready payloads
+# "columnar" transposes rows into one array per field; "series" pivots them into
+# the labels/datasets shape ChartComponent builds, averaging values per label.
+RESPONSE_FORMATS = ("rows", "columnar", "series")
+
+def chart_fields(rows: List[Dict], collection_name: str) -> Tuple[Optional[str], Optional[str]]:
+    """Label field and primary metric for a set of rows, preferring state and the collection's metric"""
+    sample = rows[0]
+    numeric = [k for k, v in sample.items() if k != 'year' and is_number(v)]
+    strings = [k for k, v in sample.items() if k != 'date' and isinstance(v, str)]
+    label_field = 'state' if 'state' in strings else (strings[0] if strings else None)
+    candidates = COLLECTION_METRICS.get(collection_name, {}).get('fields', [])
+    metric = next((f for f in candidates if f in numeric), numeric[0] if numeric else None)
+    return label_field, metric
+
+def is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def numeric_column(rows: List[Dict], field: str) -> np.ndarray:
+    return np.array([v if is_number(v) else np.nan for v in (row.get(field) for row in rows)], dtype=float)
+
+def build_chart_payload(rows: List[Dict], response_format: str, collection_name: str,
+                        chart_type: str = "bar", group_by: Optional[str] = None) -> Any:
+    """Reshape cleaned rows into the requested response format"""
+    if response_format == "rows":
+        return rows
+    if not rows:
+        return {"labels": [], "series": {}}
+    label_field, metric = chart_fields(rows, collection_name)
+
+    if response_format == "columnar":
+        fields = list(dict.fromkeys(key for row in rows for key in row))
+        numeric = [f for f in fields if f not in ('year', label_field) and any(is_number(row.get(f)) for row in rows)]
+        return {
+            "label_field": label_field,
+            "labels": [row.get(label_field) for row in rows] if label_field else list(range(len(rows))),
+            "series": {f: [v if is_number(v) else None for v in (row.get(f) for row in rows)] for f in numeric},
+            "columns": {f: [row.get(f) for row in rows] for f in fields if f not in numeric and f != label_field}
+        }
+
+    if metric is None:
+        return {"labels": [], "series": {}}
+    labels, label_index = np.unique(np.array([str(row.get(label_field)) for row in rows]), return_inverse=True)
+    values = numeric_column(rows, metric)
+    present = ~np.isnan(values)
+    weights = np.where(present, values, 0)
+
+    def means(cells, size):
+        totals = np.bincount(cells, weights=weights, minlength=size)
+        counts = np.bincount(cells, weights=present, minlength=size)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return totals / counts
+
+    if group_by:
+        # One series per group value (e.g. year) over a shared, sorted label axis
+        groups, group_index = np.unique(np.array([str(row.get(group_by)) for row in rows]), return_inverse=True)
+        grid = means(group_index * len(labels) + label_index, len(groups) * len(labels)).reshape(len(groups), len(labels))
+        order = np.arange(len(labels))
+        series = {str(group): grid[g] for g, group in enumerate(groups)}
+    else:
+        averaged = means(label_index, len(labels))
+        # Line charts keep label order; other charts rank labels by value like ChartComponent
+        order = np.arange(len(labels)) if chart_type == "line" else np.argsort(-np.nan_to_num(averaged, nan=-np.inf), kind="stable")
+        series = {metric: averaged}
+
+    return {
+        "label_field": label_field,
+        "metric": metric,
+        "aggregation": "mean",
+        "group_by": group_by,
+        "labels": [str(labels[i]) for i in order],
+        "series": {name: [json_number(v, 4) for v in row[order]] for name, row in series.items()}
+    }
+
+# Pie and doughnut charts only show a handful of slices, so their data is
+# aggregated per state in MongoDB and everything past the top N becomes "Others".
+TOP_N_CHART_TYPES = ("pie", "doughnut")
+TOP_N_DEFAULT = int(os.environ.get('TOP_N_DEFAULT', '9'))
+TOP_N_MAX = 50
+
+async def fetch_top_n_with_others(collection_name: str, query: Dict[str, Any], top_n: int,
+                                  group_field: str = "state") -> Dict[str, Any]:
+    """Top groups by the primary metric plus an "Others" remainder, in one aggregation.
+
+    rows hold only the label and metric so charts plot nothing else; per-slice record
+    and group counts are returned separately as slices.
+    """
+    field = await get_metric_field(collection_name)
+    if field is None:
+        return {"rows": [], "slices": [], "field": None, "rollup": None, "other_groups": 0}
+    rollup = COLLECTION_METRICS.get(collection_name, {}).get('rollup', 'sum')
+    pipeline = [
+        {"$match": query},
+        {"$group": {
+            "_id": f"${group_field}",
+            "value": {f"${rollup}": f"${field}"},
+            "records": {"$sum": 1},
+            # Documents $avg actually averaged over (it skips missing and null values)
+            "valued": {"$sum": {"$cond": [{"$isNumber": f"${field}"}, 1, 0]}}
+        }},
+        {"$sort": {"value": -1, "_id": 1}},
+        {"$facet": {
+            "top": [{"$limit": top_n}],
+            "others": [
+                {"$skip": top_n},
+                {"$group": {
+                    "_id": None,
+                    "value": {"$sum": "$value"},
+                    # Averages are weighted by valued documents so "Others" is the mean over them
+                    "weighted": {"$sum": {"$multiply": ["$value", "$valued"]}},
+                    "weight": {"$sum": "$valued"},
+                    "records": {"$sum": "$records"},
+                    "groups": {"$sum": 1}
+                }}
+            ]
+        }}
+    ]
+    result = (await db[collection_name].aggregate(pipeline).to_list(1) or [{"top": [], "others": []}])[0]
+    rows = [{group_field: r["_id"], field: r["value"]} for r in result["top"]]
+    slices = [{group_field: r["_id"], "records": r["records"], "groups": 1} for r in result["top"]]
+    other_groups = result["others"][0]["groups"] if result["others"] else 0
+    if other_groups:
+        others = result["others"][0]
+        value = others["value"]
+        if rollup == "avg":
+            value = others["weighted"] / others["weight"] if others["weight"] else None
+        rows.append({group_field: "Others", field: value})
+        slices.append({group_field: "Others", "records": others["records"], "groups": other_groups})
+    return {"rows": rows, "slices": slices, "field": field, "rollup": rollup, "other_groups": other_groups}
 
 # API Routes
 @api_router.get("/")
@@ -615,25 +3408,51 @@ async def get_filtered_data(filter_request: FilterRequest):
     """Get filtered data from a collection with advanced filtering options"""
     try:
         # Verify collection exists
-        collections = await db.list_collection_names()
+        async with timed_stage("db"):
+            collections = await db.list_collection_names()
         if filter_request.collection not in collections:
             raise HTTPException(status_code=404, detail="Collection not found")
+        if filter_request.format not in RESPONSE_FORMATS:
+            raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(RESPONSE_FORMATS)}")
         
         # Build query
         query = await build_filter_query(filter_request)
         
-        # Build sort criteria
-        sort_criteria = []
-        if filter_request.sort_by:
-            sort_direction = 1 if filter_request.sort_order == "asc" else -1
-            sort_criteria.append((filter_request.sort_by, sort_direction))
-        
-        # Execute query
-        cursor = db[filter_request.collection].find(query)
-        if sort_criteria:
-            cursor = cursor.sort(sort_criteria)
-        
-        data = await cursor.limit(filter_request.limit or 100).to_list(filter_request.limit or 100)
+        aggregation = None
+        sort_plan = None
+        if filter_request.chart_type in TOP_N_CHART_TYPES:
+            # Pie/doughnut: a fixed handful of slices regardless of dataset size
+            top_n = max(1, min(filter_request.top_n or TOP_N_DEFAULT, TOP_N_MAX))
+            async with timed_stage("db"):
+                top = await fetch_top_n_with_others(filter_request.collection, query, top_n)
+            data = top["rows"]
+            aggregation = {
+                "type": "top_n",
+                "top_n": top_n,
+                "group_field": "state",
+                "metric": top["field"],
+                "rollup": top["rollup"],
+                "other_groups": top["other_groups"],
+                "slices": top["slices"]
+            }
+        else:
+            limit = filter_request.limit or 100
+            
+            # Execute query
+            cursor = db[filter_request.collection].find(query)
+            if filter_request.sort_by:
+                async with timed_stage("db"):
+                    schema = await get_sort_schema(filter_request.collection)
+                sort_plan = plan_sort(schema, query, filter_request.sort_by, filter_request.sort_order)
+                cursor = cursor.sort([(sort_plan["field"], sort_plan["direction"])])
+                if sort_plan["strategy"] == "index":
+                    cursor = cursor.hint(sort_plan["index"])
+                else:
+                    # With a limit the server keeps only the top K documents while sorting
+                    cursor = cursor.allow_disk_use(True)
+            
+            async with timed_stage("db"):
+                data = await cursor.limit(limit).to_list(limit)
         
         # Process data for frontend
         processed_data = []
@@ -646,14 +3465,21 @@ async def get_filtered_data(filter_request: FilterRequest):
             processed_data.append(clean_doc)
         
         # Get total count for the query
-        total_count = await db[filter_request.collection].count_documents(query)
+        async with timed_stage("db"):
+            total_count = await db[filter_request.collection].count_documents(query)
         
         # Get chart recommendations
         chart_rec = await get_chart_recommendations(processed_data)
         
         return {
             "collection": filter_request.collection,
-            "data": processed_data,
+            "data": build_chart_payload(
+                processed_data, filter_request.format, filter_request.collection,
+                filter_request.chart_type, filter_request.group_by
+            ),
+            "format": filter_request.format,
+            "aggregation": aggregation,
+            "sort_plan": sort_plan,
             "total_count": total_count,
             "returned_count": len(processed_data),
             "chart_recommendations": chart_rec,
@@ -672,42 +3498,485 @@ async def get_filtered_data(filter_request: FilterRequest):
         logging.error(f"Filtered data error: {e}")
         raise HTTPException(status_code=500, detail="Error processing filtered data request")
 
+@api_router.post("/data/joined")
+async def get_joined_data(join_request: JoinRequest):
+    """Get the primary metrics of several collections aligned on state and year"""
+    collections = list(dict.fromkeys(join_request.collections))
+    if not 2 <= len(collections) <= JOIN_MAX_COLLECTIONS:
+        raise HTTPException(status_code=400, detail=f"Provide between 2 and {JOIN_MAX_COLLECTIONS} distinct collections")
+    try:
+        available = await db.list_collection_names()
+        missing = [c for c in collections if c not in available]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Collection not found: {', '.join(missing)}")
+        
+        frame = await join_collections(collections, join_request.states, join_request.years)
+        return {
+            **frame,
+            "returned_count": len(frame["rows"]),
+            "correlations": pairwise_correlations(frame),
+            "applied_filters": {
+                "states": join_request.states,
+                "years": join_request.years
+            }
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Joined data error: {e}")
+        raise HTTPException(status_code=500, detail="Error processing joined data request")
+
+HISTOGRAM_MAX_BINS = 100
+
+@api_router.post("/histogram")
+async def get_histogram(histogram_request: HistogramRequest):
+    """Bin counts for a numeric field, computed in MongoDB with $bucket/$bucketAuto"""
+    try:
+        collections = await db.list_collection_names()
+        if histogram_request.collection not in collections:
+            raise HTTPException(status_code=404, detail="Collection not found")
+        if histogram_request.binning not in ("fixed", "quantile"):
+            raise HTTPException(status_code=400, detail="binning must be 'fixed' or 'quantile'")
+        if not 1 <= histogram_request.bins <= HISTOGRAM_MAX_BINS:
+            raise HTTPException(status_code=400, detail=f"bins must be between 1 and {HISTOGRAM_MAX_BINS}")
+        boundaries = histogram_request.boundaries
+        if boundaries is not None and (len(boundaries) < 2 or any(a >= b for a, b in zip(boundaries, boundaries[1:]))):
+            raise HTTPException(status_code=400, detail="boundaries must be at least two strictly increasing values")
+        
+        field = histogram_request.field or await get_metric_field(histogram_request.collection)
+        if not field or field.startswith("$"):
+            raise HTTPException(status_code=400, detail="A numeric field is required")
+        
+        query = await build_filter_query(histogram_request)
+        match = {"$and": [query, {field: {"$type": "number"}}]} if query else {field: {"$type": "number"}}
+        collection = db[histogram_request.collection]
+        
+        outside = 0
+        if histogram_request.binning == "quantile" and boundaries is None:
+            # Equal-count bins: MongoDB picks the edges
+            pipeline = [
+                {"$match": match},
+                {"$bucketAuto": {"groupBy": f"${field}", "buckets": histogram_request.bins}}
+            ]
+            results = await collection.aggregate(pipeline).to_list(None)
+            bins = [{"lower": r["_id"]["min"], "upper": r["_id"]["max"], "count": r["count"]} for r in results]
+        else:
+            include_max = boundaries is None
+            if boundaries is None:
+                # Equal-width bins over the observed range
+                bounds = await collection.aggregate([
+                    {"$match": match},
+                    {"$group": {"_id": None, "min": {"$min": f"${field}"}, "max": {"$max": f"${field}"}}}
+                ]).to_list(1)
+                boundaries = []
+                if bounds:
+                    low, high = float(bounds[0]["min"]), float(bounds[0]["max"])
+                    boundaries = np.linspace(low, high if high > low else low + 1, histogram_request.bins + 1).tolist()
+            
+            bins = []
+            if boundaries:
+                pipeline = [
+                    {"$match": match},
+                    {"$bucket": {"groupBy": f"${field}", "boundaries": boundaries, "default": "outside"}}
+                ]
+                results = await collection.aggregate(pipeline).to_list(None)
+                counts = {r["_id"]: r["count"] for r in results}
+                outside = counts.pop("outside", 0)
+                bins = [
+                    {"lower": lower, "upper": upper, "count": counts.get(lower, 0)}
+                    for lower, upper in zip(boundaries, boundaries[1:])
+                ]
+                if include_max:
+                    # $bucket bins are [lower, upper), so the maximum itself lands in the default bucket
+                    bins[-1]["count"] += outside
+                    outside = 0
+        
+        return {
+            "collection": histogram_request.collection,
+            "field": field,
+            "binning": "custom" if histogram_request.boundaries else histogram_request.binning,
+            "bins": bins,
+            "total": sum(b["count"] for b in bins),
+            "outside_boundaries": outside
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Histogram error: {e}")
+        raise HTTPException(status_code=500, detail="Error computing histogram")
+
+# Time series
+# Date-keyed collections (covid_stats) are rolled up to day/week/month totals and
+# downsampled with Largest-Triangle-Three-Buckets so responses stay chart-sized.
+TIME_SERIES_DEFAULT_POINTS = 365
+TIME_SERIES_MAX_POINTS = 2000
+TIME_SERIES_MAX_STATES = 10
+TIME_SERIES_GRANULARITIES = ("auto", "day", "week", "month")
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Indices of the points kept by Largest-Triangle-Three-Buckets downsampling"""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    y = np.nan_to_num(y)
+    # Interior points split into threshold - 2 buckets; first and last points are always kept
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    selected = np.empty(threshold, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        # The next bucket's centroid is the third vertex of the triangle
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        next_x = x[next_start:next_end].mean() if next_end > next_start else x[-1]
+        next_y = y[next_start:next_end].mean() if next_end > next_start else y[-1]
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        selected[i + 1] = previous
+    return selected
+
+def fold_daily_to_weeks(dates: List[str], matrix: np.ndarray, rollup: str) -> Tuple[List[str], np.ndarray]:
+    """Combine daily columns into ISO weeks (labelled by their Monday)"""
+    days = np.array(dates, dtype="datetime64[D]")
+    # 1970-01-01 was a Thursday, so (day + 3) % 7 is the weekday with Monday = 0
+    mondays = days - ((days.astype(np.int64) + 3) % 7).astype("timedelta64[D]")
+    weeks, positions = np.unique(mondays, return_inverse=True)
+    present = ~np.isnan(matrix)
+    totals = np.zeros((matrix.shape[0], len(weeks)))
+    counts = np.zeros((matrix.shape[0], len(weeks)))
+    for row in range(matrix.shape[0]):
+        totals[row] = np.bincount(positions, weights=np.where(present[row], matrix[row], 0), minlength=len(weeks))
+        counts[row] = np.bincount(positions, weights=present[row], minlength=len(weeks))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        folded = totals / counts if rollup == "avg" else totals
+    folded[counts == 0] = np.nan
+    return [str(week) for week in weeks], folded
+
+async def build_time_series(collection_name: str, field: str, states: Optional[List[str]] = None,
+                            years: Optional[List[int]] = None, granularity: str = "auto",
+                            max_points: int = TIME_SERIES_DEFAULT_POINTS) -> Dict[str, Any]:
+    """Chart-ready series for a date-keyed collection, capped at max_points labels"""
+    rollup = COLLECTION_METRICS.get(collection_name, {}).get('rollup', 'sum')
+    match = build_state_year_query(collection_name, states, years)
+    by_state = states is not None
+
+    async def grouped(period_length):
+        # Days and months are both prefixes of the ISO date string
+        key = {"period": {"$substr": ["$date", 0, period_length]}}
+        if by_state:
+            key["state"] = "$state"
+        results = await db[collection_name].aggregate([
+            {"$match": match},
+            {"$group": {"_id": key, "value": {f"${rollup}": f"${field}"}}}
+        ]).to_list(None)
+        rows = [r for r in results if r["value"] is not None]
+        names = sorted({r["_id"].get("state") or "All states" for r in rows}) if by_state else ["All states"]
+        periods = sorted({r["_id"]["period"] for r in rows})
+        name_pos = {name: i for i, name in enumerate(names)}
+        period_pos = {period: i for i, period in enumerate(periods)}
+        matrix = np.full((len(names), len(periods)), np.nan)
+        for r in rows:
+            name = (r["_id"].get("state") or "All states") if by_state else "All states"
+            matrix[name_pos[name], period_pos[r["_id"]["period"]]] = float(r["value"])
+        return names, periods, matrix
+
+    # "auto" picks the finest calendar granularity that fits; explicit choices are downsampled instead
+    requested = granularity
+    if granularity == "month":
+        names, labels, matrix = await grouped(7)
+    else:
+        granularity = "day"
+        names, labels, matrix = await grouped(10)
+        if requested == "week" or (requested == "auto" and len(labels) > max_points):
+            granularity = "week"
+            labels, matrix = fold_daily_to_weeks(labels, matrix, rollup)
+            if requested == "auto" and len(labels) > max_points:
+                granularity = "month"
+                names, labels, matrix = await grouped(7)
+
+    source_points = len(labels)
+    downsampled = source_points > max_points
+    if downsampled:
+        # Choose points on the combined series and keep the same labels for every state
+        combined = np.nansum(matrix, axis=0)
+        keep = lttb_indices(np.arange(source_points, dtype=float), combined, max_points)
+        labels = [labels[i] for i in keep]
+        matrix = matrix[:, keep]
+
+    return {
+        "collection": collection_name,
+        "metric": field,
+        "granularity": granularity,
+        "rollup": rollup,
+        "labels": labels,
+        "series": {name: [json_number(v, 2) for v in row] for name, row in zip(names, matrix)},
+        "points": len(labels),
+        "source_points": source_points,
+        "downsampled": downsampled
+    }
+
+@api_router.get("/timeseries/{collection_name}")
+async def get_time_series(collection_name: str, metric: str = None, states: str = None, years: str = None,
+                          granularity: str = "auto", max_points: int = TIME_SERIES_DEFAULT_POINTS):
+    """Day/week/month series for date-keyed collections, downsampled to at most max_points labels"""
+    try:
+        collections = await db.list_collection_names()
+        if collection_name not in collections:
+            raise HTTPException(status_code=404, detail="Collection not found")
+        if collection_name != "covid_stats":
+            raise HTTPException(status_code=400, detail="Time series are only available for date-keyed collections")
+        if granularity not in TIME_SERIES_GRANULARITIES:
+            raise HTTPException(status_code=400, detail=f"granularity must be one of: {', '.join(TIME_SERIES_GRANULARITIES)}")
+        if not 3 <= max_points <= TIME_SERIES_MAX_POINTS:
+            raise HTTPException(status_code=400, detail=f"max_points must be between 3 and {TIME_SERIES_MAX_POINTS}")
+        
+        field = metric or await get_metric_field(collection_name)
+        if not field or field.startswith("$"):
+            raise HTTPException(status_code=400, detail="A numeric metric is required")
+        
+        year_list = None
+        if years:
+            try:
+                year_list = [int(y.strip()) for y in years.split(',') if y.strip()]
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Years must be integers")
+        state_list = None
+        if states:
+            requested = [s.strip() for s in states.split(',') if s.strip()]
+            state_list = (await resolve_state_names(requested, collection_name))[:TIME_SERIES_MAX_STATES]
+        
+        return await build_time_series(collection_name, field, state_list, year_list, granularity, max_points)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Time series error: {e}")
+        raise HTTPException(status_code=500, detail="Error building time series")
+
+@api_router.get("/analytics/correlation")
+async def get_correlation_analytics(collections: str = None, states: str = None, years: str = None, max_lag: int = 1):
+    """Pearson, Spearman and lagged correlations between dataset metrics across states and years"""
+    try:
+        available = await db.list_collection_names()
+        if collections:
+            metric_collections = list(dict.fromkeys(c.strip() for c in collections.split(',') if c.strip()))
+            missing = [c for c in metric_collections if c not in available]
+            if missing:
+                raise HTTPException(status_code=404, detail=f"Collection not found: {', '.join(missing)}")
+        else:
+            metric_collections = [c for c in COLLECTION_METRICS if c in available]
+        if len(metric_collections) < 2:
+            raise HTTPException(status_code=400, detail="At least two collections are required")
+        if not 0 <= max_lag <= CORRELATION_MAX_LAG:
+            raise HTTPException(status_code=400, detail=f"max_lag must be between 0 and {CORRELATION_MAX_LAG}")
+        
+        state_list = [s.strip() for s in states.split(',') if s.strip()] if states else None
+        year_list = None
+        if years:
+            try:
+                year_list = [int(y.strip()) for y in years.split(',') if y.strip()]
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Years must be integers")
+        
+        return await compute_correlation_analytics(metric_collections, state_list, year_list, max_lag)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Correlation analytics error: {e}")
+        raise HTTPException(status_code=500, detail="Error computing correlation analytics")
+
+@api_router.get("/analytics/forecast/{collection_name}")
+async def get_trend_forecast(collection_name: str, states: str = None, years: str = None,
+                             horizon: int = FORECAST_MAX_HORIZON, method: str = "ols"):
+    """Per-state linear trends with confidence intervals and 1-3 year projections"""
+    if not 1 <= horizon <= FORECAST_MAX_HORIZON:
+        raise HTTPException(status_code=400, detail=f"horizon must be between 1 and {FORECAST_MAX_HORIZON}")
+    if method not in ("ols", "robust"):
+        raise HTTPException(status_code=400, detail="method must be 'ols' or 'robust'")
+    try:
+        collections = await db.list_collection_names()
+        if collection_name not in collections:
+            raise HTTPException(status_code=404, detail="Collection not found")
+        
+        state_list = [s.strip() for s in states.split(',') if s.strip()] if states else None
+        year_list = None
+        if years:
+            try:
+                year_list = [int(y.strip()) for y in years.split(',') if y.strip()]
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Years must be integers")
+        
+        return await compute_trend_forecast(collection_name, state_list, year_list, horizon, method)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Forecast error: {e}")
+        raise HTTPException(status_code=500, detail="Error computing trend forecast")
+
+@api_router.get("/analytics/anomalies/{collection_name}")
+async def get_collection_anomalies(collection_name: str, states: str = None, years: str = None, limit: int = 20):
+    """Precomputed anomalies for a collection, optionally narrowed to states and years"""
+    try:
+        collections = await db.list_collection_names()
+        if collection_name not in collections:
+            raise HTTPException(status_code=404, detail="Collection not found")
+        if collection_name not in COLLECTION_METRICS:
+            raise HTTPException(status_code=400, detail="Anomaly detection is not available for this collection")
+        
+        state_list = None
+        if states:
+            state_list = await resolve_state_names([s.strip() for s in states.split(',') if s.strip()], collection_name)
+        year_list = None
+        if years:
+            try:
+                year_list = [int(y.strip()) for y in years.split(',') if y.strip()]
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Years must be integers")
+        
+        detected = await compute_collection_anomalies(collection_name)
+        anomalies = await get_detected_anomalies(collection_name, state_list, year_list, max(1, min(limit, ANOMALY_MAX_RESULTS)))
+        return {
+            "collection": collection_name,
+            "field": detected["field"],
+            "anomalies": anomalies,
+            "total_detected": detected["total_detected"],
+            "data_version": detected["data_version"],
+            "computed_at": detected["computed_at"]
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Anomaly detection error: {e}")
+        raise HTTPException(status_code=500, detail="Error detecting anomalies")
+
+@api_router.get("/distribution/{collection_name}")
+async def get_distribution(collection_name: str, metric: str = None, states: str = None, years: str = None,
+                           percentiles: str = None, value: float = None, group_by: str = None):
+    """Percentiles and box-plot summaries from precomputed quantile sketches"""
+    try:
+        collections = await db.list_collection_names()
+        if collection_name not in collections:
+            raise HTTPException(status_code=404, detail="Collection not found")
+        if group_by not in (None, "state", "year"):
+            raise HTTPException(status_code=400, detail="group_by must be 'state' or 'year'")
+        
+        store = await get_quantile_sketches(collection_name)
+        field = metric or await get_metric_field(collection_name)
+        if field not in store["rollups"]:
+            raise HTTPException(status_code=400, detail=f"Metric must be one of: {', '.join(store['fields'])}")
+        
+        try:
+            percentile_list = [float(p) for p in percentiles.split(',') if p.strip()] if percentiles else DISTRIBUTION_PERCENTILES
+            year_list = [int(y.strip()) for y in years.split(',') if y.strip()] if years else None
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Percentiles and years must be numbers")
+        if any(p < 0 or p > 100 for p in percentile_list):
+            raise HTTPException(status_code=400, detail="Percentiles must be between 0 and 100")
+        
+        state_list = None
+        if states:
+            state_list = await resolve_state_names([s.strip() for s in states.split(',') if s.strip()], collection_name)
+        
+        sketch = select_sketch(store, field, state_list, year_list)
+        response = {
+            "collection": collection_name,
+            "metric": field,
+            "states": state_list,
+            "years": year_list,
+            **summarize_sketch(sketch, percentile_list),
+            "sketch": {"type": "kll", "k": QUANTILE_SKETCH_K, "data_version": store["version"],
+                       "refreshed_at": store["refreshed_at"], **store["last_refresh"]}
+        }
+        if value is not None:
+            rank = sketch.rank(value)
+            response["value_percentile"] = json_number(rank * 100, 2) if rank is not None else None
+        
+        if group_by:
+            rollups = store["rollups"][field]
+            groups = []
+            for key in sorted(rollups[group_by], key=str):
+                if group_by == "state" and state_list is not None and key not in state_list:
+                    continue
+                if group_by == "year" and year_list and key not in year_list:
+                    continue
+                if group_by == "state":
+                    group_sketch = select_sketch(store, field, [key], year_list)
+                else:
+                    group_sketch = select_sketch(store, field, state_list, [key])
+                if group_sketch.count:
+                    groups.append({group_by: key, **summarize_sketch(group_sketch, percentile_list)})
+            response["groups"] = groups
+        
+        return response
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Distribution error: {e}")
+        raise HTTPException(status_code=500, detail="Error computing distribution")
+
+async def fetch_insight_sample(collection_name: str, query: Dict[str, Any], limit: int = 50):
+    """Fetch a cleaned insight sample and the total match count concurrently"""
+    data, total_count = await asyncio.gather(
+        fetch_stratified_sample(collection_name, query, limit),
+        db[collection_name].count_documents(query)
+    )
+    processed_data = []
+    for doc in data:
+        clean_doc = {k: v for k, v in doc.items() if k != '_id'}
+        for key, value in clean_doc.items():
+            if isinstance(value, datetime):
+                clean_doc[key] = value.isoformat()
+        processed_data.append(clean_doc)
+    return processed_data, total_count
+
 @api_router.post("/insights/enhanced")
 async def get_enhanced_insights(filter_request: FilterRequest):
     """Get enhanced AI insights for filtered data"""
     try:
-        # Get filtered data first
-        query = await build_filter_query(filter_request)
-        data = await db[filter_request.collection].find(query).limit(50).to_list(50)
-        
-        if not data:
-            raise HTTPException(status_code=404, detail="No data found for the specified filters")
+        if filter_request.insight_mode not in INSIGHT_MODES:
+            raise HTTPException(status_code=400, detail=f"insight_mode must be one of: {', '.join(INSIGHT_MODES)}")
         
-        # Process data
-        processed_data = []
-        for doc in data:
-            clean_doc = {k: v for k, v in doc.items() if k != '_id'}
-            for key, value in clean_doc.items():
-                if isinstance(value, datetime):
-                    clean_doc[key] = value.isoformat()
-            processed_data.append(clean_doc)
+        # Get filtered data first; full mode map-reduces over the query and needs no sample
+        query = await build_filter_query(filter_request)
+        if filter_request.insight_mode == "full":
+            processed_data = None
+            total_count = await db[filter_request.collection].count_documents(query)
+            if not total_count:
+                raise HTTPException(status_code=404, detail="No data found for the specified filters")
+        else:
+            processed_data, total_count = await fetch_insight_sample(filter_request.collection, query, ENHANCED_INSIGHT_SAMPLE_SIZE)
+            if not processed_data:
+                raise HTTPException(status_code=404, detail="No data found for the specified filters")
         
-        # Generate enhanced insights
-        insights = await get_enhanced_web_insights(
+        # Generate enhanced insights (identical filter requests share one job)
+        insight_job_id = await submit_insight_job(
             processed_data, 
             filter_request.collection, 
-            f"Analyze patterns in {filter_request.collection} data",
-            filter_request.chart_type or "bar"
+            ENHANCED_INSIGHT_QUERY.format(collection=filter_request.collection),
+            filter_request.chart_type or "bar",
+            query,
+            filter_request.insight_mode,
+            ENHANCED_INSIGHT_SAMPLE_SIZE
         )
-        
-        # Get total count for context
-        total_count = await db[filter_request.collection].count_documents(query)
+        insight_job = await wait_for_insight_job(insight_job_id, INSIGHT_JOB_WAIT_SECONDS)
+        insights = insight_job["result"] if insight_job else None
         
         return {
             "collection": filter_request.collection,
             "total_records": total_count,
-            "analyzed_sample": len(processed_data),
+            "analyzed_sample": total_count if filter_request.insight_mode == "full" else len(processed_data),
+            "insight_mode": filter_request.insight_mode,
             "insights": insights,
+            "insight_job_id": insight_job_id,
             "applied_filters": {
                 "states": filter_request.states,
                 "years": filter_request.years,
@@ -722,13 +3991,176 @@ async def get_enhanced_insights(filter_request: FilterRequest):
         logging.error(f"Enhanced insights error: {e}")
         raise HTTPException(status_code=500, detail="Error generating enhanced insights")
 
+INSIGHT_BATCH_MAX_REQUESTS = 20
+INSIGHT_BATCH_PACK_SIZE = 4  # Analyses packed into one LLM call
+
+@api_router.post("/insights/batch")
+async def get_batch_insights(batch_request: BatchInsightRequest):
+    """Get enhanced AI insights for many filter requests in one call"""
+    if not batch_request.requests:
+        raise HTTPException(status_code=400, detail="At least one filter request is required")
+    if len(batch_request.requests) > INSIGHT_BATCH_MAX_REQUESTS:
+        raise HTTPException(status_code=400, detail=f"At most {INSIGHT_BATCH_MAX_REQUESTS} filter requests per batch")
+    if any(filter_request.insight_mode != "sample" for filter_request in batch_request.requests):
+        # Batched analyses are packed over samples; full map-reduce runs go through /insights/enhanced
+        raise HTTPException(status_code=400, detail="Batch insights only support insight_mode 'sample'; use /insights/enhanced for 'full'")
+    
+    try:
+        collections = await db.list_collection_names()
+        
+        # Deduplicate identical sub-queries across the batch
+        items = []
+        unique_queries = {}
+        for filter_request in batch_request.requests:
+            query = await build_filter_query(filter_request)
+            chart_type = filter_request.chart_type or "bar"
+            query_key = json.dumps({"collection": filter_request.collection, "query": query}, sort_keys=True, default=str)
+            if filter_request.collection in collections:
+                unique_queries.setdefault(query_key, (filter_request.collection, query))
+            items.append({
+                "filter_request": filter_request,
+                "query": query,
+                "query_key": query_key,
+                "chart_type": chart_type,
+                "job_id": make_insight_job_id(
+                    filter_request.collection, query, chart_type,
+                    query_text=ENHANCED_INSIGHT_QUERY.format(collection=filter_request.collection),
+                    sample_limit=ENHANCED_INSIGHT_SAMPLE_SIZE
+                )
+            })
+        
+        # Run the Mongo work for every unique sub-query concurrently
+        query_keys = list(unique_queries)
+        fetched = await asyncio.gather(
+            *(fetch_insight_sample(*unique_queries[key], ENHANCED_INSIGHT_SAMPLE_SIZE) for key in query_keys)
+        )
+        samples = dict(zip(query_keys, fetched))
+        
+        # Reuse finished or in-flight insight jobs, pack the rest into shared LLM calls
+        insights_by_job = {}
+        in_flight = []
+        to_analyze = {}
+        for item in items:
+            job_id = item["job_id"]
+            if item["query_key"] not in samples or job_id in insights_by_job or job_id in to_analyze:
+                continue
+            data_sample, total_count = samples[item["query_key"]]
+            if not data_sample:
+                continue
+            job = insight_jobs.get(job_id)
+            if job and job["status"] == "completed":
+                insights_by_job[job_id] = job["result"]
+            elif job and job["status"] in ("pending", "running"):
+                in_flight.append(job_id)
+            else:
+                to_analyze[job_id] = {
+                    "id": job_id,
+                    "collection": item["filter_request"].collection,
+                    "query": item["query"],
+                    "chart_type": item["chart_type"],
+                    "total_records": total_count,
+                    "data_sample": data_sample
+                }
+        
+        pending = list(to_analyze.values())
+        chunks = [pending[i:i + INSIGHT_BATCH_PACK_SIZE] for i in range(0, len(pending), INSIGHT_BATCH_PACK_SIZE)]
+        chunk_results, in_flight_jobs = await asyncio.gather(
+            asyncio.gather(*(get_batched_enhanced_insights(chunk) for chunk in chunks)),
+            asyncio.gather(*(wait_for_insight_job(job_id, INSIGHT_JOB_WAIT_SECONDS) for job_id in in_flight))
+        )
+        for chunk_result in chunk_results:
+            for job_id, result in chunk_result.items():
+                result = await enrich_insights(result, to_analyze[job_id]["collection"], to_analyze[job_id]["query"])
+                insights_by_job[job_id] = result
+                record_insight_job_result(job_id, to_analyze[job_id]["collection"], to_analyze[job_id]["chart_type"], result)
+        for job_id, job in zip(in_flight, in_flight_jobs):
+            insights_by_job[job_id] = job["result"] if job else None
+        
+        # Assemble per-item results in request order
+        results = []
+        for item in items:
+            filter_request = item["filter_request"]
+            result = {
+                "collection": filter_request.collection,
+                "applied_filters": {
+                    "states": filter_request.states,
+                    "years": filter_request.years,
+                    "crime_types": filter_request.crime_types
+                }
+            }
+            if item["query_key"] not in samples:
+                result["error"] = "Collection not found"
+            elif not samples[item["query_key"]][0]:
+                result["error"] = "No data found for the specified filters"
+            else:
+                data_sample, total_count = samples[item["query_key"]]
+                result.update({
+                    "total_records": total_count,
+                    "analyzed_sample": len(data_sample),
+                    "insights": insights_by_job.get(item["job_id"]),
+                    "insight_job_id": item["job_id"]
+                })
+            results.append(result)
+        
+        return {
+            "results": results,
+            "unique_queries": len(query_keys),
+            "llm_calls": len(chunks),
+            "generated_at": datetime.utcnow().isoformat()
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Batch insights error: {e}")
+        raise HTTPException(status_code=500, detail="Error generating batch insights")
+
 @api_router.post("/chat")
 async def chat_with_ai(query: ChatQuery):
     """Enhanced AI chatbot endpoint for natural language queries with better data processing"""
+    llm_priority.set("interactive")
     try:
         # Process the query for better understanding
         query_info = await process_enhanced_query(query.query)
         
+        # Questions spanning several datasets go through the join engine
+        if query_info['comparative'] and len(query_info['collections']) >= 2:
+            try:
+                frame = await join_collections(
+                    query_info['collections'], query_info['states'] or None,
+                    query_info['years'] or None, expand_aliases=True
+                )
+                if frame["rows"]:
+                    national_frame = None
+                    if query_info['states'] and len(frame["rows"]) < 3:
+                        national_frame = await join_collections(query_info['collections'], None, query_info['years'] or None)
+                    insight = await generate_comparative_response(frame, query_info, national_frame)
+                    return {
+                        "query": query.query,
+                        "results": [{
+                            "collection": " + ".join(query_info['collections']),
+                            "insight": insight,
+                            "chart_type": "line" if frame["on"] == "state_year" and len(query_info['states']) == 1 else "bar",
+                            "data": frame["rows"][:50],
+                            "record_count": len(frame["rows"]),
+                            "join": {
+                                "on": frame["on"],
+                                "metrics": frame["metrics"],
+                                "correlations": pairwise_correlations(frame)
+                            },
+                            "query_info": {
+                                "states": query_info['states'],
+                                "years": query_info['years'],
+                                "collections": query_info['collections'],
+                                "corrections": query_info['corrections']
+                            }
+                        }],
+                        "total_collections_searched": len(query_info['collections'])
+                    }
+            except Exception as e:
+                logging.error(f"Comparative query error: {e}")
+                # Fall through to the single-collection paths
+        
         # If specific data query detected, handle it specifically
         if query_info['collection'] and (query_info['states'] or query_info['years']):
             try:
@@ -736,21 +4168,10 @@ async def chat_with_ai(query: ChatQuery):
                 db_query = {}
                 
                 if query_info['states']:
-                    # Map state names to database format
-                    state_names = []
-                    for state in query_info['states']:
-                        if state.lower() == 'delhi':
-                            state_names.append('Delhi')
-                        elif state.lower() == 'mumbai':
-                            state_names.extend(['Maharashtra', 'Mumbai'])
-                        elif state.lower() == 'bangalore':
-                            state_names.extend(['Karnataka', 'Bangalore'])
-                        elif state.lower() == 'kerala':
-                            state_names.append('Kerala')
-                        else:
-                            # Capitalize first letter of each word
-                            state_names.append(state.title())
-                    
+                    # Map detected states to the spellings stored in this collection
+                    state_names = await resolve_state_names(
+                        query_info['states'], query_info['collection'], expand_aliases=True
+                    )
                     db_query["state"] = {"$in": state_names}
                 
                 if query_info['years']:
@@ -764,8 +4185,11 @@ async def chat_with_ai(query: ChatQuery):
                     else:
                         db_query["year"] = {"$in": query_info['years']}
                 
-                # Get specific data
-                data = await db[query_info['collection']].find(db_query).limit(50).to_list(50)
+                # Get specific data (skip the round trip when no detected state exists in the collection)
+                if "state" in db_query and not db_query["state"]["$in"]:
+                    data = []
+                else:
+                    data = await fetch_stratified_sample(query_info['collection'], db_query, 50)
                 
                 if data:
                     # Clean data to remove ObjectIds and convert dates
@@ -780,10 +4204,17 @@ async def chat_with_ai(query: ChatQuery):
                     
                     # Generate enhanced human-readable response
                     insight = await generate_specific_response(cleaned_data, query_info)
+                    if query_info['states']:
+                        insight += await describe_state_percentiles(query_info['collection'], db_query["state"]["$in"])
                     
                     # Get chart recommendations
                     chart_rec = await get_chart_recommendations(cleaned_data)
                     
+                    # Precomputed anomalies for the requested states and years
+                    detected = await get_detected_anomalies(
+                        query_info['collection'], query_filter_values(db_query, "state"), query_info['years'] or None
+                    )
+                    
                     return {
                         "query": query.query,
                         "results": [{
@@ -791,11 +4222,13 @@ async def chat_with_ai(query: ChatQuery):
                             "insight": insight,
                             "chart_type": chart_rec["recommended"],
                             "data": cleaned_data[:5],  # Sample data for visualization
+                            "anomalies": [a["description"] for a in detected],
                             "record_count": len(cleaned_data),
                             "query_info": {
                                 "states": query_info['states'],
                                 "years": query_info['years'],
-                                "data_type": query_info['data_type']
+                                "data_type": query_info['data_type'],
+                                "corrections": query_info['corrections']
                             }
                         }],
                         "total_collections_searched": 1
@@ -829,38 +4262,47 @@ async def chat_with_ai(query: ChatQuery):
             priority_collections = ['crimes', 'literacy', 'aqi', 'power_consumption']
             target_collections = [c for c in priority_collections if c in data_collections][:3]
         
+        # Get sample data from every collection, then analyze them all in one LLM call
+        samples = {}
+        fetched = await asyncio.gather(
+            *(fetch_stratified_sample(collection_name, {}, 10) for collection_name in target_collections),
+            return_exceptions=True
+        )
+        for collection_name, sample_data in zip(target_collections, fetched):
+            if isinstance(sample_data, Exception):
+                logging.error(f"Collection {collection_name} error: {sample_data}")
+            elif sample_data:
+                samples[collection_name] = sample_data
+        
+        ai_results = await get_batched_openai_insights(samples, query.query, query_info['comparative']) if samples else {}
+        
         results = []
-        for collection_name in target_collections:
+        for collection_name, sample_data in samples.items():
             try:
-                # Get sample data from collection
-                sample_data = await db[collection_name].find().limit(10).to_list(10)
+                ai_result = await enrich_insights(ai_results[collection_name], collection_name)
                 
-                if sample_data:
-                    # Get AI insights
-                    ai_result = await get_openai_insight(sample_data, query.query)
-                    
-                    # Get chart recommendations
-                    chart_rec = await get_chart_recommendations(sample_data)
-                    
-                    # Process data for visualization
-                    processed_data = []
-                    for doc in sample_data[:5]:
-                        clean_doc = {k: v for k, v in doc.items() if k != '_id'}
-                        for key, value in clean_doc.items():
-                            if isinstance(value, datetime):
-                                clean_doc[key] = value.isoformat()
-                        processed_data.append(clean_doc)
-                    
-                    results.append({
-                        "collection": collection_name,
-                        "insight": ai_result.get("insight", "Analysis completed"),
-                        "chart_type": ai_result.get("chart_type", chart_rec["recommended"]),
-                        "data": processed_data,
-                        "anomalies": ai_result.get("anomalies", []),
-                        "trend": ai_result.get("trend", "stable"),
-                        "key_metrics": ai_result.get("key_metrics", []),
-                        "record_count": len(sample_data)
-                    })
+                # Get chart recommendations
+                chart_rec = await get_chart_recommendations(sample_data)
+                
+                # Process data for visualization
+                processed_data = []
+                for doc in sample_data[:5]:
+                    clean_doc = {k: v for k, v in doc.items() if k != '_id'}
+                    for key, value in clean_doc.items():
+                        if isinstance(value, datetime):
+                            clean_doc[key] = value.isoformat()
+                    processed_data.append(clean_doc)
+                
+                results.append({
+                    "collection": collection_name,
+                    "insight": ai_result.get("insight", "Analysis completed"),
+                    "chart_type": ai_result.get("chart_type", chart_rec["recommended"]),
+                    "data": processed_data,
+                    "anomalies": ai_result.get("anomalies", []),
+                    "trend": ai_result.get("trend", "stable"),
+                    "key_metrics": ai_result.get("key_metrics", []),
+                    "record_count": len(sample_data)
+                })
             except Exception as e:
                 logging.error(f"Collection {collection_name} error: {e}")
                 continue
@@ -906,23 +4348,33 @@ async def chat_with_ai(query: ChatQuery):
         }
 
 @api_router.get("/visualize/{collection_name}")
-async def get_visualization_data(collection_name: str, limit: int = 50, states: str = None, years: str = None):
+async def get_visualization_data(collection_name: str, limit: int = 50, states: str = None, years: str = None,
+                                 granularity: str = None, max_points: int = TIME_SERIES_DEFAULT_POINTS,
+                                 format: str = "rows", chart_type: str = "bar", group_by: str = None):
     """Get data for visualization from specific collection with optional filtering"""
     try:
         # Verify collection exists
-        collections = await db.list_collection_names()
+        async with timed_stage("db"):
+            collections = await db.list_collection_names()
         if collection_name not in collections:
             raise HTTPException(status_code=404, detail="Collection not found")
+        if format not in RESPONSE_FORMATS:
+            raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(RESPONSE_FORMATS)}")
         
         # Build query based on optional filters
         query = {}
+        states_unmatched = False
         if states:
             state_list = [s.strip() for s in states.split(',') if s.strip()]
             if state_list:
-                query["state"] = {"$in": state_list}
+                resolved_states = await resolve_state_names(state_list, collection_name)
+                if resolved_states:
+                    query["state"] = {"$in": resolved_states}
+                else:
+                    states_unmatched = True
         
+        year_list = []
         if years:
-            year_list = []
             try:
                 year_list = [int(y.strip()) for y in years.split(',') if y.strip()]
             except ValueError:
@@ -940,13 +4392,12 @@ async def get_visualization_data(collection_name: str, limit: int = 50, states:
                     query["year"] = {"$in": year_list}
         
         # If no filters provided, try to get a representative sample from all states
-        if not query:
-            # Get all states first
-            all_states = await db[collection_name].distinct("state")
-            # For better visualization, limit to top 10-15 states and get recent data
+        if not query and not states_unmatched:
+            # For better visualization, get recent data
             if collection_name != "covid_stats":
                 # Get latest year available
-                latest_years = await db[collection_name].distinct("year")
+                async with timed_stage("db"):
+                    latest_years = await db[collection_name].distinct("year")
                 if latest_years:
                     latest_year = max(latest_years)
                     query = {"year": latest_year}
@@ -954,12 +4405,18 @@ async def get_visualization_data(collection_name: str, limit: int = 50, states:
                 # For COVID data, get recent data
                 query = {"date": {"$regex": "^202[0-3]"}}
         
-        # Get data
-        data = await db[collection_name].find(query).limit(limit).to_list(limit)
-        
-        # If still no data and filters were applied, try without filters
-        if not data and (states or years):
-            data = await db[collection_name].find().limit(limit).to_list(limit)
+        # Get data; when none of the requested states exist in this collection go
+        # straight to the unfiltered sample instead of running a query that cannot match
+        async with timed_stage("db"):
+            if states_unmatched:
+                query = {}
+                data = []
+            else:
+                data = await fetch_stratified_sample(collection_name, query, limit)
+            
+            # If still no data and filters were applied, try without filters
+            if not data and (states or years):
+                data = await fetch_stratified_sample(collection_name, {}, limit)
         
         # Process data for frontend
         processed_data = []
@@ -974,22 +4431,41 @@ async def get_visualization_data(collection_name: str, limit: int = 50, states:
         # Get chart recommendations
         chart_rec = await get_chart_recommendations(processed_data)
         
-        # Generate AI insights using enhanced method
-        ai_insights = await get_enhanced_web_insights(
+        # Queue AI insights in the background so chart data is not held up by the LLM
+        insight_job_id = await submit_insight_job(
             processed_data, 
             collection_name, 
             f"Analyze the {collection_name} dataset patterns and trends",
-            "bar"  # Default chart type for general visualization
+            "bar",  # Default chart type for general visualization
+            query,
+            sample_limit=limit
         )
+        insight_job = insight_jobs[insight_job_id]
         
         # Get metadata for context
-        metadata = await get_collection_metadata(collection_name)
+        async with timed_stage("metadata"):
+            metadata = await get_collection_metadata(collection_name)
+        
+        # Full-range series for date-keyed data instead of the first `limit` rows
+        time_series = None
+        if granularity in TIME_SERIES_GRANULARITIES and collection_name == "covid_stats":
+            async with timed_stage("db"):
+                field = await get_metric_field(collection_name)
+                if field:
+                    time_series = await build_time_series(
+                        collection_name, field, query.get("state", {}).get("$in"), year_list or None,
+                        granularity, max(3, min(max_points, TIME_SERIES_MAX_POINTS))
+                    )
         
         return {
             "collection": collection_name,
-            "data": processed_data,
+            "data": build_chart_payload(processed_data, format, collection_name, chart_type, group_by),
+            "format": format,
+            "time_series": time_series,
             "chart_recommendations": chart_rec,
-            "ai_insights": ai_insights,
+            "ai_insights": insight_job["result"],  # Already available when the job was computed earlier
+            "insight_job_id": insight_job_id,
+            "insight_status": insight_job["status"],
             "total_records": len(processed_data),
             "metadata": metadata.dict(),
             "query_used": query
@@ -1010,7 +4486,10 @@ async def get_dataset_insights(collection_name: str, states: str = None, years:
         if states:
             state_list = [s.strip() for s in states.split(',') if s.strip()]
             if state_list:
-                query["state"] = {"$in": state_list}
+                resolved_states = await resolve_state_names(state_list, collection_name)
+                if not resolved_states:
+                    raise HTTPException(status_code=404, detail="No data found for the specified criteria")
+                query["state"] = {"$in": resolved_states}
         
         if years:
             year_list = []
@@ -1030,18 +4509,22 @@ async def get_dataset_insights(collection_name: str, states: str = None, years:
                     query["year"] = {"$in": year_list}
         
         # Get sample data
-        sample_data = await db[collection_name].find(query).limit(50).to_list(50)
+        sample_data = await fetch_stratified_sample(collection_name, query, 50)
         
         if not sample_data:
             raise HTTPException(status_code=404, detail="No data found for the specified criteria")
         
-        # Generate comprehensive insights using enhanced method
-        insights = await get_enhanced_web_insights(
+        # Generate comprehensive insights through the shared job queue
+        insight_job_id = await submit_insight_job(
             sample_data, 
             collection_name, 
             f"Provide comprehensive analysis of the {collection_name} dataset including trends, patterns, and key findings",
-            "bar"  # Default chart type for insights
+            "bar",  # Default chart type for insights
+            query,
+            sample_limit=50
         )
+        insight_job = await wait_for_insight_job(insight_job_id, INSIGHT_JOB_WAIT_SECONDS)
+        insights = insight_job["result"] if insight_job else None
         
         # Calculate basic statistics
         total_records = await db[collection_name].count_documents(query if query else {})
@@ -1053,6 +4536,7 @@ async def get_dataset_insights(collection_name: str, states: str = None, years:
             "collection": collection_name,
             "total_records": total_records,
             "insights": insights,
+            "insight_job_id": insight_job_id,
             "sample_size": len(sample_data),
             "metadata": metadata.dict(),
             "applied_filters": {
@@ -1068,6 +4552,68 @@ async def get_dataset_insights(collection_name: str, states: str = None, years:
         logging.error(f"Insights error: {e}")
         raise HTTPException(status_code=500, detail="Error generating insights")
 
+@api_router.get("/insights/jobs/{job_id}")
+async def get_insight_job(job_id: str, wait: float = 0):
+    """Poll an insight job; pass wait (seconds) to long-poll until it finishes"""
+    job = await wait_for_insight_job(job_id, min(max(wait, 0), INSIGHT_JOB_WAIT_SECONDS))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Insight job not found")
+    return serialize_insight_job(job)
+
+@api_router.get("/insights/jobs/{job_id}/stream")
+async def stream_insight_job(job_id: str):
+    """Subscribe to an insight job as server-sent events"""
+    job = insight_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Insight job not found")
+
+    async def event_stream():
+        yield f"data: {json.dumps(serialize_insight_job(job), default=str)}\n\n"
+        while not job["done"].is_set():
+            try:
+                await asyncio.wait_for(job["done"].wait(), 15)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+        yield f"data: {json.dumps(serialize_insight_job(job), default=str)}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+@api_router.get("/metrics")
+async def get_metrics():
+    """Operational metrics for the API"""
+    return {
+        "llm_circuit_breaker": llm_circuit_breaker.snapshot(),
+        "llm_dispatch": llm_dispatcher.snapshot(),
+        "llm_tiers": {
+            tier: {"model": LLM_TIERS[tier]["model"], "max_tokens": LLM_TIERS[tier]["max_tokens"],
+                   "timeout_seconds": LLM_TIERS[tier]["timeout"], **stats.snapshot()}
+            for tier, stats in llm_tier_stats.items()
+        },
+        "llm_usage": [
+            {"endpoint": endpoint, "collection": collection_name, "chart_type": chart_type, **stats.snapshot()}
+            for (endpoint, collection_name, chart_type), stats in sorted(llm_usage_stats.items())
+        ]
+    }
+
+@api_router.get("/admin/slow-queries")
+async def get_slow_queries(limit: int = 20):
+    """Slowest query shapes by total time, with their explain summaries"""
+    return {
+        "threshold_ms": SLOW_QUERY_MS,
+        "enabled": SLOW_QUERY_MS > 0,
+        "shapes_tracked": len(slow_query_log.shapes),
+        "shapes_dropped": slow_query_log.dropped,
+        "slow_queries": slow_query_log.worst(max(1, min(limit, SLOW_QUERY_MAX_SHAPES)))
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_prometheus_metrics():
+    """Per-route, per-stage request latency histograms for Prometheus scraping"""
+    return render_stage_metrics()
+
+# Same exposition under /api for deployments whose ingress only forwards /api to the backend
+api_router.add_api_route("/metrics/prometheus", get_prometheus_metrics, methods=["GET"], response_class=PlainTextResponse)
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -1087,8 +4633,17 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def start_background_tasks():
+    # Slow-query explains run on this loop; the listener itself is called from driver threads
+    slow_query_log.loop = asyncio.get_running_loop()
+    # Precompute analytics in the background without delaying startup
+    app.state.analytics_warmup = asyncio.create_task(warm_analytics_cache())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in [*insight_job_workers, *quantile_sketch_tasks.values()]:
+        task.cancel()
     client.close()
 
 if __name__ == "__main__":
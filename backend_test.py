@@ -828,5 +828,497 @@ class TestTRACITYAPI(unittest.TestCase):
                         if year in year_counts:
                             self.assertGreater(year_counts[year], 0, f"Should have multiple records for year {year}")
 
+    def test_16_insight_job_polling(self):
+        """Test that visualize returns an insight job that can be polled to completion"""
+        success, response = self.tester.run_test(
+            "Visualization for crimes - Insight job",
+            "GET",
+            "visualize/crimes",
+            200
+        )
+        self.assertTrue(success)
+        if success:
+            data = response.json()
+            self.assertIn("insight_job_id", data)
+            self.assertIn("insight_status", data)
+            
+            success, job_response = self.tester.run_test(
+                "Poll insight job",
+                "GET",
+                f"insights/jobs/{data['insight_job_id']}",
+                200,
+                params={"wait": 30}
+            )
+            self.assertTrue(success)
+            if success:
+                job = job_response.json()
+                self.assertEqual(job["job_id"], data["insight_job_id"])
+                self.assertIn(job["status"], ["pending", "running", "completed", "failed"])
+                if job["status"] == "completed":
+                    self.assertIn("insight", job["insights"])
+                print(f"Insight job status: {job['status']}")
+        
+        # Unknown jobs should 404
+        success, _ = self.tester.run_test(
+            "Poll unknown insight job",
+            "GET",
+            "insights/jobs/does-not-exist",
+            404
+        )
+        self.assertTrue(success)
+
+    def test_17_batch_insights_endpoint(self):
+        """Test batch insights with duplicate and invalid filter requests"""
+        requests_batch = [
+            {"collection": "crimes", "chart_type": "bar"},
+            {"collection": "crimes", "chart_type": "bar"},
+            {"collection": "aqi", "chart_type": "line"},
+            {"collection": "non_existent_collection"}
+        ]
+        success, response = self.tester.run_test(
+            "Batch insights",
+            "POST",
+            "insights/batch",
+            200,
+            data={"requests": requests_batch}
+        )
+        self.assertTrue(success)
+        if success:
+            data = response.json()
+            self.assertIn("results", data)
+            self.assertEqual(len(data["results"]), len(requests_batch))
+            # The two identical crimes requests collapse into one sub-query
+            self.assertLessEqual(data["unique_queries"], 2)
+            self.assertEqual(data["results"][3].get("error"), "Collection not found")
+            for result in data["results"][:3]:
+                if "error" not in result:
+                    self.assertIn("insights", result)
+                    self.assertIn("total_records", result)
+            print(f"Batch: {data['unique_queries']} unique queries, {data['llm_calls']} LLM calls")
+        
+        # Empty batches are rejected
+        success, _ = self.tester.run_test(
+            "Batch insights - Empty",
+            "POST",
+            "insights/batch",
+            400,
+            data={"requests": []}
+        )
+        self.assertTrue(success)
+
+    def test_18_metrics_endpoint(self):
+        """Test that the metrics endpoint exposes the LLM circuit breaker state"""
+        success, response = self.tester.run_test(
+            "Metrics",
+            "GET",
+            "metrics",
+            200
+        )
+        self.assertTrue(success)
+        if success:
+            data = response.json()
+            self.assertIn("llm_circuit_breaker", data)
+            self.assertIn(data["llm_circuit_breaker"]["state"], ["closed", "open", "half_open"])
+            print(f"LLM circuit breaker: {data['llm_circuit_breaker']}")
+            self.assertEqual(set(data["llm_dispatch"]["classes"]), {"interactive", "standard", "background"})
+            self.assertEqual(set(data["llm_tiers"]), {"chat_answer", "chart_insight", "deep_dive"})
+            for tier in data["llm_tiers"].values():
+                self.assertIn("model", tier)
+                self.assertIn("estimated_cost_usd", tier)
+            for usage in data["llm_usage"]:
+                self.assertIn("prompt_tokens", usage)
+                self.assertEqual(usage["latency_histogram"]["le_inf"], usage["calls"])
+
+    def test_19_state_name_normalization(self):
+        """Test that state names and aliases are normalized to the stored spellings"""
+        success, response = self.tester.run_test(
+            "Visualization for literacy - Lowercase state",
+            "GET",
+            "visualize/literacy",
+            200,
+            params={"states": "kerala"}
+        )
+        self.assertTrue(success)
+        if success:
+            data = response.json()
+            if data["data"]:
+                for record in data["data"]:
+                    self.assertEqual(record["state"], "Kerala")
+        
+        success, response = self.tester.run_test(
+            "Filtered data for crimes - State alias",
+            "POST",
+            "data/filtered",
+            200,
+            data={"collection": "crimes", "states": ["bombay"]}
+        )
+        self.assertTrue(success)
+        if success:
+            data = response.json()
+            for record in data["data"]:
+                self.assertIn(record["state"], ["Maharashtra", "Mumbai"])
+
+    def test_20_joined_data_endpoint(self):
+        """Test aligning several collections on state and year"""
+        success, response = self.tester.run_test(
+            "Joined data - crimes and literacy",
+            "POST",
+            "data/joined",
+            200,
+            data={"collections": ["crimes", "literacy"]}
+        )
+        self.assertTrue(success)
+        if success:
+            data = response.json()
+            self.assertIn(data["on"], ["state_year", "state"])
+            self.assertIn("metrics", data)
+            self.assertIn("correlations", data)
+            for row in data["rows"]:
+                self.assertIn("state", row)
+                self.assertIn("crimes", row)
+                self.assertIn("literacy", row)
+            print(f"Joined on {data['on']}: {data['returned_count']} rows")
+        
+        # A single collection is not a join
+        success, _ = self.tester.run_test(
+            "Joined data - Single collection",
+            "POST",
+            "data/joined",
+            400,
+            data={"collections": ["crimes"]}
+        )
+        self.assertTrue(success)
+
+    def test_21_correlation_analytics_endpoint(self):
+        """Test cross-dataset correlation matrices"""
+        success, response = self.tester.run_test(
+            "Correlation analytics",
+            "GET",
+            "analytics/correlation",
+            200,
+            params={"collections": "aqi,literacy,power_consumption,crimes", "max_lag": 1}
+        )
+        self.assertTrue(success)
+        if success:
+            data = response.json()
+            size = len(data["metrics"])
+            self.assertEqual(size, 4)
+            for section in ["state_year", "state_level"]:
+                self.assertEqual(len(data[section]["pearson"]), size)
+                self.assertEqual(len(data[section]["spearman"]), size)
+            self.assertIn("lagged", data)
+            self.assertIn("data_versions", data)
+            print(f"Correlation computed in {data['computed_in_ms']} ms (cached: {data['cached']})")
+            
+            # The same request is served from the cache
+            success, response = self.tester.run_test(
+                "Correlation analytics - Cached",
+                "GET",
+                "analytics/correlation",
+                200,
+                params={"collections": "aqi,literacy,power_consumption,crimes", "max_lag": 1}
+            )
+            if success:
+                self.assertTrue(response.json()["cached"])
+
+    def test_22_trend_forecast_endpoint(self):
+        """Test per-state trend fitting and projections"""
+        for method in ["ols", "robust"]:
+            success, response = self.tester.run_test(
+                f"Trend forecast for crimes - {method}",
+                "GET",
+                "analytics/forecast/crimes",
+                200,
+                params={"horizon": 2, "method": method}
+            )
+            self.assertTrue(success)
+            if success:
+                data = response.json()
+                self.assertEqual(data["method"], method)
+                self.assertIn("overall", data)
+                self.assertIn("states", data)
+                for state in data["states"]:
+                    self.assertIn("slope_per_year", state)
+                    self.assertEqual(len(state["slope_ci_95"]), 2)
+                    self.assertIn(state["trend"], [None, "increasing", "decreasing", "stable", "volatile"])
+                    if state["projections"]:
+                        self.assertEqual(len(state["projections"]), 2)
+                print(f"Overall {method} trend: {data['overall']['trend']} ({data['overall']['slope_per_year']}/year)")
+        
+        success, _ = self.tester.run_test(
+            "Trend forecast - Horizon too long",
+            "GET",
+            "analytics/forecast/crimes",
+            400,
+            params={"horizon": 10}
+        )
+        self.assertTrue(success)
+
+    def test_23_anomalies_endpoint(self):
+        """Test precomputed anomaly detection"""
+        success, response = self.tester.run_test(
+            "Anomalies for covid_stats",
+            "GET",
+            "analytics/anomalies/covid_stats",
+            200,
+            params={"limit": 10}
+        )
+        self.assertTrue(success)
+        if success:
+            data = response.json()
+            self.assertLessEqual(len(data["anomalies"]), 10)
+            for anomaly in data["anomalies"]:
+                self.assertIn(anomaly["type"], ["cross_sectional", "temporal", "jump"])
+                self.assertIn("robust_z", anomaly)
+                self.assertIn("description", anomaly)
+            print(f"Detected {data['total_detected']} anomalies in {data['field']}")
+        
+        success, _ = self.tester.run_test(
+            "Anomalies - Unknown collection",
+            "GET",
+            "analytics/anomalies/nonexistent",
+            404
+        )
+        self.assertTrue(success)
+
+    def test_24_distribution_endpoint(self):
+        """Test percentiles from quantile sketches"""
+        success, response = self.tester.run_test(
+            "Distribution for aqi by state",
+            "GET",
+            "distribution/aqi",
+            200,
+            params={"percentiles": "25,50,75", "value": 150, "group_by": "state"}
+        )
+        self.assertTrue(success)
+        if success:
+            data = response.json()
+            self.assertEqual(set(data["percentiles"]), {"p25", "p50", "p75"})
+            self.assertIn("value_percentile", data)
+            self.assertIn("box_plot", data)
+            for group in data["groups"]:
+                self.assertIn("state", group)
+                self.assertGreater(group["count"], 0)
+            print(f"AQI median: {data['percentiles']['p50']} over {data['count']} records")
+        
+        success, _ = self.tester.run_test(
+            "Distribution - Invalid percentile",
+            "GET",
+            "distribution/aqi",
+            400,
+            params={"percentiles": "150"}
+        )
+        self.assertTrue(success)
+
+    def test_25_histogram_endpoint(self):
+        """Test database-side histogram binning"""
+        for binning in ["fixed", "quantile"]:
+            success, response = self.tester.run_test(
+                f"Histogram for aqi - {binning} bins",
+                "POST",
+                "histogram",
+                200,
+                data={"collection": "aqi", "bins": 5, "binning": binning}
+            )
+            self.assertTrue(success)
+            if success:
+                data = response.json()
+                self.assertLessEqual(len(data["bins"]), 5)
+                self.assertEqual(data["total"], sum(b["count"] for b in data["bins"]))
+                print(f"{binning} bins: {[b['count'] for b in data['bins']]}")
+        
+        success, response = self.tester.run_test(
+            "Histogram - Custom AQI bands",
+            "POST",
+            "histogram",
+            200,
+            data={"collection": "aqi", "boundaries": [0, 50, 100, 200, 300, 500]}
+        )
+        self.assertTrue(success)
+        if success:
+            self.assertEqual(len(response.json()["bins"]), 5)
+        
+        success, _ = self.tester.run_test(
+            "Histogram - Invalid boundaries",
+            "POST",
+            "histogram",
+            400,
+            data={"collection": "aqi", "boundaries": [100, 50]}
+        )
+        self.assertTrue(success)
+
+    def test_26_time_series_endpoint(self):
+        """Test calendar rollups and downsampling for covid_stats"""
+        for granularity in ["week", "month"]:
+            success, response = self.tester.run_test(
+                f"COVID time series - {granularity}",
+                "GET",
+                "timeseries/covid_stats",
+                200,
+                params={"granularity": granularity, "max_points": 50}
+            )
+            self.assertTrue(success)
+            if success:
+                data = response.json()
+                self.assertEqual(data["granularity"], granularity)
+                self.assertLessEqual(len(data["labels"]), 50)
+                for values in data["series"].values():
+                    self.assertEqual(len(values), len(data["labels"]))
+                print(f"{granularity}: {data['points']} points from {data['source_points']}")
+        
+        success, _ = self.tester.run_test(
+            "Time series - Year-keyed collection",
+            "GET",
+            "timeseries/crimes",
+            400
+        )
+        self.assertTrue(success)
+
+    def test_27_chart_ready_formats(self):
+        """Test columnar and series response formats"""
+        for response_format in ["columnar", "series"]:
+            success, response = self.tester.run_test(
+                f"Filtered data - {response_format} format",
+                "POST",
+                "data/filtered",
+                200,
+                data={"collection": "crimes", "limit": 200, "format": response_format}
+            )
+            self.assertTrue(success)
+            if success:
+                payload = response.json()["data"]
+                self.assertIn("labels", payload)
+                for values in payload["series"].values():
+                    self.assertEqual(len(values), len(payload["labels"]))
+                print(f"{response_format}: {len(payload['labels'])} labels, series {list(payload['series'])[:3]}")
+        
+        success, response = self.tester.run_test(
+            "Visualization - Series grouped by year",
+            "GET",
+            "visualize/crimes",
+            200,
+            params={"format": "series", "group_by": "year"}
+        )
+        self.assertTrue(success)
+        if success:
+            self.assertEqual(response.json()["format"], "series")
+
+    def test_28_pie_top_n_with_others(self):
+        """Test server-side top-N bucketing for pie charts"""
+        success, response = self.tester.run_test(
+            "Filtered data - Pie chart top 5",
+            "POST",
+            "data/filtered",
+            200,
+            data={"collection": "crimes", "chart_type": "pie", "top_n": 5, "limit": 1000}
+        )
+        self.assertTrue(success)
+        if success:
+            data = response.json()
+            self.assertEqual(data["aggregation"]["type"], "top_n")
+            self.assertLessEqual(len(data["data"]), 6)
+            if data["aggregation"]["other_groups"]:
+                self.assertEqual(data["data"][-1]["state"], "Others")
+            # Counts live in aggregation.slices so the chart only plots the metric
+            self.assertNotIn("records", data["data"][0])
+            self.assertEqual(len(data["aggregation"]["slices"]), len(data["data"]))
+            print(f"Pie slices: {[row['state'] for row in data['data']]}")
+
+    def test_29_full_dataset_insights(self):
+        """Test map-reduce insights over every matching record"""
+        success, response = self.tester.run_test(
+            "Enhanced insights - Full dataset",
+            "POST",
+            "insights/enhanced",
+            200,
+            data={"collection": "crimes", "insight_mode": "full"}
+        )
+        self.assertTrue(success)
+        if success:
+            data = response.json()
+            self.assertEqual(data["insight_mode"], "full")
+            if data["insights"]:
+                coverage = data["insights"]["coverage"]
+                self.assertEqual(coverage["records"], data["total_records"])
+                print(f"Map-reduce over {coverage['records']} records in {coverage['chunks']} chunks")
+        
+        success, _ = self.tester.run_test(
+            "Enhanced insights - Invalid mode",
+            "POST",
+            "insights/enhanced",
+            400,
+            data={"collection": "crimes", "insight_mode": "everything"}
+        )
+        self.assertTrue(success)
+
+    def test_30_request_stage_timing(self):
+        """Test Server-Timing headers and the Prometheus stage histograms"""
+        success, response = self.tester.run_test(
+            "Visualization for crimes - Server-Timing",
+            "GET",
+            "visualize/crimes",
+            200,
+            params={"limit": 10}
+        )
+        self.assertTrue(success)
+        if success:
+            server_timing = response.headers.get("Server-Timing", "")
+            print(f"Server-Timing: {server_timing}")
+            self.assertIn("total;dur=", server_timing)
+            self.assertIn("db;dur=", server_timing)
+        
+        success, response = self.tester.run_test(
+            "Prometheus metrics",
+            "GET",
+            "metrics/prometheus",
+            200
+        )
+        self.assertTrue(success)
+        if success:
+            self.assertIn("# TYPE api_request_stage_seconds histogram", response.text)
+            self.assertIn('route="/api/visualize/{collection_name}",stage="total"', response.text)
+
+    def test_31_slow_query_log(self):
+        """Test the slow-query admin endpoint"""
+        success, response = self.tester.run_test(
+            "Slow queries",
+            "GET",
+            "admin/slow-queries",
+            200,
+            params={"limit": 5}
+        )
+        self.assertTrue(success)
+        if success:
+            data = response.json()
+            self.assertIn("threshold_ms", data)
+            self.assertLessEqual(len(data["slow_queries"]), 5)
+            for entry in data["slow_queries"]:
+                print(f"{entry['command']} on {entry['collection']}: {entry['max_ms']}ms, explain: {entry['explain']}")
+
+    def test_32_sort_planner(self):
+        """Test sort_by validation and the reported sort strategy"""
+        success, response = self.tester.run_test(
+            "Filtered data for crimes - Sort plan",
+            "POST",
+            "data/filtered",
+            200,
+            data={"collection": "crimes", "sort_by": "year", "sort_order": "desc", "limit": 20}
+        )
+        self.assertTrue(success)
+        if success:
+            sort_plan = response.json()["sort_plan"]
+            print(f"Sort plan: {sort_plan}")
+            self.assertIn(sort_plan["strategy"], ["index", "top_k"])
+            self.assertEqual(sort_plan["direction"], -1)
+        
+        success, _ = self.tester.run_test(
+            "Filtered data for crimes - Unknown sort field",
+            "POST",
+            "data/filtered",
+            400,
+            data={"collection": "crimes", "sort_by": "no_such_field"}
+        )
+        self.assertTrue(success)
+
 if __name__ == "__main__":
     unittest.main(argv=['first-arg-is-ignored'], exit=False)
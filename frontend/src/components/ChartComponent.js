@@ -27,10 +27,57 @@ ChartJS.register(
   Filler
 );
 
+// Enhanced vibrant color palette that works in both day and night modes
+const ENHANCED_COLORS = [
+  'rgba(99, 102, 241, 0.85)',   // Bright Indigo
+  'rgba(59, 130, 246, 0.85)',   // Bright Blue
+  'rgba(16, 185, 129, 0.85)',   // Bright Emerald
+  'rgba(245, 158, 11, 0.85)',   // Bright Amber
+  'rgba(239, 68, 68, 0.85)',    // Bright Red
+  'rgba(139, 92, 246, 0.85)',   // Bright Violet
+  'rgba(236, 72, 153, 0.85)',   // Bright Pink
+  'rgba(20, 184, 166, 0.85)',   // Bright Teal
+  'rgba(251, 146, 60, 0.85)',   // Bright Orange
+  'rgba(34, 197, 94, 0.85)',    // Bright Green
+  'rgba(168, 85, 247, 0.85)',   // Bright Purple
+  'rgba(14, 165, 233, 0.85)',   // Bright Sky Blue
+  'rgba(217, 70, 239, 0.85)',   // Bright Fuchsia
+  'rgba(34, 211, 238, 0.85)',   // Bright Cyan
+  'rgba(244, 63, 94, 0.85)',    // Bright Rose
+  'rgba(52, 211, 153, 0.85)',   // Bright Emerald Alt
+  'rgba(251, 191, 36, 0.85)',   // Bright Yellow
+  'rgba(124, 58, 237, 0.85)',   // Bright Purple Alt
+  'rgba(248, 113, 113, 0.85)',  // Bright Red Alt
+  'rgba(96, 165, 250, 0.85)',   // Bright Blue Alt
+];
+
 const ChartComponent = ({ data, chartType = 'bar', height = 300, showYearSeparately = false }) => {
   const chartData = useMemo(() => {
     if (!data || data.length === 0) return null;
 
+    // Already pivoted on the server (format=series): one dataset per series
+    if (!Array.isArray(data)) {
+      if (!data.labels || !data.series) return null;
+      const names = Object.keys(data.series);
+      const single = names.length === 1;
+      return {
+        labels: data.labels,
+        datasets: names.map((name, index) => {
+          const color = ENHANCED_COLORS[index % ENHANCED_COLORS.length];
+          const colors = single && chartType !== 'line' ? ENHANCED_COLORS.slice(0, data.labels.length) : color;
+          return {
+            label: name.replace('_', ' ').toUpperCase(),
+            data: data.series[name].map(value => value ?? 0),
+            backgroundColor: chartType === 'line' ? color.replace('0.85', '0.2') : colors,
+            borderColor: Array.isArray(colors) ? colors.map(c => c.replace('0.85', '1')) : color.replace('0.85', '1'),
+            borderWidth: 2,
+            fill: chartType === 'line',
+            tension: chartType === 'line' ? 0.4 : undefined,
+          };
+        })
+      };
+    }
+
     // Extract keys from first data item (excluding common non-numeric fields)
     const firstItem = data[0];
     const excludeKeys = ['_id', 'id', 'name', 'title', 'description', 'category', 'type', 'date'];
@@ -165,29 +212,7 @@ const ChartComponent = ({ data, chartType = 'bar', height = 300, showYearSeparat
       const finalLabels = sortedLabels.slice(0, maxItems);
       const finalValues = sortedValues.slice(0, maxItems);
 
-      // Enhanced vibrant color palette that works in both day and night modes
-      const enhancedColors = [
-        'rgba(99, 102, 241, 0.85)',   // Bright Indigo
-        'rgba(59, 130, 246, 0.85)',   // Bright Blue
-        'rgba(16, 185, 129, 0.85)',   // Bright Emerald
-        'rgba(245, 158, 11, 0.85)',   // Bright Amber
-        'rgba(239, 68, 68, 0.85)',    // Bright Red
-        'rgba(139, 92, 246, 0.85)',   // Bright Violet
-        'rgba(236, 72, 153, 0.85)',   // Bright Pink
-        'rgba(20, 184, 166, 0.85)',   // Bright Teal
-        'rgba(251, 146, 60, 0.85)',   // Bright Orange
-        'rgba(34, 197, 94, 0.85)',    // Bright Green
-        'rgba(168, 85, 247, 0.85)',   // Bright Purple
-        'rgba(14, 165, 233, 0.85)',   // Bright Sky Blue
-        'rgba(217, 70, 239, 0.85)',   // Bright Fuchsia
-        'rgba(34, 211, 238, 0.85)',   // Bright Cyan
-        'rgba(244, 63, 94, 0.85)',    // Bright Rose
-        'rgba(52, 211, 153, 0.85)',   // Bright Emerald Alt
-        'rgba(251, 191, 36, 0.85)',   // Bright Yellow
-        'rgba(124, 58, 237, 0.85)',   // Bright Purple Alt
-        'rgba(248, 113, 113, 0.85)',  // Bright Red Alt
-        'rgba(96, 165, 250, 0.85)',   // Bright Blue Alt
-      ];
+      const enhancedColors = ENHANCED_COLORS;
 
       const enhancedBorderColors = enhancedColors.map(color => color.replace('0.85', '1'));
 
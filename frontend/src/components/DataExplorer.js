@@ -96,20 +96,20 @@ const DataExplorer = () => {
         url += '?limit=200';
       }
 
-      const [vizResponse, insightsResponse] = await Promise.all([
-        fetch(url),
-        fetch(`${process.env.REACT_APP_BACKEND_URL}/api/insights/${collection}`)
-      ]);
+      const vizResponse = await fetch(url);
 
       if (vizResponse.ok) {
         const vizData = await vizResponse.json();
         setVisualizationData(vizData);
         setChartType(vizData.chart_recommendations?.recommended || 'bar');
-      }
 
-      if (insightsResponse.ok) {
-        const insightsData = await insightsResponse.json();
-        setInsights(insightsData);
+        // Insights are generated in the background; render the chart now and fill them in later
+        if (vizData.ai_insights) {
+          setInsights({ insights: vizData.ai_insights, sample_size: vizData.total_records });
+        } else if (vizData.insight_job_id) {
+          setInsights(null);
+          pollInsightJob(vizData.insight_job_id, vizData.total_records);
+        }
       }
     } catch (error) {
       console.error('Error fetching visualization data:', error);
@@ -120,6 +120,25 @@ const DataExplorer = () => {
     }
   };
 
+  const pollInsightJob = async (jobId, sampleSize) => {
+    try {
+      for (let attempt = 0; attempt < 5; attempt++) {
+        const response = await fetch(`${process.env.REACT_APP_BACKEND_URL}/api/insights/jobs/${jobId}?wait=20`);
+        if (!response.ok) return;
+        const job = await response.json();
+        // Failed jobs may still carry fallback insights; show them rather than nothing
+        if (job.status === 'completed' || job.status === 'failed') {
+          if (job.insights) {
+            setInsights({ insights: job.insights, sample_size: sampleSize });
+          }
+          return;
+        }
+      }
+    } catch (error) {
+      console.error('Error fetching insight job:', error);
+    }
+  };
+
   const fetchFilteredData = async () => {
     if (!selectedDataset) return;
     
@@ -132,7 +151,8 @@ const DataExplorer = () => {
         crime_types: selectedCrimeTypes.length > 0 ? selectedCrimeTypes : null,
         sort_by: sortBy || null,
         sort_order: sortOrder,
-        limit: showAllStates ? 1000 : 100
+        limit: showAllStates ? 1000 : 100,
+        chart_type: chartType // Pie/doughnut get top-N slices; also gives the AI chart context
       };
 
       const response = await fetch(`${process.env.REACT_APP_BACKEND_URL}/api/data/filtered`, {
@@ -151,17 +171,12 @@ const DataExplorer = () => {
         });
 
         // Fetch enhanced insights for filtered data with chart type context
-        const enhancedFilterRequest = {
-          ...filterRequest,
-          chart_type: chartType // Pass selected chart type to AI
-        };
-
         const insightsResponse = await fetch(`${process.env.REACT_APP_BACKEND_URL}/api/insights/enhanced`, {
           method: 'POST',
           headers: {
             'Content-Type': 'application/json',
           },
-          body: JSON.stringify(enhancedFilterRequest)
+          body: JSON.stringify(filterRequest)
         });
 
         if (insightsResponse.ok) {
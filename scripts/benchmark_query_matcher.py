@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""Micro-benchmark: compiled query matcher vs the previous per-call substring scan.
+
+Run from the repository root:
+    python scripts/benchmark_query_matcher.py
+"""
+
+import os
+import re
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+
+from backend.server import STATE_ALIASES, COLLECTION_KEYWORDS, match_query_entities
+
+QUERIES = [
+    "What is the crime rate in Delhi in 2020?",
+    "Show me literacy rates in Kerala",
+    "Compare AQI between Mumbai and Bangalore for 2018 and 2019",
+    "Power consumption in Maharashtra",
+    "How has pollution changed in Uttar Pradesh since 2015?",
+    "Tell me something interesting about the data",
+]
+
+
+def legacy_match(query):
+    """The matching logic process_enhanced_query used before the compiled matcher"""
+    query_lower = query.lower()
+    state_mapping = {state: list(variations) for state, variations in STATE_ALIASES.items()}
+    detected_states = [
+        state for state, variations in state_mapping.items()
+        if any(var in query_lower for var in variations)
+    ]
+    years = [int(year) for year in re.findall(r'\b(20[0-2][0-9])\b', query)]
+    collection = None
+    for name, _, keywords in COLLECTION_KEYWORDS:
+        if any(word in query_lower for word in keywords):
+            collection = name
+            break
+    return detected_states, years, collection
+
+
+def main(number=20000):
+    for name, func in (("legacy substring scan", legacy_match), ("compiled matcher", match_query_entities)):
+        elapsed = timeit.timeit(lambda: [func(q) for q in QUERIES], number=number)
+        per_query_us = elapsed / (number * len(QUERIES)) * 1e6
+        print(f"{name:<24} {per_query_us:8.2f} µs/query")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+"""Load test: mixed API traffic at set concurrency levels, with per-endpoint RPS and latency percentiles.
+
+By default the API runs in this process against an in-memory Mongo stand-in
+(mongomock-motor) seeded with synthetic data, and a local fake OpenAI-compatible
+server with configurable latency and errors. Run from the repository root:
+
+    python scripts/load_test.py --concurrency 1,8,32 --duration 20
+    python scripts/load_test.py --mongo-url mongodb://localhost:27017 --records 20000
+    python scripts/load_test.py --llm-latency-ms 1500 --llm-latency-sd-ms 600 --llm-error-rate 0.1
+    python scripts/load_test.py --target http://localhost:8001   # drive an already running server
+
+The in-memory stand-in executes queries synchronously on the API's event loop, so it
+measures application overhead rather than database behaviour; use --mongo-url for
+realistic numbers. With --mongo-url the data is written to --database (never the
+live world_data database unless asked for explicitly).
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import httpx
+import numpy as np
+import uvicorn
+
+STATES = [
+    "Andhra Pradesh", "Assam", "Bihar", "Delhi", "Goa", "Gujarat", "Karnataka", "Kerala",
+    "Madhya Pradesh", "Maharashtra", "Punjab", "Rajasthan", "Tamil Nadu", "Telangana",
+    "Uttar Pradesh", "West Bengal"
+]
+YEARS = list(range(2014, 2024))
+CRIME_TYPES = ["Theft", "Burglary", "Assault", "Fraud", "Cyber Crime", "Robbery"]
+CHAT_QUERIES = [
+    "What is the crime rate in Delhi in 2020?",
+    "Show me literacy rates in Kerala",
+    "Compare AQI between Maharashtra and Karnataka for 2019",
+    "Power consumption in Gujarat",
+    "How did covid deaths change in Tamil Nadu?",
+    "Tell me something interesting about the data"
+]
+DEFAULT_MIX = "stats=2,datasets=2,filtered=3,visualize=2,chat=1"
+
+
+# Synthetic data
+
+def synthetic_documents(records: int, rng: random.Random):
+    """Documents per collection shaped like the real datasets, about `records` each"""
+    per_state_year = max(1, records // (len(STATES) * len(YEARS)))
+    docs = defaultdict(list)
+    for state in STATES:
+        base = rng.uniform(0.5, 2.0)
+        for year in YEARS:
+            growth = 1 + (year - YEARS[0]) * rng.uniform(-0.02, 0.05)
+            for _ in range(per_state_year):
+                docs["crimes"].append({
+                    "state": state, "year": year, "crime_type": rng.choice(CRIME_TYPES),
+                    "cases_reported": int(rng.gauss(800, 200) * base * growth)
+                })
+                docs["literacy"].append({
+                    "state": state, "year": year,
+                    "literacy_rate": round(min(99.0, 60 + 20 * base / 2 + (year - YEARS[0]) * 0.6 + rng.gauss(0, 1.5)), 2)
+                })
+                docs["aqi"].append({
+                    "state": state, "year": year, "avg_aqi": round(max(20.0, rng.gauss(150, 40) * base), 1)
+                })
+                docs["power_consumption"].append({
+                    "state": state, "year": year,
+                    "power_consumption_gwh": round(rng.gauss(50000, 8000) * base * growth, 1)
+                })
+    covid_days = max(1, records // len(STATES))
+    for state in STATES:
+        for day in range(covid_days):
+            date = time.strftime("%Y-%m-%d", time.gmtime(1577836800 + day * 86400))  # from 2020-01-01
+            wave = 1 + 4 * np.exp(-((day % 365) - 120) ** 2 / 800)
+            confirmed = max(0, int(rng.gauss(2000, 400) * wave))
+            docs["covid_stats"].append({
+                "state": state, "date": date, "confirmed": confirmed, "deaths": int(confirmed * rng.uniform(0.005, 0.02))
+            })
+    return docs
+
+
+async def seed_database(database, records: int, seed: int):
+    rng = random.Random(seed)
+    for collection_name, documents in synthetic_documents(records, rng).items():
+        await database[collection_name].drop()
+        for start in range(0, len(documents), 5000):
+            await database[collection_name].insert_many(documents[start:start + 5000])
+        print(f"Seeded {collection_name}: {len(documents)} documents")
+
+
+# Fake OpenAI-compatible endpoint
+
+def fake_insight(label: str):
+    return {
+        "insight": f"Synthetic analysis of {label}: values vary across states with a mild upward trend.",
+        "chart_type": "bar",
+        "key_findings": ["Regional spread is wide", "Recent years are higher", "A few states dominate"],
+        "key_metrics": ["total", "average"],
+        "anomalies": [],
+        "trend": "increasing",
+        "recommendations": ["Monitor the top states", "Investigate outliers"],
+        "comparison_insights": "Larger states report higher totals.",
+        "temporal_analysis": "Values rose steadily over the period.",
+        "visualization_notes": "Bars make the regional comparison easy to read.",
+        "summary": f"Synthetic summary of {label}.",
+        "notable": []
+    }
+
+
+def fake_completion_content(prompt: str) -> str:
+    """JSON answer in the shape the prompt asks for, including the batched keyed forms"""
+    if "keyed by dataset id" in prompt:
+        ids = re.findall(r'"id": "([0-9a-f]+)"', prompt)
+        return json.dumps({item_id: fake_insight(item_id) for item_id in ids})
+    if "keyed by collection name" in prompt:
+        match = re.search(r"Data samples keyed by collection: (\{.*\})", prompt)
+        names = list(json.loads(match.group(1))) if match else []
+        return json.dumps({name: fake_insight(name) for name in names})
+    return json.dumps(fake_insight("the dataset"))
+
+
+def create_fake_llm_app(latency_ms: float, latency_sd_ms: float, error_rate: float, malformed_rate: float,
+                        rng: random.Random):
+    """Chat-completions endpoint with normally distributed latency, HTTP errors and broken JSON"""
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse
+
+    fake_app = FastAPI()
+
+    @fake_app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        await asyncio.sleep(max(0.0, rng.gauss(latency_ms, latency_sd_ms)) / 1000)
+        if rng.random() < error_rate:
+            status = rng.choice([429, 500, 503])
+            return JSONResponse(status_code=status, content={"error": {"message": "injected failure", "type": "server_error"}})
+        prompt = " ".join(str(message.get("content", "")) for message in body.get("messages", []))
+        content = "Sorry, I cannot answer that." if rng.random() < malformed_rate else fake_completion_content(prompt)
+        prompt_tokens = len(prompt) // 4
+        completion_tokens = len(content) // 4
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        }
+
+    return fake_app
+
+
+class ServerThread(threading.Thread):
+    """Serve an ASGI app on its own event loop, optionally running a setup coroutine first"""
+
+    def __init__(self, app, port: int, setup=None):
+        super().__init__(daemon=True)
+        self.setup = setup
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        self.error = None
+
+    def run(self):
+        async def main():
+            if self.setup is not None:
+                await self.setup()
+            await self.server.serve()
+        try:
+            asyncio.run(main())
+        except BaseException as e:
+            self.error = e
+
+    def wait_started(self, timeout: float = 120):
+        deadline = time.monotonic() + timeout
+        while not self.server.started:
+            if self.error is not None or not self.is_alive():
+                raise RuntimeError(f"Server failed to start: {self.error}")
+            if time.monotonic() > deadline:
+                raise RuntimeError("Server did not start in time")
+            time.sleep(0.05)
+
+    def stop(self):
+        self.server.should_exit = True
+        self.join(timeout=10)
+
+
+def start_stack(args):
+    """Start the fake LLM and the API (seeded) and return (base_url, threads)"""
+    rng = random.Random(args.seed)
+    llm = ServerThread(
+        create_fake_llm_app(args.llm_latency_ms, args.llm_latency_sd_ms, args.llm_error_rate, args.llm_malformed_rate, rng),
+        args.llm_port
+    )
+    llm.start()
+    llm.wait_started()
+
+    # The server builds its Mongo client and reads the OpenAI settings at import time
+    os.environ["MONGO_URL"] = args.mongo_url or "mongodb://localhost:27017"
+    os.environ["OPENAI_API_KEY"] = "load-test"
+    import openai
+    from backend import server
+
+    openai.api_key = "load-test"
+    # The OpenAI client logs every request at INFO through httpx
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    openai.base_url = f"http://127.0.0.1:{args.llm_port}/v1/"
+    if args.mongo_url:
+        server.db = server.client[args.database]
+    else:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            raise SystemExit("The in-memory stand-in needs mongomock-motor (pip install mongomock-motor); "
+                             "or pass --mongo-url to use a local mongod")
+        server.db = AsyncMongoMockClient()[args.database]
+
+    api = ServerThread(server.app, args.port, setup=lambda: seed_database(server.db, args.records, args.seed))
+    api.start()
+    api.wait_started()
+    return f"http://127.0.0.1:{args.port}", [api, llm]
+
+
+# Traffic
+
+def build_request(endpoint: str, rng: random.Random):
+    """(method, path, json body, query params) for one request to a traffic-mix endpoint"""
+    collection = rng.choice(["crimes", "literacy", "aqi", "power_consumption", "covid_stats"])
+    if endpoint == "stats":
+        return "GET", "/api/stats", None, None
+    if endpoint == "datasets":
+        return "GET", "/api/datasets", None, None
+    if endpoint == "filtered":
+        body = {"collection": collection, "limit": rng.choice([50, 100, 500])}
+        if rng.random() < 0.6:
+            body["states"] = rng.sample(STATES, rng.randint(1, 4))
+        if collection != "covid_stats" and rng.random() < 0.5:
+            body["years"] = rng.sample(YEARS, rng.randint(1, 3))
+        if collection != "covid_stats" and rng.random() < 0.3:
+            body["sort_by"] = "year"
+            body["sort_order"] = rng.choice(["asc", "desc"])
+        if rng.random() < 0.2:
+            body["chart_type"] = "pie"
+        return "POST", "/api/data/filtered", body, None
+    if endpoint == "visualize":
+        params = {"limit": 50}
+        if rng.random() < 0.5:
+            params["states"] = ",".join(rng.sample(STATES, 3))
+        return "GET", f"/api/visualize/{collection}", None, params
+    if endpoint == "chat":
+        return "POST", "/api/chat", {"query": rng.choice(CHAT_QUERIES)}, None
+    raise ValueError(f"Unknown endpoint in traffic mix: {endpoint}")
+
+
+async def run_level(base_url: str, concurrency: int, duration: float, mix, rng: random.Random):
+    """Run `concurrency` closed-loop workers for `duration` seconds; returns per-endpoint samples"""
+    endpoints, weights = zip(*mix)
+    samples = defaultdict(lambda: {"latencies": [], "errors": 0})
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        async def worker():
+            while time.monotonic() < deadline:
+                endpoint = rng.choices(endpoints, weights)[0]
+                method, path, body, params = build_request(endpoint, rng)
+                started = time.perf_counter()
+                try:
+                    response = await client.request(method, path, json=body, params=params)
+                    failed = response.status_code >= 400
+                except httpx.HTTPError:
+                    failed = True
+                samples[endpoint]["latencies"].append(time.perf_counter() - started)
+                samples[endpoint]["errors"] += int(failed)
+
+        started = time.monotonic()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.monotonic() - started
+    return samples, elapsed
+
+
+def summarize_level(concurrency: int, samples, elapsed: float):
+    rows = []
+    for endpoint in sorted(samples):
+        latencies = np.array(samples[endpoint]["latencies"]) * 1000
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        rows.append({
+            "concurrency": concurrency,
+            "endpoint": endpoint,
+            "requests": len(latencies),
+            "errors": samples[endpoint]["errors"],
+            "rps": round(len(latencies) / elapsed, 2),
+            "p50_ms": round(float(p50), 1),
+            "p90_ms": round(float(p90), 1),
+            "p99_ms": round(float(p99), 1),
+            "max_ms": round(float(latencies.max()), 1)
+        })
+    return rows
+
+
+def print_rows(rows):
+    header = f"{'conc':>5} {'endpoint':<10} {'requests':>8} {'errors':>6} {'rps':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(f"{row['concurrency']:>5} {row['endpoint']:<10} {row['requests']:>8} {row['errors']:>6} {row['rps']:>8.1f} "
+              f"{row['p50_ms']:>8.1f} {row['p90_ms']:>8.1f} {row['p99_ms']:>8.1f} {row['max_ms']:>8.1f}")
+
+
+def parse_mix(text: str):
+    mix = []
+    for part in text.split(","):
+        endpoint, _, weight = part.partition("=")
+        mix.append((endpoint.strip(), float(weight or 1)))
+    for endpoint, _ in mix:
+        build_request(endpoint, random.Random(0))  # reject unknown endpoints up front
+    return mix
+
+
+async def drive(base_url: str, args):
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    if args.warmup > 0:
+        await run_level(base_url, min(args.concurrency), args.warmup, mix, rng)
+    results = []
+    for concurrency in args.concurrency:
+        samples, elapsed = await run_level(base_url, concurrency, args.duration, mix, rng)
+        rows = summarize_level(concurrency, samples, elapsed)
+        total = sum(row["requests"] for row in rows)
+        print(f"\nConcurrency {concurrency}: {total} requests in {elapsed:.1f}s ({total / elapsed:.1f} req/s)")
+        print_rows(rows)
+        results.extend(rows)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=lambda s: [int(c) for c in s.split(",")], default=[1, 8, 32],
+                        help="comma-separated concurrency levels (default 1,8,32)")
+    parser.add_argument("--duration", type=float, default=15, help="seconds per concurrency level")
+    parser.add_argument("--warmup", type=float, default=3, help="warm-up seconds before measuring")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"endpoint weights (default {DEFAULT_MIX})")
+    parser.add_argument("--target", help="base URL of a running server; skips the local stack")
+    parser.add_argument("--mongo-url", help="local mongod to seed and use instead of the in-memory stand-in")
+    parser.add_argument("--database", default="world_data_loadtest", help="database to seed (dropped per collection)")
+    parser.add_argument("--records", type=int, default=5000, help="synthetic documents per collection")
+    parser.add_argument("--port", type=int, default=8765, help="port for the API under test")
+    parser.add_argument("--llm-port", type=int, default=8766, help="port for the fake OpenAI endpoint")
+    parser.add_argument("--llm-latency-ms", type=float, default=800, help="mean fake LLM latency")
+    parser.add_argument("--llm-latency-sd-ms", type=float, default=250, help="standard deviation of fake LLM latency")
+    parser.add_argument("--llm-error-rate", type=float, default=0.02, help="share of LLM calls answered with 429/500/503")
+    parser.add_argument("--llm-malformed-rate", type=float, default=0.02, help="share of LLM answers that are not JSON")
+    parser.add_argument("--seed", type=int, default=7, help="random seed for data and traffic")
+    parser.add_argument("--json", help="also write the result rows to this file")
+    args = parser.parse_args()
+
+    threads = []
+    if args.target:
+        base_url = args.target.rstrip("/")
+    else:
+        base_url, threads = start_stack(args)
+    try:
+        results = asyncio.run(drive(base_url, args))
+    finally:
+        for thread in threads:
+            thread.stop()
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+        print(f"\nWrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
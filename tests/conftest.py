@@ -0,0 +1,4 @@
+import os
+
+# Keep imports offline: the server builds its Mongo client at import time
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
@@ -0,0 +1,48 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from backend import server
+
+
+class TestDetectedAnomalies(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        matrix = np.full((10, 6), 100.0) + np.arange(6)
+        matrix += np.arange(10).reshape(-1, 1) * 0.5
+        matrix[0, 1] = 10000.0  # the strongest anomaly
+        matrix[5, 3] = 400.0    # weaker, in another state
+        self.loaded = {
+            "matrices": [matrix],
+            "years": [2015, 2016, 2017, 2018, 2019, 2020],
+            "states": [f"state {i}" for i in range(10)],
+            "fields": {"crimes": "cases_reported"}
+        }
+        server.analytics_cache.clear()
+        patches = [
+            mock.patch.object(server, "load_metric_matrices", mock.AsyncMock(return_value=self.loaded)),
+            mock.patch.object(server, "get_data_version", mock.AsyncMock(return_value="v1")),
+            mock.patch.object(server, "ANOMALY_MAX_RESULTS", 1),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    async def test_filter_runs_before_truncation(self):
+        detected = await server.compute_collection_anomalies("crimes")
+        self.assertGreater(detected["total_detected"], 1)
+        self.assertEqual(len(detected["anomalies"]), detected["total_detected"])
+
+        anomalies = await server.get_detected_anomalies("crimes", states=["state 5"], limit=1)
+        self.assertEqual(len(anomalies), 1)
+        self.assertEqual(anomalies[0]["state"], "state 5")
+        self.assertEqual(anomalies[0]["period"], "2018")
+
+    async def test_limit_applies_after_filtering(self):
+        anomalies = await server.get_detected_anomalies("crimes", years=[2016], limit=1)
+        self.assertEqual(len(anomalies), 1)
+        self.assertEqual(anomalies[0]["state"], "state 0")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import json
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from backend import server
+from backend.server import get_batched_openai_insights, get_fallback_openai_insight
+
+SAMPLES = {
+    "crimes": [{"state": "Goa", "year": 2020, "cases_reported": 120}],
+    "literacy": [{"state": "Goa", "year": 2020, "literacy_rate": 88.7}]
+}
+
+
+def chat_response(content):
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+        usage=SimpleNamespace(prompt_tokens=100, completion_tokens=50)
+    )
+
+
+def insight(text):
+    return {"insight": text, "chart_type": "line", "key_metrics": [], "anomalies": [], "trend": "increasing"}
+
+
+class TestBatchedOpenAIInsights(unittest.IsolatedAsyncioTestCase):
+    async def run_batch(self, content):
+        completion = mock.AsyncMock(return_value=chat_response(content))
+        with mock.patch.object(server, "create_chat_completion", completion):
+            results = await get_batched_openai_insights(SAMPLES, "crime and literacy in Goa")
+        completion.assert_awaited_once()
+        return results
+
+    async def test_keyed_reply_is_split_per_collection(self):
+        results = await self.run_batch(json.dumps({"crimes": insight("crime"), "literacy": insight("literacy")}))
+        self.assertEqual(results, {"crimes": insight("crime"), "literacy": insight("literacy")})
+
+    async def test_missing_collection_gets_the_fallback(self):
+        results = await self.run_batch(json.dumps({"crimes": insight("crime")}))
+        self.assertEqual(results["crimes"], insight("crime"))
+        self.assertEqual(results["literacy"], get_fallback_openai_insight("literacy"))
+
+    async def test_non_json_reply_falls_back_for_every_collection(self):
+        results = await self.run_batch("Sorry, I can't help with that.")
+        self.assertEqual(set(results), set(SAMPLES))
+        for collection_name in SAMPLES:
+            self.assertEqual(results[collection_name], get_fallback_openai_insight(collection_name))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+
+from backend.server import build_chart_payload
+
+ROWS = [
+    {"state": "Goa", "year": 2019, "crime_type": "Theft", "cases_reported": 10},
+    {"state": "Goa", "year": 2020, "crime_type": "Theft", "cases_reported": 30},
+    {"state": "Delhi", "year": 2019, "crime_type": "Theft", "cases_reported": 50},
+    {"state": "Delhi", "year": 2020, "crime_type": "Fraud", "cases_reported": None},
+]
+
+
+class TestChartPayload(unittest.TestCase):
+    def test_rows_are_returned_unchanged(self):
+        self.assertIs(build_chart_payload(ROWS, "rows", "crimes"), ROWS)
+
+    def test_columnar_transposes_rows(self):
+        payload = build_chart_payload(ROWS, "columnar", "crimes")
+        self.assertEqual(payload["labels"], ["Goa", "Goa", "Delhi", "Delhi"])
+        self.assertEqual(payload["series"], {"cases_reported": [10, 30, 50, None]})
+        self.assertEqual(payload["columns"]["year"], [2019, 2020, 2019, 2020])
+
+    def test_series_averages_and_ranks_labels(self):
+        payload = build_chart_payload(ROWS, "series", "crimes")
+        self.assertEqual(payload["metric"], "cases_reported")
+        self.assertEqual(payload["labels"], ["Delhi", "Goa"])
+        self.assertEqual(payload["series"], {"cases_reported": [50.0, 20.0]})
+
+    def test_line_series_keep_label_order(self):
+        payload = build_chart_payload(ROWS, "series", "crimes", chart_type="line")
+        self.assertEqual(payload["labels"], ["Delhi", "Goa"])
+
+    def test_grouped_series(self):
+        payload = build_chart_payload(ROWS, "series", "crimes", group_by="year")
+        self.assertEqual(payload["labels"], ["Delhi", "Goa"])
+        self.assertEqual(payload["series"], {"2019": [50.0, 10.0], "2020": [None, 30.0]})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from fastapi import HTTPException
+
+from backend import server
+from backend.server import (
+    BatchInsightRequest, FilterRequest, get_batch_insights, get_fallback_enhanced_insights, make_insight_job_id,
+    record_insight_job_result, submit_insight_job, wait_for_insight_job
+)
+
+
+async def passthrough_enrichment(result, collection_name, query):
+    return result
+
+
+class TestInsightJobId(unittest.TestCase):
+    def test_prompt_and_sample_size_are_part_of_the_key(self):
+        base = make_insight_job_id("crimes", {}, "bar", query_text="Analyze", sample_limit=50)
+        self.assertEqual(base, make_insight_job_id("crimes", {}, "bar", query_text="Analyze", sample_limit=50))
+        self.assertNotEqual(base, make_insight_job_id("crimes", {}, "bar", query_text="Analyze", sample_limit=200))
+        self.assertNotEqual(base, make_insight_job_id("crimes", {}, "bar", query_text="Summarize", sample_limit=50))
+
+
+class TestInsightJobWorker(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        server.insight_jobs.clear()
+        server.insight_job_workers.clear()
+        server.insight_job_queue = asyncio.Queue()
+
+    async def asyncTearDown(self):
+        for task in server.insight_job_workers:
+            task.cancel()
+        server.insight_job_workers.clear()
+
+    async def run_job(self, result):
+        insights = mock.AsyncMock(return_value=result)
+        with mock.patch.object(server, "get_enhanced_web_insights", insights), \
+                mock.patch.object(server, "enrich_insights", passthrough_enrichment):
+            job_id = await submit_insight_job([{"state": "Goa"}], "crimes", "Analyze", "bar", {}, sample_limit=50)
+            job = await wait_for_insight_job(job_id, 5)
+        return job_id, job, insights
+
+    async def test_fallback_results_are_not_cached_as_completed(self):
+        job_id, job, _ = await self.run_job(get_fallback_enhanced_insights("crimes", "bar"))
+        self.assertEqual(job["status"], "failed")
+        self.assertTrue(job["result"]["fallback"])
+
+        # The next identical request queues a fresh attempt
+        _, retried, insights = await self.run_job({"insight": "fresh"})
+        self.assertEqual(retried["status"], "completed")
+        self.assertEqual(retried["result"], {"insight": "fresh"})
+        insights.assert_awaited_once()
+
+    async def test_completed_jobs_are_reused(self):
+        await self.run_job({"insight": "first"})
+        _, job, insights = await self.run_job({"insight": "second"})
+        self.assertEqual(job["result"], {"insight": "first"})
+        insights.assert_not_awaited()
+
+    async def test_recorded_results_do_not_replace_queued_jobs(self):
+        insights = mock.AsyncMock(return_value={"insight": "from worker"})
+        with mock.patch.object(server, "get_enhanced_web_insights", insights), \
+                mock.patch.object(server, "enrich_insights", passthrough_enrichment):
+            job_id = await submit_insight_job([{"state": "Goa"}], "crimes", "Analyze", "bar", {}, sample_limit=50)
+            record_insight_job_result(job_id, "crimes", "bar", {"insight": "from batch"})
+            job = await wait_for_insight_job(job_id, 5)
+        self.assertEqual(job["status"], "completed")
+        self.assertEqual(job["result"], {"insight": "from worker"})
+
+    def test_recorded_results_keep_their_endpoint(self):
+        token = server.llm_endpoint.set("/api/insights/batch")
+        try:
+            record_insight_job_result("job", "crimes", "bar", {"insight": "real"})
+        finally:
+            server.llm_endpoint.reset(token)
+        self.assertEqual(server.insight_jobs["job"]["endpoint"], "/api/insights/batch")
+
+    async def test_empty_map_reduce_is_not_an_llm_fallback(self):
+        server.llm_usage_stats.clear()
+        with mock.patch.object(server, "profile_insight_chunks", mock.AsyncMock(return_value={"profiles": []})):
+            result = await server.get_map_reduce_insights("crimes", {"state": "Nowhere"}, "Analyze", "bar")
+        self.assertFalse(result["fallback"])
+        self.assertEqual(sum(stats.fallbacks for stats in server.llm_usage_stats.values()), 0)
+
+    async def run_full_job(self, wait):
+        priorities = []
+
+        async def map_reduce(*args):
+            priorities.append(server.llm_priority.get())
+            return {"insight": "full"}
+
+        with mock.patch.object(server, "get_map_reduce_insights", map_reduce), \
+                mock.patch.object(server, "enrich_insights", passthrough_enrichment):
+            job_id = await submit_insight_job(None, "crimes", "Analyze", "bar", {}, mode="full")
+            if wait:
+                await wait_for_insight_job(job_id, 5)
+            else:
+                await server.insight_jobs[job_id]["done"].wait()
+        return priorities
+
+    async def test_full_jobs_run_at_standard_priority_when_a_request_waits(self):
+        self.assertEqual(await self.run_full_job(wait=True), ["standard"])
+        server.insight_jobs.clear()
+        self.assertEqual(await self.run_full_job(wait=False), ["background"])
+
+    def test_fallback_results_are_not_recorded(self):
+        record_insight_job_result("job", "crimes", "bar", get_fallback_enhanced_insights("crimes", "bar"))
+        self.assertNotIn("job", server.insight_jobs)
+        record_insight_job_result("job", "crimes", "bar", {"insight": "real"})
+        self.assertEqual(server.insight_jobs["job"]["status"], "completed")
+
+
+class TestBatchInsightModes(unittest.IsolatedAsyncioTestCase):
+    async def test_full_mode_is_rejected(self):
+        batch = BatchInsightRequest(requests=[
+            FilterRequest(collection="crimes"),
+            FilterRequest(collection="aqi", insight_mode="full")
+        ])
+        with self.assertRaises(HTTPException) as caught:
+            await get_batch_insights(batch)
+        self.assertEqual(caught.exception.status_code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
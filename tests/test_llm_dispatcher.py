@@ -0,0 +1,47 @@
+import asyncio
+import unittest
+
+from backend.server import LLMDispatcher
+
+
+class TestLLMDispatcher(unittest.IsolatedAsyncioTestCase):
+    async def run_jobs(self, dispatcher, jobs, order, peak):
+        async def job(cls, name):
+            async with dispatcher.slot(cls):
+                order.append(name)
+                peak[cls] = max(peak.get(cls, 0), dispatcher.active[cls])
+                await asyncio.sleep(0.01)
+        return [asyncio.create_task(job(cls, name)) for cls, name in jobs]
+
+    async def test_interactive_calls_jump_the_queue(self):
+        dispatcher = LLMDispatcher(2, {"interactive": 2, "standard": 2, "background": 2})
+        order, peak = [], {}
+        tasks = await self.run_jobs(dispatcher, [("background", f"b{i}") for i in range(4)], order, peak)
+        await asyncio.sleep(0)
+        tasks += await self.run_jobs(dispatcher, [("interactive", "i0")], order, peak)
+        await asyncio.gather(*tasks)
+        self.assertEqual(order[:3], ["b0", "b1", "i0"])
+
+    async def test_class_limits_are_enforced(self):
+        dispatcher = LLMDispatcher(4, {"interactive": 4, "standard": 2, "background": 1})
+        order, peak = [], {}
+        jobs = [("background", f"b{i}") for i in range(3)] + [("standard", f"s{i}") for i in range(4)]
+        await asyncio.gather(*await self.run_jobs(dispatcher, jobs, order, peak))
+        self.assertEqual(peak, {"background": 1, "standard": 2})
+        snapshot = dispatcher.snapshot()["classes"]
+        self.assertEqual(snapshot["standard"]["granted"], 4)
+        self.assertEqual(snapshot["background"]["queued"], 0)
+
+    async def test_cancelled_waiter_frees_nothing_it_did_not_hold(self):
+        dispatcher = LLMDispatcher(1, {"interactive": 1, "standard": 1, "background": 1})
+        order, peak = [], {}
+        tasks = await self.run_jobs(dispatcher, [("standard", f"s{i}") for i in range(3)], order, peak)
+        await asyncio.sleep(0)
+        tasks[2].cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.assertEqual(order, ["s0", "s1"])
+        self.assertEqual(sum(dispatcher.active.values()), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
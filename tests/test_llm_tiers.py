@@ -0,0 +1,61 @@
+import json
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from backend import server
+from backend.server import CHART_ANALYSIS_GUIDE, LLM_TIERS, match_query_entities, route_llm_tier
+
+# Conservative for English prose in JSON (OpenAI's rule of thumb is about 4)
+CHARS_PER_TOKEN = 3
+
+
+def chat_response(content):
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+        usage=SimpleNamespace(prompt_tokens=10, completion_tokens=5)
+    )
+
+
+class TestLLMTierRouting(unittest.IsolatedAsyncioTestCase):
+    async def test_server_insight_prompts_stay_on_chart_insight(self):
+        completion = mock.AsyncMock(return_value=chat_response(json.dumps({"insight": "ok"})))
+        prompts = [
+            "Analyze the crimes dataset patterns and trends",
+            "Provide comprehensive analysis of the crimes dataset including trends, patterns, and key findings",
+            server.ENHANCED_INSIGHT_QUERY.format(collection="crimes")
+        ]
+        with mock.patch.object(server, "create_chat_completion", completion):
+            for prompt in prompts:
+                for chart_type in CHART_ANALYSIS_GUIDE:
+                    await server.get_enhanced_web_insights([{"state": "Goa"}], "crimes", prompt, chart_type)
+        tiers = {call.kwargs["tier"] for call in completion.await_args_list}
+        self.assertEqual(tiers, {"chart_insight"})
+
+    def test_only_explicit_comparisons_get_a_deep_dive(self):
+        for query in ["crime rate in Delhi and Mumbai", "literacy between 2015 and 2020", "impact of covid in Kerala"]:
+            with self.subTest(query=query):
+                comparative = match_query_entities(query)["comparative"]
+                self.assertEqual(route_llm_tier("chat_answer", comparative), "chat_answer")
+        for query in ["compare crime in Delhi and Mumbai", "Delhi vs Mumbai air quality", "does literacy correlate with crime?"]:
+            with self.subTest(query=query):
+                comparative = match_query_entities(query)["comparative"]
+                self.assertEqual(route_llm_tier("chat_answer", comparative), "deep_dive")
+
+    def test_typical_chat_answer_fits_the_budget(self):
+        insight = " ".join(["Kerala reported 1,234 cases in 2021, up 12.5% on the previous year."] * 8)
+        self.assertLessEqual(len(insight.split()), 100)
+        answer = json.dumps({
+            "insight": insight,
+            "chart_type": "line",
+            "key_metrics": ["Total cases: 45,678", "Average per state: 1,523.4", "Year-on-year change: +8.2%",
+                            "Highest state: Uttar Pradesh (6,789)", "Lowest state: Goa (123)"],
+            "anomalies": ["Delhi spiked 45% in 2020 against a flat national trend",
+                          "Bihar reported no data for 2018"],
+            "trend": "increasing"
+        }, indent=2)
+        self.assertLessEqual(len(answer) / CHARS_PER_TOKEN, LLM_TIERS["chat_answer"]["max_tokens"])
+
+
+if __name__ == "__main__":
+    unittest.main()
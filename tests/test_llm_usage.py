@@ -0,0 +1,34 @@
+import unittest
+
+from backend.server import LLMUsageStats, llm_usage_key
+
+
+class TestLLMUsageStats(unittest.TestCase):
+    def test_latency_histogram_is_cumulative(self):
+        stats = LLMUsageStats()
+        for latency in (0.2, 0.7, 3.0, 60.0):
+            stats.record_call(latency, prompt_tokens=100, completion_tokens=40, error=False)
+        snapshot = stats.snapshot()
+        histogram = snapshot["latency_histogram"]
+        self.assertEqual(histogram["le_0.5"], 1)
+        self.assertEqual(histogram["le_1"], 2)
+        self.assertEqual(histogram["le_5"], 3)
+        self.assertEqual(histogram["le_45"], 3)
+        self.assertEqual(histogram["le_inf"], 4)
+        self.assertEqual(snapshot["prompt_tokens"], 400)
+        self.assertEqual(snapshot["completion_tokens"], 160)
+
+    def test_errors_are_counted(self):
+        stats = LLMUsageStats()
+        stats.record_call(1.5, prompt_tokens=0, completion_tokens=0, error=True)
+        self.assertEqual(stats.snapshot()["errors"], 1)
+        self.assertEqual(stats.snapshot()["calls"], 1)
+
+    def test_unknown_chart_types_share_a_label(self):
+        self.assertEqual(llm_usage_key("crimes", "pie")[1:], ("crimes", "pie"))
+        self.assertEqual(llm_usage_key("crimes", "radar<script>")[1:], ("crimes", "other"))
+        self.assertEqual(llm_usage_key(None, None)[1:], ("none", "none"))
+
+
+if __name__ == "__main__":
+    unittest.main()
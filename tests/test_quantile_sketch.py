@@ -0,0 +1,86 @@
+import asyncio
+import random
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from backend import server
+from backend.server import KLLSketch, get_quantile_sketches, merge_sketches
+
+
+class TestKLLSketch(unittest.TestCase):
+    def setUp(self):
+        random.seed(0)
+        self.data = np.random.RandomState(0).lognormal(size=50000)
+
+    def assertRankErrorBelow(self, sketch, tolerance):
+        fractions = [0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99]
+        for fraction, estimate in zip(fractions, sketch.quantiles(fractions)):
+            self.assertLess(abs((self.data <= estimate).mean() - fraction), tolerance)
+
+    def test_small_inputs_are_exact(self):
+        sketch = KLLSketch()
+        for value in [5, 1, 3, 2, 4]:
+            sketch.update(value)
+        self.assertEqual(sketch.quantiles([0, 0.5, 1]), [1, 3, 5])
+        self.assertEqual(sketch.rank(3), 0.6)
+
+    def test_quantiles_stay_within_rank_error(self):
+        sketch = KLLSketch()
+        for value in self.data:
+            sketch.update(float(value))
+        self.assertEqual(sketch.count, len(self.data))
+        self.assertLess(sketch.size, 1000)
+        self.assertRankErrorBelow(sketch, 0.02)
+
+    def test_merged_sketches_match_a_single_sketch(self):
+        parts = [KLLSketch() for _ in range(4)]
+        for i, value in enumerate(self.data):
+            parts[i % 4].update(float(value))
+        merged = merge_sketches(parts)
+        self.assertEqual(merged.count, len(self.data))
+        self.assertEqual(merged.min, float(self.data.min()))
+        self.assertEqual(merged.max, float(self.data.max()))
+        self.assertRankErrorBelow(merged, 0.02)
+
+    def test_empty_sketch(self):
+        sketch = KLLSketch()
+        self.assertEqual(sketch.quantiles([0.5]), [None])
+        self.assertIsNone(sketch.rank(1.0))
+
+
+class TestQuantileSketchRefresh(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        server.quantile_sketches.clear()
+        server.quantile_sketch_tasks.clear()
+
+    async def test_stale_sketches_are_served_while_refreshing(self):
+        started, release = asyncio.Event(), asyncio.Event()
+
+        async def slow_refresh(collection_name):
+            started.set()
+            await release.wait()
+            server.quantile_sketches[collection_name] = {"version": "v2"}
+            return server.quantile_sketches[collection_name]
+
+        server.quantile_sketches["crimes"] = {"version": "v1"}
+        with mock.patch.object(server, "get_data_version", mock.AsyncMock(return_value="v2")), \
+                mock.patch.object(server, "refresh_quantile_sketches", slow_refresh):
+            self.assertEqual((await get_quantile_sketches("crimes"))["version"], "v1")
+            self.assertEqual((await get_quantile_sketches("crimes"))["version"], "v1")
+            await started.wait()
+            self.assertEqual(len(server.quantile_sketch_tasks), 1)
+            release.set()
+            await server.quantile_sketch_tasks["crimes"]
+            self.assertEqual((await get_quantile_sketches("crimes"))["version"], "v2")
+
+    async def test_first_request_waits_for_the_initial_build(self):
+        refresh = mock.AsyncMock(return_value={"version": "v1"})
+        with mock.patch.object(server, "refresh_quantile_sketches", refresh):
+            self.assertEqual(await get_quantile_sketches("crimes"), {"version": "v1"})
+        refresh.assert_awaited_once_with("crimes")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import unittest
+
+from backend.server import match_query_entities
+
+
+class TestQueryMatcher(unittest.TestCase):
+    def test_detects_states_years_and_collection(self):
+        result = match_query_entities("What is the crime rate in Delhi in 2020?")
+        self.assertEqual(result["states"], ["delhi"])
+        self.assertEqual(result["years"], [2020])
+        self.assertEqual(result["collection"], "crimes")
+        self.assertEqual(result["data_type"], "crime")
+
+    def test_multi_word_and_plural_aliases(self):
+        result = match_query_entities("Crimes in Tamil  Nadu and West Bengal during 2019 and 2021")
+        self.assertEqual(result["states"], ["chennai", "kolkata"])
+        self.assertEqual(result["years"], [2019, 2021])
+        self.assertEqual(result["collection"], "crimes")
+
+    def test_longest_alias_wins(self):
+        result = match_query_entities("air quality in new delhi")
+        self.assertEqual(result["states"], ["delhi"])
+        self.assertEqual(result["collection"], "aqi")
+
+    def test_collection_priority_is_preserved(self):
+        # Crime outranks energy when both appear, as before
+        result = match_query_entities("energy theft in Gujarat")
+        self.assertEqual(result["collection"], "crimes")
+        self.assertEqual(result["states"], ["gujarat"])
+
+    def test_comparative_questions_list_every_collection(self):
+        result = match_query_entities("does literacy correlate with crime in Kerala?")
+        self.assertEqual(result["collections"], ["crimes", "literacy"])
+        self.assertTrue(result["comparative"])
+        self.assertFalse(match_query_entities("crime in Kerala")["comparative"])
+        self.assertTrue(match_query_entities("impact of literacy on crime in Kerala")["comparative"])
+        self.assertTrue(match_query_entities("aqi vs power consumption")["comparative"])
+
+    def test_conjunctions_are_not_comparisons(self):
+        for query in ["energy theft in Bihar and UP", "power cuts with rising crime in Delhi",
+                      "crime between 2015 and 2020", "literacy in Kerala between 2011 and 2021",
+                      "crimes related to power theft", "how pollution affects Delhi"]:
+            with self.subTest(query=query):
+                self.assertFalse(match_query_entities(query)["comparative"])
+
+    def test_uppercase_abbreviations_match(self):
+        result = match_query_entities("Literacy in UP, AP and MP")
+        self.assertEqual(result["states"], ["uttar pradesh", "andhra pradesh", "madhya pradesh"])
+
+    def test_false_positive_corpus(self):
+        corpus = [
+            "sales went up last quarter",
+            "show me the map of happy places",
+            "can you wrap up the summary",
+            "I need help with my chair repair",
+            "what an affair",
+            "a superpowered laptop",
+            "the apple is on the mat",
+            "ramp up the compute",
+            "gross upgrades to the airport lounge",
+            "population in 1999 and 2035",
+            "prefix2020suffix",
+        ]
+        for query in corpus:
+            with self.subTest(query=query):
+                result = match_query_entities(query)
+                self.assertEqual(result["states"], [])
+                self.assertEqual(result["years"], [])
+                self.assertIsNone(result["collection"])
+
+
+class TestFuzzyQueryMatcher(unittest.TestCase):
+    def test_misspelled_states_resolve(self):
+        cases = {
+            "crime in Karnatka in 2020": ["bangalore"],
+            "literacy in Tamilnadu": ["chennai"],
+            "Chattisgarh pollution": ["chhattisgarh"],
+            "aqi in Utar Pradesh": ["uttar pradesh"],
+            "power use in Gujrat": ["gujarat"],
+            "murders in Keral": ["kerala"],
+        }
+        for query, states in cases.items():
+            with self.subTest(query=query):
+                self.assertEqual(match_query_entities(query)["states"], states)
+
+    def test_misspelled_keywords_resolve(self):
+        result = match_query_entities("polution levels in Delhi")
+        self.assertEqual(result["collection"], "aqi")
+        self.assertEqual(result["corrections"], {"polution": "pollution"})
+
+    def test_exact_matches_report_no_corrections(self):
+        self.assertEqual(match_query_entities("crime in Kerala")["corrections"], {})
+
+    def test_ordinary_words_stay_unmatched(self):
+        for query in ["show me the tower data", "what is happening there", "lower the volume", "a goal was scored"]:
+            with self.subTest(query=query):
+                result = match_query_entities(query)
+                self.assertEqual(result["states"], [])
+                self.assertIsNone(result["collection"])
+
+    def test_dictionary_words_near_aliases_stay_unmatched(self):
+        for word in ["crises", "primes", "grimes", "solution", "ranch", "assay", "literary", "towers", "delphi"]:
+            with self.subTest(word=word):
+                result = match_query_entities(f"tell me about the {word} in the report")
+                self.assertEqual(result["states"], [])
+                self.assertIsNone(result["collection"])
+                self.assertEqual(result["corrections"], {})
+
+    def test_keywords_tolerate_a_single_edit(self):
+        self.assertEqual(match_query_entities("electrcity use")["collection"], "power_consumption")
+        self.assertIsNone(match_query_entities("eletrcity use")["collection"])
+
+    def test_transposed_delhi_resolves(self):
+        result = match_query_entities("crime in Dehli")
+        self.assertEqual(result["states"], ["delhi"])
+        self.assertEqual(result["corrections"], {"dehli": "delhi"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import asyncio
+import unittest
+
+from fastapi.testclient import TestClient
+
+from backend.server import (
+    app, LatencyHistogram, format_server_timing, render_stage_metrics, request_timings, stage_histograms, timed_stage
+)
+
+
+class TestTimedStage(unittest.IsolatedAsyncioTestCase):
+    async def test_stages_accumulate_per_request(self):
+        timings = {}
+        request_timings.set(timings)
+        for _ in range(2):
+            async with timed_stage("db"):
+                await asyncio.sleep(0.01)
+        self.assertEqual(set(timings), {"db"})
+        self.assertGreaterEqual(timings["db"], 0.02)
+
+    async def test_disabled_timing_records_nothing(self):
+        request_timings.set(None)
+        async with timed_stage("db"):
+            pass
+        self.assertIsNone(request_timings.get())
+
+    async def test_time_is_recorded_when_the_block_raises(self):
+        timings = {}
+        request_timings.set(timings)
+        with self.assertRaises(ValueError):
+            async with timed_stage("llm"):
+                raise ValueError("boom")
+        self.assertIn("llm", timings)
+
+
+class TestStageMetrics(unittest.TestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = LatencyHistogram((0.1, 1))
+        for seconds in (0.05, 0.5, 5):
+            histogram.observe(seconds)
+        self.assertEqual(histogram.cumulative(), [("0.1", 1), ("1", 2), ("+Inf", 3)])
+        self.assertEqual(histogram.count, 3)
+
+    def test_server_timing_header_uses_milliseconds(self):
+        self.assertEqual(format_server_timing({"db": 0.0123, "total": 0.05}), "db;dur=12.3, total;dur=50.0")
+
+    def test_prometheus_exposition(self):
+        stage_histograms[("/api/test/{name}", "db")].observe(0.2)
+        text = render_stage_metrics()
+        self.assertIn("# TYPE api_request_stage_seconds histogram", text)
+        self.assertIn('api_request_stage_seconds_bucket{route="/api/test/{name}",stage="db",le="+Inf"} 1', text)
+        self.assertIn('api_request_stage_seconds_count{route="/api/test/{name}",stage="db"} 1', text)
+
+    def test_scrapers_find_metrics_at_the_root_path(self):
+        stage_histograms[("/api/test/{name}", "total")].observe(0.1)
+        response = TestClient(app).get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/plain"))
+        self.assertIn('route="/api/test/{name}",stage="total"', response.text)
+
+
+if __name__ == "__main__":
+    unittest.main()
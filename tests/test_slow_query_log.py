@@ -0,0 +1,67 @@
+import unittest
+from types import SimpleNamespace
+
+from backend.server import SlowQueryLog, query_shape, summarize_explain
+
+
+def command_event(request_id, command_name, command=None, duration_ms=0):
+    return SimpleNamespace(
+        request_id=request_id, command_name=command_name, command=command,
+        database_name="world_data", duration_micros=int(duration_ms * 1000)
+    )
+
+
+class TestQueryShape(unittest.TestCase):
+    def test_values_are_replaced_by_types(self):
+        shape = query_shape({"state": {"$in": ["Kerala"]}, "year": 2020, "$or": [{"date": {"$regex": "^2020-"}}]})
+        self.assertEqual(shape, {"state": {"$in": "array"}, "year": "number", "$or": [{"date": {"$regex": "str"}}]})
+
+
+class TestSlowQueryLog(unittest.TestCase):
+    def run_command(self, log, request_id, command, duration_ms):
+        log.started(command_event(request_id, "find", command))
+        log.succeeded(command_event(request_id, "find", duration_ms=duration_ms))
+
+    def test_slow_commands_are_grouped_by_shape(self):
+        log = SlowQueryLog(threshold_ms=50)
+        self.run_command(log, 1, {"find": "crimes", "filter": {"year": 2019}, "sort": {"cases": -1}}, 80)
+        self.run_command(log, 2, {"find": "crimes", "filter": {"year": 2021}, "sort": {"cases": -1}}, 120)
+        self.run_command(log, 3, {"find": "crimes", "filter": {"year": 2021}}, 10)
+        worst = log.worst(10)
+        self.assertEqual(len(worst), 1)
+        self.assertEqual(worst[0]["count"], 2)
+        self.assertEqual(worst[0]["max_ms"], 120)
+        self.assertEqual(worst[0]["shape"]["sort"], {"cases": -1})
+        self.assertEqual(log.pending, {})
+
+    def test_other_commands_are_ignored(self):
+        log = SlowQueryLog(threshold_ms=1)
+        log.started(command_event(1, "insert", {"insert": "crimes"}))
+        log.succeeded(command_event(1, "insert", duration_ms=500))
+        self.assertEqual(log.worst(10), [])
+
+
+class TestSummarizeExplain(unittest.TestCase):
+    def test_collection_scan_ratios(self):
+        summary = summarize_explain({
+            "queryPlanner": {
+                "winningPlan": {"stage": "SORT", "inputStage": {"stage": "COLLSCAN"}},
+                "rejectedPlans": [{"stage": "IXSCAN"}]
+            },
+            "executionStats": {"nReturned": 10, "totalKeysExamined": 0, "totalDocsExamined": 5000}
+        })
+        self.assertEqual(summary["plan_stages"], ["SORT", "COLLSCAN"])
+        self.assertTrue(summary["collection_scan"])
+        self.assertEqual(summary["docs_examined_per_returned"], 500)
+
+    def test_aggregate_explain_nests_stats_under_cursor(self):
+        summary = summarize_explain({"stages": [{"$cursor": {
+            "queryPlanner": {"winningPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}},
+            "executionStats": {"nReturned": 4, "totalKeysExamined": 8, "totalDocsExamined": 4}
+        }}]})
+        self.assertFalse(summary["collection_scan"])
+        self.assertEqual(summary["keys_examined_per_returned"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
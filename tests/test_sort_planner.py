@@ -0,0 +1,48 @@
+import unittest
+
+from fastapi import HTTPException
+
+from backend.server import plan_sort
+
+SCHEMA = {
+    "fields": {"_id", "state", "year", "cases_reported"},
+    "indexes": {"_id_": ["_id"], "state_1_year_-1": ["state", "year"]}
+}
+
+
+class TestPlanSort(unittest.TestCase):
+    def test_leading_index_field_uses_the_index(self):
+        plan = plan_sort(SCHEMA, {}, "state", "desc")
+        self.assertEqual(plan["strategy"], "index")
+        self.assertEqual(plan["index"], "state_1_year_-1")
+        self.assertEqual(plan["direction"], -1)
+
+    def test_second_index_field_needs_an_equality_prefix(self):
+        self.assertEqual(plan_sort(SCHEMA, {"state": "Kerala"}, "year", "asc")["strategy"], "index")
+        self.assertEqual(plan_sort(SCHEMA, {"state": {"$in": ["Kerala"]}}, "year", "asc")["strategy"], "index")
+        plan = plan_sort(SCHEMA, {"state": {"$in": ["Kerala", "Goa"]}}, "year", "asc")
+        self.assertEqual(plan["strategy"], "top_k")
+
+    def test_unindexed_sort_uses_top_k(self):
+        plan = plan_sort(SCHEMA, {}, "cases_reported", "asc")
+        self.assertEqual(plan["strategy"], "top_k")
+        self.assertTrue(plan["field_seen"])
+
+    def test_fields_missing_from_the_sample_still_sort(self):
+        plan = plan_sort(SCHEMA, {}, "crime_type", "asc")
+        self.assertEqual(plan["strategy"], "top_k")
+        self.assertFalse(plan["field_seen"])
+        self.assertEqual(plan_sort(SCHEMA, {}, "details.region", "desc")["field"], "details.region")
+
+    def test_invalid_requests_are_rejected(self):
+        for field in ["$where", "details.$ne", "", "a..b"]:
+            with self.subTest(field=field):
+                with self.assertRaises(HTTPException) as ctx:
+                    plan_sort(SCHEMA, {}, field, "asc")
+                self.assertEqual(ctx.exception.status_code, 400)
+        with self.assertRaises(HTTPException):
+            plan_sort(SCHEMA, {}, "year", "sideways")
+
+
+if __name__ == "__main__":
+    unittest.main()
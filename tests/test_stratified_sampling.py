@@ -0,0 +1,81 @@
+import unittest
+from unittest import mock
+
+from backend import server
+from backend.server import allocate_sample, fetch_stratified_sample
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def to_list(self, length):
+        return self.rows if length is None else self.rows[:length]
+
+
+class FakeCollection:
+    """Answers the strata $group and per-stratum $sample pipelines, recording each one"""
+
+    def __init__(self, strata):
+        self.strata = strata
+        self.pipelines = []
+
+    def aggregate(self, pipeline):
+        self.pipelines.append(pipeline)
+        if "$group" in pipeline[-1]:
+            return FakeCursor([{"_id": {"state": s, "year": y}, "count": c} for s, y, c in self.strata])
+        condition = pipeline[0]["$match"]["$and"][0]
+        size = pipeline[1]["$sample"]["size"]
+        return FakeCursor([{"state": condition["state"], "year": condition["year"]}] * size)
+
+
+class TestAllocateSample(unittest.TestCase):
+    def test_every_state_before_any_second_row(self):
+        strata = [("Delhi", 2020, 100), ("Delhi", 2021, 100), ("Goa", 2020, 1), ("Kerala", 2019, 50)]
+        allocation = allocate_sample(strata, 3)
+        self.assertEqual(sorted(state for state, _, _ in allocation), ["Delhi", "Goa", "Kerala"])
+        self.assertEqual(sum(size for _, _, size in allocation), 3)
+
+    def test_respects_stratum_sizes_and_budget(self):
+        strata = [("A", 2019, 1), ("A", 2020, 5), ("B", 2020, 2), ("C", 2018, 3)]
+        allocation = {(state, year): size for state, year, size in allocate_sample(strata, 7)}
+        self.assertEqual(sum(allocation.values()), 7)
+        self.assertLessEqual(allocation[("A", 2019)], 1)
+        self.assertLessEqual(allocation[("B", 2020)], 2)
+
+    def test_years_rotate_within_a_state(self):
+        strata = [("A", year, 10) for year in range(2015, 2020)]
+        allocation = allocate_sample(strata, 5)
+        self.assertEqual(sorted(year for _, year, _ in allocation), list(range(2015, 2020)))
+
+    def test_budget_larger_than_data(self):
+        allocation = allocate_sample([("A", 2020, 2), ("B", 2020, 1)], 10)
+        self.assertEqual(sum(size for _, _, size in allocation), 3)
+
+    def test_more_states_than_rows(self):
+        strata = [(f"S{i}", 2020, 5) for i in range(10)]
+        allocation = allocate_sample(strata, 4)
+        self.assertEqual(len({state for state, _, _ in allocation}), 4)
+
+
+class TestFetchStratifiedSample(unittest.IsolatedAsyncioTestCase):
+    async def test_each_stratum_is_its_own_query(self):
+        collection = FakeCollection([("Delhi", 2020, 100), ("Goa", 2020, 100), ("Kerala", 2021, 100)])
+        query = {"year": {"$gte": 2020}}
+        server.rollup_cache.clear()
+        with mock.patch.object(server, "db", {"crimes": collection}), \
+                mock.patch.object(server, "get_data_version", mock.AsyncMock(return_value="v1")):
+            sample = await fetch_stratified_sample("crimes", query, 6)
+            await fetch_stratified_sample("crimes", query, 6)
+        self.assertEqual([row["state"] for row in sample[:3]], ["Delhi", "Goa", "Kerala"])
+        self.assertEqual(len(sample), 6)
+        # One cached strata count, then one small query per stratum on each call; no $facet rescans
+        self.assertEqual(sum(1 for p in collection.pipelines if "$group" in p[-1]), 1)
+        sampled = [p for p in collection.pipelines if "$sample" in p[-1]]
+        self.assertEqual(len(sampled), 6)
+        self.assertTrue(all(p[0]["$match"]["$and"][1] == query for p in sampled))
+        self.assertFalse(any("$facet" in stage for p in collection.pipelines for stage in p))
+
+
+if __name__ == "__main__":
+    unittest.main()
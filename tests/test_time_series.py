@@ -0,0 +1,42 @@
+import unittest
+
+import numpy as np
+
+from backend.server import fold_daily_to_weeks, lttb_indices
+
+
+class TestLTTB(unittest.TestCase):
+    def test_keeps_endpoints_and_peaks(self):
+        x = np.arange(1000, dtype=float)
+        y = np.sin(x / 50)
+        y[500] = 10
+        indices = lttb_indices(x, y, 50)
+        self.assertEqual(len(indices), 50)
+        self.assertEqual(indices[0], 0)
+        self.assertEqual(indices[-1], 999)
+        self.assertIn(500, indices)
+        self.assertTrue(np.all(np.diff(indices) > 0))
+
+    def test_short_series_are_untouched(self):
+        x = np.arange(10, dtype=float)
+        np.testing.assert_array_equal(lttb_indices(x, x, 20), np.arange(10))
+
+
+class TestWeeklyFold(unittest.TestCase):
+    def test_groups_days_into_iso_weeks(self):
+        # 2021-01-03 is a Sunday, 2021-01-04 a Monday
+        dates = ["2021-01-01", "2021-01-03", "2021-01-04", "2021-01-10"]
+        matrix = np.array([[1.0, 2.0, 3.0, np.nan]])
+        weeks, folded = fold_daily_to_weeks(dates, matrix, "sum")
+        self.assertEqual(weeks, ["2020-12-28", "2021-01-04"])
+        np.testing.assert_array_equal(folded, [[3.0, 3.0]])
+
+    def test_average_rollup_ignores_missing_days(self):
+        dates = ["2021-01-04", "2021-01-05"]
+        weeks, folded = fold_daily_to_weeks(dates, np.array([[2.0, np.nan], [np.nan, np.nan]]), "avg")
+        self.assertEqual(folded[0, 0], 2.0)
+        self.assertTrue(np.isnan(folded[1, 0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from backend import server
+
+NAN = np.nan
+
+
+class TestNationalTrend(unittest.IsolatedAsyncioTestCase):
+    async def forecast(self, matrix, collection_name="crimes"):
+        loaded = {
+            "matrices": [np.array(matrix, dtype=float)],
+            "years": [2015, 2016, 2017, 2018, 2019, 2020],
+            "states": [f"state {i}" for i in range(len(matrix))],
+            "fields": {collection_name: "cases_reported"}
+        }
+        server.analytics_cache.clear()
+        with mock.patch.object(server, "load_metric_matrices", mock.AsyncMock(return_value=loaded)), \
+                mock.patch.object(server, "get_data_version", mock.AsyncMock(return_value="v1")):
+            return await server.compute_trend_forecast(collection_name, horizon=1)
+
+    async def test_late_reporting_state_does_not_create_a_trend(self):
+        result = await self.forecast([
+            [100, 101, 99, 100, 101, 99],
+            [NAN, NAN, NAN, 100, 100, 100],
+        ])
+        overall = result["overall"]
+        self.assertEqual(overall["basis"], "complete_states")
+        self.assertEqual(overall["states_in_series"], 1)
+        self.assertEqual(overall["trend"], "stable")
+
+    async def test_sums_are_scaled_by_coverage_without_complete_states(self):
+        result = await self.forecast([
+            [100, 100, 100, 100, 100, NAN],
+            [NAN, 100, 100, 100, 100, 100],
+        ])
+        overall = result["overall"]
+        self.assertEqual(overall["basis"], "coverage_scaled")
+        self.assertAlmostEqual(overall["slope_per_year"], 0.0, places=6)
+
+
+if __name__ == "__main__":
+    unittest.main()